@@ -0,0 +1,206 @@
+"""
+Typo- and transliteration-tolerant artist name index.
+
+Artist names from parsed tracks are reduced to a phonetic Latin key
+("Мияги" and "Miyagi" both become "miagi") and indexed SymSpell-style:
+every deletion of the key prefix (up to MAX_EDIT_DISTANCE characters) points
+back to the key. A query is resolved by generating its own deletions, looking
+up candidates in the dictionary and verifying them with an edit distance, so
+artist queries resolve to canonical names without touching Hitmo.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+try:
+    from backend.database import TrackRecord, SessionLocal
+except ImportError:
+    from database import TrackRecord, SessionLocal
+
+# Configuration
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7  # SymSpell prefix: deletions are generated for the first N chars only
+MIN_KEY_LENGTH = 2
+FUZZY_MIN_KEY_LENGTH = 4  # keys of this length or shorter are matched exactly
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Ukrainian / Belarusian letters that show up in artist names
+    'і': 'i', 'ї': 'i', 'є': 'e', 'ґ': 'g', 'ў': 'u',
+}
+
+# Spelling variants that differ between romanizations, applied in order
+PHONETIC_RULES = [
+    ('dzh', 'dj'), ('j', 'dj'), ('ddj', 'dj'),
+    ('kh', 'h'), ('ck', 'k'), ('q', 'k'), ('c', 'k'), ('ph', 'f'),
+    ('w', 'v'), ('x', 'ks'), ('y', 'i'),
+]
+
+ARTIST_SEPARATORS = re.compile(r"\s*(?:,|&|/|\+|\bfeat\.?|\bft\.?|\bx\b|\bvs\.?)\s*", re.IGNORECASE)
+
+
+class ArtistMatch(NamedTuple):
+    name: str  # canonical display name
+    key: str
+    distance: int
+
+
+def normalize(name: str) -> str:
+    name = name.lower().replace('ё', 'е')
+    name = re.sub(r"[^\w\s]", " ", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def make_key(name: str) -> str:
+    """
+    Phonetic Latin key: transliterated, romanization variants unified,
+    spaces and doubled letters removed.
+    """
+    latin = "".join(TRANSLIT.get(ch, ch) for ch in normalize(name))
+    for source, target in PHONETIC_RULES:
+        latin = latin.replace(source, target)
+    latin = latin.replace(" ", "")
+    return re.sub(r"(.)\1+", r"\1", latin)
+
+
+def split_artists(artist: str) -> List[str]:
+    """'Miyagi & Andy Panda feat. Kyivstoner' -> ['Miyagi', 'Andy Panda', 'Kyivstoner']"""
+    return [part.strip() for part in ARTIST_SEPARATORS.split(artist) if part and part.strip()]
+
+
+def _deletes(key: str, max_distance: int) -> Set[str]:
+    prefix = key[:PREFIX_LENGTH]
+    result = {prefix}
+    frontier = {prefix}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for word in frontier:
+            for i in range(len(word)):
+                next_frontier.add(word[:i] + word[i + 1:])
+        result |= next_frontier
+        frontier = next_frontier
+    return result
+
+
+def _max_distance_for(key: str) -> int:
+    # A typo in a short name makes it a different name ("ann" / "anna"): exact only
+    return 0 if len(key) <= FUZZY_MIN_KEY_LENGTH else MAX_EDIT_DISTANCE
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance (Levenshtein + adjacent transpositions).
+    Returns max_distance + 1 as soon as the distance is known to exceed it.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class ArtistIndex:
+    def __init__(self):
+        # key -> display name variants with occurrence counts
+        self._names: Dict[str, Counter] = {}
+        # deletion of key prefix -> keys
+        self._deletes: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, artist: str, count: int = 1) -> None:
+        for name in [artist] + split_artists(artist):
+            key = make_key(name)
+            if len(key) < MIN_KEY_LENGTH:
+                continue
+            if key not in self._names:
+                self._names[key] = Counter()
+                for deletion in _deletes(key, _max_distance_for(key)):
+                    self._deletes.setdefault(deletion, set()).add(key)
+            self._names[key][name] += count
+
+    def add_tracks(self, tracks: Iterable[Dict]) -> None:
+        for track in tracks:
+            artist = track.get("artist")
+            if artist and artist != "Unknown":
+                self.add(artist)
+
+    def canonical_name(self, key: str) -> str:
+        return self._names[key].most_common(1)[0][0]
+
+    def lookup(self, query: str) -> Optional[ArtistMatch]:
+        """
+        Resolves a query to the closest known artist: smallest edit distance
+        first, then the most frequently seen artist.
+        """
+        query_key = make_key(query)
+        if len(query_key) < MIN_KEY_LENGTH:
+            return None
+
+        if query_key in self._names:
+            return ArtistMatch(self.canonical_name(query_key), query_key, 0)
+
+        max_distance = _max_distance_for(query_key)
+        candidates: Set[str] = set()
+        for deletion in _deletes(query_key, max_distance):
+            candidates |= self._deletes.get(deletion, set())
+
+        best = None
+        for key in candidates:
+            distance = edit_distance(query_key, key, max_distance)
+            if distance > max_distance:
+                continue
+            rank = (distance, -sum(self._names[key].values()))
+            if best is None or rank < best[0]:
+                best = (rank, key, distance)
+
+        if best is None:
+            return None
+        _, key, distance = best
+        return ArtistMatch(self.canonical_name(key), key, distance)
+
+
+def artist_matches(query_key: str, artist: str) -> bool:
+    """Substring match on phonetic keys, so spelling and script don't matter"""
+    return query_key in make_key(artist)
+
+
+# Global index, filled from the track registry
+artist_index = ArtistIndex()
+
+
+def build_from_registry() -> None:
+    """
+    Loads artists of all persisted tracks into the global index.
+    """
+    from sqlalchemy import func
+
+    db = SessionLocal()
+    try:
+        rows = db.query(TrackRecord.artist, func.count(TrackRecord.id)).group_by(TrackRecord.artist).all()
+    finally:
+        db.close()
+
+    for artist, count in rows:
+        if artist and artist != "Unknown":
+            artist_index.add(artist, count)
+    print(f"🎤 Artist index built: {len(artist_index)} names")
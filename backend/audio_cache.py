@@ -0,0 +1,412 @@
+"""
+On-disk byte-range audio cache for /api/stream.
+
+Files are split into fixed-size blocks stored under
+AUDIO_CACHE_DIR/<key[:2]>/<key>/<block index>. A Range request is served
+block by block: cached blocks come straight from disk, and runs of missing
+blocks are fetched from upstream with a single Range request and written
+back as they complete. Blocks are evicted least-recently-used once the
+cache exceeds its disk quota; blocks that are being sent are pinned and
+skipped by eviction. Disk writes, eviction and the startup scan run in
+worker threads, off the event loop.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+import anyio
+from starlette.types import Receive, Scope, Send
+
+try:
+    from backend.request_scope import ClosingStreamingResponse
+except ImportError:
+    from request_scope import ClosingStreamingResponse
+
+# Configuration
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "1") == "1"
+# Relative paths are resolved against backend/, whatever the working directory
+AUDIO_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("AUDIO_CACHE_DIR", "audio_cache"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "1024")) * 1024 * 1024
+BLOCK_SIZE = int(os.getenv("AUDIO_CACHE_BLOCK_KB", "256")) * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Statistics
+_stats = {
+    "bytes_from_disk": 0,  # bytes that did not have to be fetched upstream
+    "bytes_from_upstream": 0,
+    "blocks_written": 0,
+    "blocks_evicted": 0,
+    "range_requests": 0
+}
+
+
+class FileSegment(NamedTuple):
+    """A slice of a cached block file, sent with sendfile when possible"""
+    path: str
+    offset: int
+    count: int
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single-range header into inclusive (start, end).
+    Returns None for a missing header, and raises ValueError for
+    unsatisfiable or multi-range headers.
+    """
+    if not range_header:
+        return None
+
+    match = RANGE_RE.match(range_header.strip())
+    if not match:
+        raise ValueError(f"Unsupported range: {range_header}")
+
+    first, last = match.groups()
+    if first == "" and last == "":
+        raise ValueError(f"Unsupported range: {range_header}")
+    if first == "":
+        # Suffix range: last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Unsatisfiable range: {range_header}")
+    return start, end
+
+
+class AudioDiskCache:
+    def __init__(self, root: str, max_bytes: int, block_size: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        # block path -> size, least recently used first
+        self._blocks: "OrderedDict[str, int]" = OrderedDict()
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        # Keys whose upstream has no known size (live streams): never probed again
+        self._uncacheable = set()
+        # block path -> number of responses currently sending it
+        self._pins: Dict[str, int] = {}
+        # key -> block writes in progress (its directory must not be removed)
+        self._writing: Dict[str, int] = {}
+        self.total_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.isdigit():
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, path, stat.st_size))
+        return sorted(found)
+
+    async def load(self) -> None:
+        """Rebuilds the LRU from disk (oldest modification time first) in a worker thread"""
+        found = await anyio.to_thread.run_sync(self._scan)
+        # Blocks written while the scan ran are the most recent ones
+        written = self._blocks
+        self._blocks = OrderedDict((path, size) for _, path, size in found if path not in written)
+        self._blocks.update(written)
+        self.total_bytes = sum(self._blocks.values())
+        print(f"💾 Audio cache loaded: {len(self._blocks)} blocks, {self.total_bytes // (1024 * 1024)} MB")
+        await self._evict()
+
+    @staticmethod
+    def key_for(identity: str) -> str:
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def block_path(self, key: str, index: int) -> str:
+        return os.path.join(self._dir(key), str(index))
+
+    def block_length(self, size: int, index: int) -> int:
+        return min(self.block_size, size - index * self.block_size)
+
+    async def get_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        meta = self._meta.get(key)
+        if meta is None:
+            meta = await anyio.to_thread.run_sync(_read_json, os.path.join(self._dir(key), "meta.json"))
+            if meta is None:
+                return None
+            self._meta[key] = meta
+        return meta
+
+    async def set_meta(self, key: str, size: int, content_type: Optional[str]) -> Dict[str, Any]:
+        meta = {"size": size, "content_type": content_type or "audio/mpeg"}
+        self._meta[key] = meta
+        await anyio.to_thread.run_sync(_write_json, self._dir(key), "meta.json", meta)
+        return meta
+
+    def mark_uncacheable(self, key: str) -> None:
+        self._uncacheable.add(key)
+
+    def is_uncacheable(self, key: str) -> bool:
+        return key in self._uncacheable
+
+    def has_block(self, key: str, index: int) -> bool:
+        path = self.block_path(key, index)
+        if path in self._blocks:
+            self._blocks.move_to_end(path)
+            return True
+        return False
+
+    def first_missing(self, key: str, size: int, start: int, end: int) -> Optional[int]:
+        """Returns the first byte of the first uncached block in [start, end], or None"""
+        for index in range(start // self.block_size, end // self.block_size + 1):
+            if self.block_path(key, index) not in self._blocks:
+                return max(start, index * self.block_size)
+        return None
+
+    async def write_block(self, key: str, index: int, data: bytes) -> None:
+        path = self.block_path(key, index)
+        if path in self._blocks:
+            # Already written by a concurrent request sharing the transfer
+            return
+        self._writing[key] = self._writing.get(key, 0) + 1
+        try:
+            await anyio.to_thread.run_sync(_write_file, path, data)
+        finally:
+            self._writing[key] -= 1
+            if not self._writing[key]:
+                del self._writing[key]
+
+        self.total_bytes += len(data) - self._blocks.pop(path, 0)
+        self._blocks[path] = len(data)
+        _stats["blocks_written"] += 1
+        await self._evict()
+
+    def _pin(self, path: str) -> None:
+        self._pins[path] = self._pins.get(path, 0) + 1
+
+    def _unpin(self, path: str) -> None:
+        self._pins[path] -= 1
+        if not self._pins[path]:
+            del self._pins[path]
+
+    async def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        victims = []
+        for path in list(self._blocks):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if path in self._pins:
+                continue  # being sent right now
+            self.total_bytes -= self._blocks.pop(path)
+            victims.append(path)
+            _stats["blocks_evicted"] += 1
+        if not victims:
+            return
+
+        # Drop the whole entry once its last block is gone
+        remaining = {os.path.dirname(path) for path in self._blocks}
+        directories = {
+            os.path.dirname(path) for path in victims
+            if os.path.dirname(path) not in remaining and os.path.basename(os.path.dirname(path)) not in self._writing
+        }
+        for directory in directories:
+            self._meta.pop(os.path.basename(directory), None)
+        await anyio.to_thread.run_sync(_remove_blocks, victims, directories)
+
+    async def iter_range(
+        self,
+        key: str,
+        size: int,
+        start: int,
+        end: int,
+        fetch: Callable[[int, int], AsyncIterator[bytes]]
+    ) -> AsyncIterator[Union[bytes, FileSegment]]:
+        """
+        Yields the inclusive byte range [start, end] as FileSegments for cached
+        blocks and as bytes for gaps, which fetch(gap_start, gap_end) fills
+        from upstream. Completed gap blocks are written to the cache.
+        """
+        _stats["range_requests"] += 1
+        first = start // self.block_size
+        last = end // self.block_size
+        index = first
+
+        while index <= last:
+            block_start = index * self.block_size
+            if self.has_block(key, index):
+                offset = max(start - block_start, 0)
+                stop = min(end - block_start, self.block_length(size, index) - 1)
+                _stats["bytes_from_disk"] += stop - offset + 1
+                path = self.block_path(key, index)
+                # The consumer reads the file before asking for the next part
+                self._pin(path)
+                try:
+                    yield FileSegment(path, offset, stop - offset + 1)
+                finally:
+                    self._unpin(path)
+                index += 1
+                continue
+
+            # Contiguous run of missing blocks -> one upstream range request
+            gap_last = index
+            while gap_last < last and not self.has_block(key, gap_last + 1):
+                gap_last += 1
+            gap_start = block_start
+            gap_end = min((gap_last + 1) * self.block_size, size) - 1
+
+            position = gap_start
+            pending = bytearray()
+            async for chunk in fetch(gap_start, gap_end):
+                _stats["bytes_from_upstream"] += len(chunk)
+                pending += chunk
+
+                # Bytes of this chunk that the client asked for
+                chunk_start = position
+                position += len(chunk)
+                lo = max(start, chunk_start)
+                hi = min(end + 1, position)
+                if lo < hi:
+                    yield bytes(chunk[lo - chunk_start:hi - chunk_start])
+
+                while index <= gap_last:
+                    length = self.block_length(size, index)
+                    if len(pending) < length:
+                        break
+                    await self.write_block(key, index, bytes(pending[:length]))
+                    del pending[:length]
+                    index += 1
+
+            if position <= gap_end:
+                raise IOError(f"Upstream ended at byte {position}, expected {gap_end + 1}")
+            index = gap_last + 1
+
+
+    async def read_range(
+        self,
+        key: str,
+        size: int,
+        start: int,
+        end: int,
+        fetch: Callable[[int, int], AsyncIterator[bytes]]
+    ) -> bytes:
+        """
+        Returns the inclusive byte range [start, end] as one bytes object,
+        filling gaps through fetch like iter_range.
+        """
+        data = bytearray()
+        async for part in self.iter_range(key, size, start, end, fetch):
+            if isinstance(part, FileSegment):
+                part = await anyio.to_thread.run_sync(_read_segment, part)
+            data += part
+        return bytes(data)
+
+
+class CachedRangeResponse(ClosingStreamingResponse):
+    """
+    Streaming response whose body iterator may yield FileSegments. They are
+    sent through the ASGI zero-copy extension (sendfile) when the server
+    offers it, and read from disk in a worker thread otherwise.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for part in self.body_iterator:
+            if isinstance(part, FileSegment):
+                if self._zerocopy:
+                    with open(part.path, "rb") as f:
+                        await send({
+                            "type": "http.response.zerocopysend",
+                            "file": f.fileno(),
+                            "offset": part.offset,
+                            "count": part.count,
+                            "more_body": True
+                        })
+                    continue
+                part = await anyio.to_thread.run_sync(_read_segment, part)
+            await send({"type": "http.response.body", "body": part, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _read_segment(segment: FileSegment) -> bytes:
+    with open(segment.path, "rb") as f:
+        f.seek(segment.offset)
+        return f.read(segment.count)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(directory: str, name: str, data: Dict[str, Any]) -> None:
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), "w") as f:
+        json.dump(data, f)
+
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remove_blocks(paths: List[str], directories: Set[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    for directory in directories:
+        try:
+            os.remove(os.path.join(directory, "meta.json"))
+        except OSError:
+            pass
+        try:
+            # Fails if a block was written in the meantime - then the entry stays
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+# Global cache instance (None when disabled)
+audio_cache: Optional[AudioDiskCache] = None
+if AUDIO_CACHE_ENABLED:
+    try:
+        audio_cache = AudioDiskCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, BLOCK_SIZE)
+    except OSError as e:
+        print(f"❌ Audio cache disabled: {e}")
+
+
+def get_audio_cache_stats() -> Dict[str, Any]:
+    """
+    Returns current audio cache statistics.
+    """
+    return {
+        "enabled": audio_cache is not None,
+        "disk_usage_bytes": audio_cache.total_bytes if audio_cache else 0,
+        "disk_quota_bytes": AUDIO_CACHE_MAX_BYTES,
+        "cached_blocks": len(audio_cache._blocks) if audio_cache else 0,
+        "pinned_blocks": len(audio_cache._pins) if audio_cache else 0,
+        "block_size": BLOCK_SIZE,
+        "bytes_saved": _stats["bytes_from_disk"],
+        **_stats
+    }
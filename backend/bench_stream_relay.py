@@ -0,0 +1,119 @@
+"""
+Stream relay benchmark against a local fake CDN.
+
+Starts a fake CDN (uvicorn, separate process) serving a FILE_MB file, then
+reads it through the same upstream path /api/stream uses, with N concurrent
+streams. Compares httpx's default aiter_bytes() with the relay's raw
+passthrough and with raw reads coalesced into --chunk-kb chunks, and reports
+throughput and client-side CPU time per stream.
+
+Usage (from backend/):
+    python bench_stream_relay.py [--concurrency 1,4,16] [--file-mb 8] [--chunk-kb 256]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+PORT = 8765
+
+
+def serve(file_mb: int) -> None:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import Response
+    from starlette.routing import Route
+
+    body = os.urandom(file_mb * 1024 * 1024)
+
+    async def audio(request):
+        return Response(body, media_type="audio/mpeg")
+
+    app = Starlette(routes=[Route("/track.mp3", audio)])
+    uvicorn.run(app, host="127.0.0.1", port=PORT, log_level="warning")
+
+
+async def wait_for_cdn(url: str) -> None:
+    async with httpx.AsyncClient() as client:
+        for _ in range(50):
+            try:
+                await client.head(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("Fake CDN did not start")
+
+
+async def run_streams(url: str, concurrency: int, chunk_size) -> dict:
+    """chunk_size: "default" for aiter_bytes(), None for raw passthrough, or bytes per chunk"""
+    import stream_relay
+    from stream_upstream import open_upstream
+
+    stream_relay.RELAY_CHUNK_SIZE = chunk_size if chunk_size != "default" else None
+
+    async def one_stream() -> int:
+        started = time.monotonic()
+        client, r = await open_upstream(url)
+        received = 0
+        try:
+            body = r.aiter_bytes() if chunk_size == "default" else stream_relay.relay_body(r, started)
+            async for chunk in body:
+                received += len(chunk)
+        finally:
+            await r.aclose()
+            await client.aclose()
+        return received
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    sizes = await asyncio.gather(*(one_stream() for _ in range(concurrency)))
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    total_mb = sum(sizes) / (1024 * 1024)
+    return {
+        "mb_per_s": total_mb / wall,
+        "cpu_ms_per_stream": cpu * 1000 / concurrency,
+        "cpu_ms_per_mb": cpu * 1000 / total_mb
+    }
+
+
+async def benchmark(levels, file_mb: int, chunk_kb: int) -> None:
+    url = f"http://127.0.0.1:{PORT}/track.mp3"
+    await wait_for_cdn(url)
+
+    modes = [("default", "default"), ("raw", None), (f"raw-{chunk_kb}k", chunk_kb * 1024)]
+    print(f"--- Relay benchmark: {file_mb} MB file ---")
+    print(f"{'streams':>8} {'mode':>10} {'MB/s':>10} {'CPU ms/stream':>15} {'CPU ms/MB':>11}")
+    for concurrency in levels:
+        for name, chunk_size in modes:
+            result = await run_streams(url, concurrency, chunk_size)
+            print(f"{concurrency:>8} {name:>10} {result['mb_per_s']:>10.1f} "
+                  f"{result['cpu_ms_per_stream']:>15.1f} {result['cpu_ms_per_mb']:>11.2f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--concurrency", default="1,4,16")
+    arg_parser.add_argument("--file-mb", type=int, default=8)
+    arg_parser.add_argument("--chunk-kb", type=int, default=256)
+    arg_parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.serve:
+        serve(args.file_mb)
+        sys.exit(0)
+
+    # No proxies for the local CDN
+    os.environ["PROXY_LIST"] = ""
+    cdn = subprocess.Popen([sys.executable, __file__, "--serve", "--file-mb", str(args.file_mb)])
+    try:
+        asyncio.run(benchmark([int(n) for n in args.concurrency.split(",")], args.file_mb, args.chunk_kb))
+    finally:
+        cdn.terminate()
+        cdn.wait()
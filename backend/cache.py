@@ -1,17 +1,26 @@
+import os
 import time
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Optional, Set, Tuple
 
 # Configuration
 TTL = 60  # seconds
+# Prefetched pages wait for the user to scroll, so they are kept longer
+PREFETCH_TTL = int(os.getenv("CACHE_PREFETCH_TTL", "600"))
 
 # Storage
 # Format: key -> (expires_at_timestamp, data)
 _cache: Dict[str, Tuple[float, Any]] = {}
 
+# Keys stored by background prefetch and not yet requested by a client
+_prefetched: Set[str] = set()
+
 # Statistics
 _stats = {
     "hits": 0,
-    "misses": 0
+    "misses": 0,
+    "prefetch_stored": 0,
+    "prefetch_hits": 0,
+    "prefetch_expired": 0
 }
 
 def make_cache_key(path: str, params: Dict[str, Any]) -> str:
@@ -34,22 +43,42 @@ def get_from_cache(key: str) -> Optional[Any]:
         expires_at, data = _cache[key]
         if current_time < expires_at:
             _stats["hits"] += 1
+            if key in _prefetched:
+                _prefetched.discard(key)
+                _stats["prefetch_hits"] += 1
             return data
         else:
             # Expired
             del _cache[key]
+            if key in _prefetched:
+                _prefetched.discard(key)
+                _stats["prefetch_expired"] += 1
             _stats["misses"] += 1
             return None
     
     _stats["misses"] += 1
     return None
 
-def set_to_cache(key: str, data: Any) -> None:
+def set_to_cache(key: str, data: Any, prefetched: bool = False) -> None:
     """
     Saves data to cache with the configured TTL.
+    Entries stored by background prefetch get PREFETCH_TTL and are tracked
+    to measure prefetch hits.
     """
-    expires_at = time.time() + TTL
+    expires_at = time.time() + (PREFETCH_TTL if prefetched else TTL)
     _cache[key] = (expires_at, data)
+    if prefetched:
+        _prefetched.add(key)
+        _stats["prefetch_stored"] += 1
+    else:
+        _prefetched.discard(key)
+
+def is_cached(key: str) -> bool:
+    """
+    Checks for a fresh entry without touching hit/miss statistics.
+    """
+    entry = _cache.get(key)
+    return entry is not None and time.time() < entry[0]
 
 def get_cache_stats() -> Dict[str, Any]:
     """
@@ -61,6 +90,9 @@ def get_cache_stats() -> Dict[str, Any]:
     total_requests = hits + misses
     hit_ratio = (hits / total_requests) if total_requests > 0 else 0
     
+    prefetch_stored = _stats["prefetch_stored"]
+    prefetch_hit_ratio = (_stats["prefetch_hits"] / prefetch_stored) if prefetch_stored > 0 else 0
+    
     # Get first 5 keys for debugging
     sample_keys = list(_cache.keys())[:5]
     
@@ -69,7 +101,12 @@ def get_cache_stats() -> Dict[str, Any]:
         "cache_hits": hits,
         "cache_misses": misses,
         "hit_ratio": round(hit_ratio, 4),
+        "prefetch_stored": prefetch_stored,
+        "prefetch_hits": _stats["prefetch_hits"],
+        "prefetch_expired": _stats["prefetch_expired"],
+        "prefetch_hit_ratio": round(prefetch_hit_ratio, 4),
         "ttl_seconds": TTL,
+        "prefetch_ttl_seconds": PREFETCH_TTL,
         "sample_keys": sample_keys
     }
 
@@ -78,5 +115,6 @@ def reset_cache() -> None:
     Clears the cache and resets statistics.
     """
     _cache.clear()
-    _stats["hits"] = 0
-    _stats["misses"] = 0
+    _prefetched.clear()
+    for stat in _stats:
+        _stats[stat] = 0
@@ -81,6 +81,48 @@ class Referral(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)  # When referral made first purchase
 
+class TrackRecord(Base):
+    __tablename__ = "tracks"
+
+    id = Column(String, primary_key=True, index=True)  # Hitmo data-track-id or yt_<video_id>
+    title = Column(String)
+    artist = Column(String, index=True)
+    duration = Column(Integer, default=0)
+    url = Column(String)  # Original upstream URL (not the /api/stream proxy URL)
+    image = Column(String, nullable=True)
+    source = Column(String, default="hitmo")  # hitmo, youtube
+    url_resolved_at = Column(DateTime, default=datetime.utcnow)  # When url was last known to be fresh
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DownloadJob(Base):
+    __tablename__ = "download_jobs"
+
+    id = Column(String, primary_key=True, index=True)  # uuid hex
+    user_id = Column(Integer, index=True)
+    track_id = Column(String, index=True)  # "batch:<hash of track ids>" for batches
+    kind = Column(String, default="track")  # track, batch
+    track_json = Column(String)  # Track payload as sent by the client (list of tracks for a batch)
+    items_done = Column(Integer, default=0)  # Batch: tracks delivered so far, in order
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+    message_id = Column(Integer, nullable=True)  # Telegram message with the audio
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class TelegramFile(Base):
+    __tablename__ = "telegram_files"
+
+    track_id = Column(String, primary_key=True, index=True)
+    file_id = Column(String)  # audio.file_id returned by sendAudio, reusable by this bot
+    file_unique_id = Column(String, nullable=True)
+    thumbnail_file_id = Column(String, nullable=True)
+    file_size = Column(Integer, default=0)
+    uses = Column(Integer, default=0)  # Sends by file_id
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
 
 
 def init_db():
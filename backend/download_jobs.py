@@ -0,0 +1,257 @@
+"""
+Download-to-chat job queue.
+
+POST /api/download/chat stores a job in the download_jobs table and returns
+at once; a pool of WORKERS tasks performs the deliveries. Jobs are durable:
+on startup, queued jobs and jobs that were running when the process stopped
+are queued again. Failed jobs are retried up to MAX_ATTEMPTS times with a
+growing delay. A second request for the same (user, track) while a job is
+pending, or shortly after it finished, returns the existing job instead of
+sending the track twice.
+
+A batch (playlist or album) is one job of kind "batch". Its tracks are
+delivered in order and items_done records how many were sent, so a retried
+or resumed batch continues after the last delivered track.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+try:
+    from backend.database import DownloadJob, SessionLocal
+except ImportError:
+    from database import DownloadJob, SessionLocal
+
+# Configuration
+WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))
+MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_JOB_ATTEMPTS", "3"))
+DEDUP_SECONDS = int(os.getenv("DOWNLOAD_JOB_DEDUP_SECONDS", "60"))  # finished jobs still answer repeat taps
+RETENTION_DAYS = int(os.getenv("DOWNLOAD_JOB_RETENTION_DAYS", "7"))
+RETRY_DELAY = 10  # seconds, multiplied by the attempt number
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# (db, job, progress) -> id of the last Telegram message sent.
+# progress is the job's live progress dict, which the handler updates.
+JobHandler = Callable[[Session, DownloadJob, Dict[str, Any]], Awaitable[Optional[int]]]
+
+# Storage
+_queue: "asyncio.Queue[str]" = asyncio.Queue()
+# Format: job_id -> {stage, bytes_sent, bytes_total} while the job runs
+_progress: Dict[str, Dict[str, Any]] = {}
+
+# Statistics
+_stats = {
+    "enqueued": 0,
+    "deduplicated": 0,
+    "completed": 0,
+    "retried": 0,
+    "failed": 0,
+    "resumed": 0  # picked up again after a restart
+}
+
+
+def enqueue(db: Session, user_id: int, track: Dict[str, Any]) -> Tuple[DownloadJob, bool]:
+    """
+    Queues delivery of the track to the user's chat.
+    Returns (job, created); created is False for a deduplicated request.
+    """
+    return _enqueue(db, user_id, track["id"], "track", track)
+
+
+def enqueue_batch(db: Session, user_id: int, tracks: List[Dict[str, Any]]) -> Tuple[DownloadJob, bool]:
+    """
+    Queues ordered delivery of several tracks. The same track list is
+    deduplicated like a single track.
+    """
+    digest = hashlib.sha1("\n".join(track["id"] for track in tracks).encode("utf-8")).hexdigest()[:16]
+    return _enqueue(db, user_id, f"batch:{digest}", "batch", tracks)
+
+
+def _enqueue(db: Session, user_id: int, track_id: str, kind: str, payload: Any) -> Tuple[DownloadJob, bool]:
+    recent = datetime.utcnow() - timedelta(seconds=DEDUP_SECONDS)
+    existing = db.query(DownloadJob).filter(
+        DownloadJob.user_id == user_id,
+        DownloadJob.track_id == track_id,
+        or_(
+            DownloadJob.status.in_(ACTIVE_STATUSES),
+            and_(DownloadJob.status == "done", DownloadJob.finished_at >= recent)
+        )
+    ).order_by(DownloadJob.created_at.desc()).first()
+    if existing:
+        _stats["deduplicated"] += 1
+        return existing, False
+
+    job = DownloadJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        track_id=track_id,
+        kind=kind,
+        track_json=json.dumps(payload, ensure_ascii=False),
+        items_done=0,
+        status="queued"
+    )
+    db.add(job)
+    db.commit()
+    _queue.put_nowait(job.id)
+    _stats["enqueued"] += 1
+    return job, True
+
+
+def get_job(db: Session, job_id: str) -> Optional[DownloadJob]:
+    return db.query(DownloadJob).filter(DownloadJob.id == job_id).first()
+
+
+def job_to_dict(db: Session, job: DownloadJob) -> Dict[str, Any]:
+    result = {
+        "job_id": job.id,
+        "kind": job.kind or "track",
+        "track_id": job.track_id,
+        "status": job.status,
+        "attempts": job.attempts or 0,
+        "error": job.error,
+        "message_id": job.message_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+    if job.status == "queued":
+        result["queue_position"] = db.query(DownloadJob).filter(
+            DownloadJob.status == "queued",
+            DownloadJob.created_at < job.created_at
+        ).count()
+    if job.kind == "batch":
+        result["tracks_total"] = len(json.loads(job.track_json))
+        result["tracks_sent"] = job.items_done or 0
+    progress = _progress.get(job.id)
+    if progress:
+        if progress.get("tracks_total"):
+            percent = round(progress["tracks_sent"] * 100 / progress["tracks_total"])
+        elif progress.get("bytes_total"):
+            percent = round(progress["bytes_sent"] * 100 / progress["bytes_total"])
+        else:
+            percent = None
+        result["progress"] = {**progress, "percent": percent}
+    return result
+
+
+async def _perform(job_id: str, handlers: Dict[str, JobHandler]) -> None:
+    db = SessionLocal()
+    try:
+        job = get_job(db, job_id)
+        if not job or job.status != "queued":
+            return  # already taken by another worker or finished
+
+        job.status = "running"
+        job.attempts = (job.attempts or 0) + 1
+        job.updated_at = datetime.utcnow()
+        db.commit()
+
+        progress = _progress[job_id] = {"stage": "preparing"}
+
+        try:
+            message_id = await handlers[job.kind or "track"](db, job, progress)
+        except asyncio.CancelledError:
+            # Shutdown: the job stays "running" and is resumed on the next start
+            raise
+        except Exception as e:
+            db.rollback()
+            job.error = str(e)[:500]
+            job.updated_at = datetime.utcnow()
+            if job.attempts < MAX_ATTEMPTS:
+                job.status = "queued"
+                _stats["retried"] += 1
+                delay = RETRY_DELAY * job.attempts
+                asyncio.get_running_loop().call_later(delay, _queue.put_nowait, job_id)
+                print(f"Download job {job_id} failed (attempt {job.attempts}), retry in {delay}s: {e}")
+            else:
+                job.status = "failed"
+                job.finished_at = datetime.utcnow()
+                _stats["failed"] += 1
+                print(f"❌ Download job {job_id} failed: {e}")
+            db.commit()
+            return
+
+        job.status = "done"
+        job.message_id = message_id
+        job.error = None
+        job.updated_at = job.finished_at = datetime.utcnow()
+        db.commit()
+        _stats["completed"] += 1
+    finally:
+        _progress.pop(job_id, None)
+        db.close()
+
+
+async def _worker(handlers: Dict[str, JobHandler]) -> None:
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _perform(job_id, handlers)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error in download worker: {e}")
+
+
+def _restore() -> None:
+    """Queues jobs left over from the previous run and drops old finished ones"""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+        db.query(DownloadJob).filter(
+            DownloadJob.status.in_(("done", "failed")),
+            DownloadJob.finished_at < cutoff
+        ).delete(synchronize_session=False)
+
+        pending = db.query(DownloadJob).filter(
+            DownloadJob.status.in_(ACTIVE_STATUSES)
+        ).order_by(DownloadJob.created_at).all()
+        for job in pending:
+            # "running" means the process stopped mid-delivery
+            job.status = "queued"
+            _queue.put_nowait(job.id)
+        db.commit()
+        if pending:
+            _stats["resumed"] += len(pending)
+            print(f"📥 Download queue: resumed {len(pending)} jobs")
+    finally:
+        db.close()
+
+
+async def run(handlers: Dict[str, JobHandler]) -> None:
+    """
+    Worker pool; handlers maps job kind to its handler.
+    Runs until cancelled; unfinished jobs survive in the database.
+    """
+    print(f"🔄 Download job queue started ({WORKERS} workers)")
+    _restore()
+    workers = [asyncio.create_task(_worker(handlers)) for _ in range(WORKERS)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+
+def get_download_job_stats(db: Session) -> Dict[str, Any]:
+    """
+    Returns job queue statistics.
+    """
+    counts = {status: 0 for status in ("queued", "running", "done", "failed")}
+    for status, count in db.query(DownloadJob.status, func.count(DownloadJob.id)).group_by(DownloadJob.status).all():
+        counts[status] = count
+    return {
+        "workers": WORKERS,
+        "max_attempts": MAX_ATTEMPTS,
+        "in_queue": _queue.qsize(),
+        "jobs": counts,
+        **_stats
+    }
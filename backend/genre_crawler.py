@@ -0,0 +1,188 @@
+"""
+Background genre catalog crawler.
+
+Discovers the Hitmo genre list and keeps the first CRAWL_PAGES pages of every
+genre fresh on a staggered schedule, so /api/genre/{id} can be answered
+without waiting on Hitmo. Pages are fetched conditionally (ETag /
+Last-Modified); when the server ignores those, a content hash of the body and
+a fingerprint of the parsed tracks let unchanged pages skip reparsing and
+cover lookups.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configuration
+CRAWLER_ENABLED = os.getenv("GENRE_CRAWLER_ENABLED", "1") == "1"
+CRAWL_PAGES = int(os.getenv("GENRE_CRAWLER_PAGES", "2"))  # first K pages of each genre
+REFRESH_INTERVAL = int(os.getenv("GENRE_CRAWLER_INTERVAL", "1800"))  # seconds for one full pass
+GENRE_LIST_TTL = int(os.getenv("GENRE_CRAWLER_LIST_TTL", str(6 * 3600)))
+PAGE_SIZE = 48  # Hitmo's native page size
+MAX_PAGE_AGE = REFRESH_INTERVAL * 3  # crawled pages older than this are not served
+
+# Storage
+# Format: (genre_id, page_index) -> page entry
+_pages: Dict[Tuple[int, int], Dict[str, Any]] = {}
+_genres: List[Dict[str, Any]] = []
+_genres_fetched_at = 0.0
+
+# Statistics
+_stats = {
+    "pages_fetched": 0,
+    "not_modified": 0,
+    "unchanged_body": 0,
+    "unchanged_tracks": 0,
+    "pages_parsed": 0,
+    "errors": 0,
+    "served": 0
+}
+
+
+def _fingerprint(tracks: List[Dict[str, Any]]) -> str:
+    """Identity of a parsed page, ignoring covers"""
+    digest = hashlib.sha1()
+    for track in tracks:
+        digest.update(f"{track['id']}|{track['title']}|{track['artist']}|{track['url']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def _refresh_genre_list(parser) -> None:
+    global _genres, _genres_fetched_at
+    try:
+        genres = await parser.get_genres()
+        if genres:
+            _genres = genres
+            _genres_fetched_at = time.time()
+            print(f"🗂️ Genre crawler: discovered {len(genres)} genres")
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"❌ Genre crawler: failed to fetch genre list: {e}")
+
+
+async def refresh_page(parser, genre_id: int, page_index: int, on_tracks=None) -> None:
+    """
+    Refreshes one stored page. on_tracks(tracks) is called with freshly parsed
+    tracks (e.g. to register them in the track registry).
+    """
+    key = (genre_id, page_index)
+    previous = _pages.get(key)
+
+    response = await parser.fetch_genre_page(
+        genre_id,
+        start=page_index * PAGE_SIZE,
+        etag=previous.get("etag") if previous else None,
+        last_modified=previous.get("last_modified") if previous else None
+    )
+    _stats["pages_fetched"] += 1
+    now = time.time()
+
+    if response.status_code == 304 and previous:
+        _stats["not_modified"] += 1
+        previous["fetched_at"] = now
+        return
+
+    content_hash = hashlib.sha1(response.content).hexdigest()
+    if previous and previous["content_hash"] == content_hash:
+        _stats["unchanged_body"] += 1
+        previous["fetched_at"] = now
+        return
+
+    parsed = parser.parse_tracks_html(response.text, PAGE_SIZE)
+    _stats["pages_parsed"] += 1
+    fingerprint = _fingerprint(parsed)
+
+    if previous and previous["fingerprint"] == fingerprint:
+        # Only page chrome changed: keep the already resolved covers
+        _stats["unchanged_tracks"] += 1
+        tracks = previous["tracks"]
+    else:
+        tracks = await parser.resolve_covers(parsed)
+        if on_tracks:
+            on_tracks(tracks)
+
+    _pages[key] = {
+        "tracks": tracks,
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "content_hash": content_hash,
+        "fingerprint": fingerprint,
+        "fetched_at": now
+    }
+
+
+def get_crawled_tracks(genre_id: int, limit: int, page: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Serves a (limit, page) window from crawled pages.
+    Returns None if the window is not fully covered by fresh crawled data.
+    """
+    offset = (page - 1) * limit
+    end = offset + limit
+    first_index = offset // PAGE_SIZE
+    last_index = (end - 1) // PAGE_SIZE
+    if last_index >= CRAWL_PAGES:
+        return None
+
+    now = time.time()
+    tracks: List[Dict[str, Any]] = []
+    for page_index in range(first_index, last_index + 1):
+        entry = _pages.get((genre_id, page_index))
+        if entry is None or now - entry["fetched_at"] > MAX_PAGE_AGE:
+            return None
+        tracks.extend(entry["tracks"])
+        if len(entry["tracks"]) < PAGE_SIZE:
+            break  # last page of the genre
+
+    start = offset - first_index * PAGE_SIZE
+    _stats["served"] += 1
+    # Copies, so callers can rewrite URLs without touching the store
+    return [dict(track) for track in tracks[start:start + limit]]
+
+
+async def run(parser, on_tracks=None) -> None:
+    """
+    Crawler loop. One pass over all (genre, page) jobs takes REFRESH_INTERVAL
+    seconds; jobs are spaced evenly so Hitmo sees a steady trickle.
+    """
+    print("🔄 Genre crawler started")
+    while True:
+        try:
+            if not _genres or time.time() - _genres_fetched_at > GENRE_LIST_TTL:
+                await _refresh_genre_list(parser)
+
+            jobs = [(genre["id"], page_index) for page_index in range(CRAWL_PAGES) for genre in _genres]
+            if not jobs:
+                await asyncio.sleep(60)
+                continue
+
+            delay = REFRESH_INTERVAL / len(jobs)
+            for genre_id, page_index in jobs:
+                try:
+                    await refresh_page(parser, genre_id, page_index, on_tracks)
+                except Exception as e:
+                    _stats["errors"] += 1
+                    print(f"❌ Genre crawler: genre {genre_id} page {page_index}: {e}")
+                await asyncio.sleep(delay)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["errors"] += 1
+            print(f"❌ Error in genre crawler: {e}")
+            await asyncio.sleep(60)
+
+
+def get_crawler_stats() -> Dict[str, Any]:
+    """
+    Returns current crawler statistics.
+    """
+    return {
+        "enabled": CRAWLER_ENABLED,
+        "genres": len(_genres),
+        "stored_pages": len(_pages),
+        "pages_per_genre": CRAWL_PAGES,
+        "refresh_interval_seconds": REFRESH_INTERVAL,
+        **_stats
+    }
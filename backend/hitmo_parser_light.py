@@ -6,6 +6,9 @@ import urllib.parse
 import asyncio
 import os
 import random
+import hashlib
+import time
+from collections import deque
 
 class HitmoParser:
     """
@@ -17,11 +20,20 @@ class HitmoParser:
     BASE_URL = "https://rus.hitmotop.com"
     SEARCH_URL = f"{BASE_URL}/search"
     
+    # Chart pages used for the home feed shelves
+    CHART_PATHS = {
+        'trending': '/songs/top-today',
+        'recent': '/songs/new',
+    }
+    
     def __init__(self):
         # Load proxy list from environment
         proxy_list_str = os.getenv("PROXY_LIST", "")
         self.proxy_list = [p.strip() for p in proxy_list_str.split(",") if p.strip()]
         
+        # Timestamps of recent upstream failures (Hitmo or proxy errors)
+        self._error_times = deque(maxlen=100)
+        
         # Default headers (fallback)
         self.default_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -36,6 +48,17 @@ class HitmoParser:
             return None
         return random.choice(self.proxy_list)
     
+    @staticmethod
+    def _generate_track_id(artist: str, title: str) -> str:
+        """Stable fallback ID (built-in hash() is salted per process)"""
+        digest = hashlib.md5(f"{artist}{title}".encode('utf-8')).hexdigest()[:16]
+        return f"gen_{int(digest, 16)}"
+    
+    def upstream_pressure(self, window: float = 60.0, threshold: int = 3) -> bool:
+        """True if Hitmo or the proxies failed at least `threshold` times within `window` seconds"""
+        since = time.time() - window
+        return sum(1 for t in self._error_times if t >= since) >= threshold
+    
     def _prepare_headers(self, user_agent: Optional[str] = None) -> dict:
         """Prepare headers with custom user agent if provided"""
         headers = self.default_headers.copy()
@@ -58,107 +81,131 @@ class HitmoParser:
                 'q': query,
                 'start': (page - 1) * limit # Use limit for offset calculation
             }
-            
-            # Prepare headers with custom user agent
-            headers = self._prepare_headers(user_agent)
-            
-            # Get random proxy if available
-            proxy = self._get_random_proxy()
-            proxies = {"http://": proxy, "https://": proxy} if proxy else None
-            
-            async with httpx.AsyncClient(
-                headers=headers, 
-                timeout=10.0,
-                proxies=proxies
-            ) as client:
-                response = await client.get(self.SEARCH_URL, params=params)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                tracks_data = []
+            # Поиск, как и раньше, без перехода по редиректам
+            return await self._fetch_listing(self.SEARCH_URL, params, limit, user_agent, follow_redirects=False)
                 
-                track_elements = soup.select('.tracks__item')
-                
-                # 1. Parse basic info
-                for el in track_elements:
-                    if len(tracks_data) >= limit:
-                        break
-                        
-                    try:
-                        title_el = el.select_one('.track__title')
-                        artist_el = el.select_one('.track__desc')
-                        time_el = el.select_one('.track__fulltime')
-                        download_el = el.select_one('a.track__download-btn')
-                        cover_el = el.select_one('.track__img')
-                        
-                        if not (title_el and download_el):
-                            continue
-                            
-                        title = title_el.text.strip()
-                        artist = artist_el.text.strip() if artist_el else "Unknown"
-                        duration_str = time_el.text.strip() if time_el else "00:00"
-                        
-                        try:
-                            mins, secs = map(int, duration_str.split(':'))
-                            duration = mins * 60 + secs
-                        except:
-                            duration = 0
-                            
-                        url = download_el.get('href')
-                        if not url:
-                            continue
-                            
-                        track_id = el.get('data-track-id')
-                        if not track_id:
-                            track_id = f"gen_{abs(hash(artist + title))}"
-                            
-                        # Extract fallback cover from style
-                        fallback_image = None
-                        if cover_el:
-                            style = cover_el.get('style', '')
-                            match = re.search(r"url\(['\"]?(.*?)['\"]?\)", style)
-                            if match:
-                                fallback_image = match.group(1)
-                        
-                        tracks_data.append({
-                            'id': track_id,
-                            'title': title,
-                            'artist': artist,
-                            'duration': duration,
-                            'url': url,
-                            'fallback_image': fallback_image,
-                            'image': None # Will be filled later
-                        })
-                        
-                    except Exception as e:
-                        print(f"Error parsing track: {e}")
-                        continue
+        except Exception as e:
+            print(f"Search error: {e}")
+            self._error_times.append(time.time())
+            return []
+
+    def _get_proxies(self) -> Optional[dict]:
+        """Get random proxy mapping for httpx if proxies are configured"""
+        proxy = self._get_random_proxy()
+        return {"http://": proxy, "https://": proxy} if proxy else None
+
+    async def _fetch_listing(
+        self,
+        url: str,
+        params: dict,
+        limit: int,
+        user_agent: Optional[str] = None,
+        follow_redirects: bool = True
+    ) -> List[Dict]:
+        """
+        Fetch a Hitmo track listing page (search, genre, chart) and resolve covers
+        """
+        async with httpx.AsyncClient(
+            headers=self._prepare_headers(user_agent), 
+            timeout=10.0,
+            follow_redirects=follow_redirects,
+            proxies=self._get_proxies()
+        ) as client:
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+            
+            tracks_data = self.parse_tracks_html(response.text, limit)
+            return await self.attach_covers(client, tracks_data)
+
+    def parse_tracks_html(self, html: str, limit: int) -> List[Dict]:
+        """
+        Parse basic track info from a listing page.
+        Returned tracks carry 'fallback_image' until attach_covers() is called.
+        """
+        soup = BeautifulSoup(html, 'html.parser')
+        tracks_data = []
+        
+        track_elements = soup.select('.tracks__item')
+        
+        for el in track_elements:
+            if len(tracks_data) >= limit:
+                break
                 
-                # 2. Fetch covers in parallel (iTunes -> Deezer fallback)
-                tasks = []
-                for track in tracks_data:
-                    tasks.append(self._get_best_cover(client, track['artist'], track['title']))
+            try:
+                title_el = el.select_one('.track__title')
+                artist_el = el.select_one('.track__desc')
+                time_el = el.select_one('.track__fulltime')
+                download_el = el.select_one('a.track__download-btn')
+                cover_el = el.select_one('.track__img')
                 
-                covers = await asyncio.gather(*tasks)
+                if not (title_el and download_el):
+                    continue
+                    
+                title = title_el.text.strip()
+                artist = artist_el.text.strip() if artist_el else "Unknown"
+                duration_str = time_el.text.strip() if time_el else "00:00"
                 
-                # 3. Merge covers
-                final_tracks = []
-                for track, cover in zip(tracks_data, covers):
-                    image = cover
-                    if not image:
-                        image = track['fallback_image']
-                    if not image:
-                        image = f"https://ui-avatars.com/api/?name={urllib.parse.quote(track['artist'])}&size=200&background=random"
+                try:
+                    mins, secs = map(int, duration_str.split(':'))
+                    duration = mins * 60 + secs
+                except:
+                    duration = 0
+                    
+                url = download_el.get('href')
+                if not url:
+                    continue
                     
-                    track['image'] = image
-                    del track['fallback_image'] # Clean up
-                    final_tracks.append(track)
+                track_id = el.get('data-track-id')
+                if not track_id:
+                    track_id = self._generate_track_id(artist, title)
                     
-                return final_tracks
+                # Extract fallback cover from style
+                fallback_image = None
+                if cover_el:
+                    style = cover_el.get('style', '')
+                    match = re.search(r"url\(['\"]?(.*?)['\"]?\)", style)
+                    if match:
+                        fallback_image = match.group(1)
                 
-        except Exception as e:
-            print(f"Search error: {e}")
-            return []
+                tracks_data.append({
+                    'id': track_id,
+                    'title': title,
+                    'artist': artist,
+                    'duration': duration,
+                    'url': url,
+                    'fallback_image': fallback_image,
+                    'image': None # Will be filled later
+                })
+                
+            except Exception as e:
+                print(f"Error parsing track: {e}")
+                continue
+        
+        return tracks_data
+
+    async def attach_covers(self, client: httpx.AsyncClient, tracks_data: List[Dict]) -> List[Dict]:
+        """
+        Fetch covers in parallel (iTunes -> Deezer fallback) and merge them into tracks
+        """
+        tasks = []
+        for track in tracks_data:
+            tasks.append(self._get_best_cover(client, track['artist'], track['title']))
+        
+        covers = await asyncio.gather(*tasks)
+        
+        final_tracks = []
+        for track, cover in zip(tracks_data, covers):
+            image = cover
+            if not image:
+                image = track['fallback_image']
+            if not image:
+                image = f"https://ui-avatars.com/api/?name={urllib.parse.quote(track['artist'])}&size=200&background=random"
+            
+            track['image'] = image
+            del track['fallback_image'] # Clean up
+            final_tracks.append(track)
+            
+        return final_tracks
 
     async def _get_best_cover(self, client: httpx.AsyncClient, artist: str, title: str) -> Optional[str]:
         """
@@ -195,7 +242,7 @@ class HitmoParser:
                     if artwork:
                         return re.sub(r'\d+x\d+bb', '600x600bb', artwork)
             return None
-        except:
+        except Exception:
             return None
 
     async def _get_deezer_cover(self, client: httpx.AsyncClient, artist: str, title: str) -> Optional[str]:
@@ -222,7 +269,7 @@ class HitmoParser:
                     # Try to get the largest cover
                     return album.get('cover_xl') or album.get('cover_big') or album.get('cover_medium')
             return None
-        except:
+        except Exception:
             return None
     
     async def get_genre_tracks(self, genre_id: int, limit: int = 20, page: int = 1, user_agent: Optional[str] = None) -> List[Dict]:
@@ -234,106 +281,82 @@ class HitmoParser:
             params = {
                 'start': (page - 1) * limit
             }
-            
-            # Prepare headers with custom user agent
-            headers = self._prepare_headers(user_agent)
-            
-            # Get random proxy if available
-            proxy = self._get_random_proxy()
-            proxies = {"http://": proxy, "https://": proxy} if proxy else None
-            
-            async with httpx.AsyncClient(
-                headers=headers, 
-                timeout=10.0, 
-                follow_redirects=True,
-                proxies=proxies
-            ) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                tracks_data = []
-                
-                track_elements = soup.select('.tracks__item')
-                
-                for el in track_elements:
-                    if len(tracks_data) >= limit:
-                        break
-                        
-                    try:
-                        title_el = el.select_one('.track__title')
-                        artist_el = el.select_one('.track__desc')
-                        time_el = el.select_one('.track__fulltime')
-                        download_el = el.select_one('a.track__download-btn')
-                        cover_el = el.select_one('.track__img')
-                        
-                        if not (title_el and download_el):
-                            continue
-                            
-                        title = title_el.text.strip()
-                        artist = artist_el.text.strip() if artist_el else "Unknown"
-                        duration_str = time_el.text.strip() if time_el else "00:00"
-                        
-                        try:
-                            mins, secs = map(int, duration_str.split(':'))
-                            duration = mins * 60 + secs
-                        except:
-                            duration = 0
-                            
-                        url = download_el.get('href')
-                        if not url:
-                            continue
-                            
-                        track_id = el.get('data-track-id')
-                        if not track_id:
-                            track_id = f"gen_{abs(hash(artist + title))}"
-                            
-                        fallback_image = None
-                        if cover_el:
-                            style = cover_el.get('style', '')
-                            match = re.search(r"url\(['\"]?(.*?)['\"]?\)", style)
-                            if match:
-                                fallback_image = match.group(1)
-                        
-                        tracks_data.append({
-                            'id': track_id,
-                            'title': title,
-                            'artist': artist,
-                            'duration': duration,
-                            'url': url,
-                            'fallback_image': fallback_image,
-                            'image': None
-                        })
-                        
-                    except Exception as e:
-                        print(f"Error parsing track: {e}")
-                        continue
-                
-                # Fetch covers in parallel (iTunes -> Deezer fallback)
-                tasks = []
-                for track in tracks_data:
-                    tasks.append(self._get_best_cover(client, track['artist'], track['title']))
-                
-                covers = await asyncio.gather(*tasks)
-                
-                final_tracks = []
-                for track, cover in zip(tracks_data, covers):
-                    image = cover
-                    if not image:
-                        image = track['fallback_image']
-                    if not image:
-                        image = f"https://ui-avatars.com/api/?name={urllib.parse.quote(track['artist'])}&size=200&background=random"
-                    
-                    track['image'] = image
-                    del track['fallback_image']
-                    final_tracks.append(track)
-                    
-                return final_tracks
+            return await self._fetch_listing(url, params, limit, user_agent)
                 
         except Exception as e:
             print(f"Genre tracks error: {e}")
+            self._error_times.append(time.time())
+            return []
+
+    async def get_chart_tracks(self, chart: str, limit: int = 20, page: int = 1, user_agent: Optional[str] = None) -> List[Dict]:
+        """
+        Get tracks from a Hitmo chart page ('trending' or 'recent') (Async)
+        """
+        try:
+            url = f"{self.BASE_URL}{self.CHART_PATHS[chart]}"
+            params = {
+                'start': (page - 1) * limit
+            }
+            return await self._fetch_listing(url, params, limit, user_agent)
+                
+        except Exception as e:
+            print(f"Chart tracks error ({chart}): {e}")
+            self._error_times.append(time.time())
             return []
 
+    async def get_genres(self, user_agent: Optional[str] = None) -> List[Dict]:
+        """
+        Discover the genre list from the Hitmo /genres index (Async)
+        """
+        async with httpx.AsyncClient(
+            headers=self._prepare_headers(user_agent),
+            timeout=10.0,
+            follow_redirects=True,
+            proxies=self._get_proxies()
+        ) as client:
+            response = await client.get(f"{self.BASE_URL}/genres")
+            response.raise_for_status()
+        
+        soup = BeautifulSoup(response.text, 'html.parser')
+        genres = {}
+        for link in soup.find_all('a', href=True):
+            match = re.search(r'/genre/(\d+)/?$', link['href'])
+            if match:
+                genre_id = int(match.group(1))
+                name = link.text.strip()
+                if name and genre_id not in genres:
+                    genres[genre_id] = name
+        
+        return [{'id': genre_id, 'name': name} for genre_id, name in sorted(genres.items())]
+
+    async def fetch_genre_page(self, genre_id: int, start: int, etag: Optional[str] = None, last_modified: Optional[str] = None) -> httpx.Response:
+        """
+        Conditional GET of a raw genre page (may return 304 Not Modified)
+        """
+        headers = self._prepare_headers()
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        async with httpx.AsyncClient(
+            headers=headers,
+            timeout=10.0,
+            follow_redirects=True,
+            proxies=self._get_proxies()
+        ) as client:
+            response = await client.get(f"{self.BASE_URL}/genre/{genre_id}", params={'start': start})
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response
+
+    async def resolve_covers(self, tracks_data: List[Dict]) -> List[Dict]:
+        """
+        attach_covers() with its own client, for tracks parsed outside a request
+        """
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            return await self.attach_covers(client, tracks_data)
+
     def get_radio_stations(self) -> List[Dict]:
         """
         Get list of popular radio stations
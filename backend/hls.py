@@ -0,0 +1,260 @@
+"""
+HLS packaging of MP3 tracks.
+
+A track is presented as a VOD playlist of SEGMENT_SECONDS packed-audio
+segments. Segment boundaries come from the file size and duration alone, so
+the playlist is available before any segment exists. Each segment is cut
+lazily on its first request: the byte range is read through the audio block
+cache, both ends are moved to the next MP3 frame header, and an ID3
+timestamp is prepended as HLS packed audio requires. Finished segments are
+immutable and kept on disk; segment files are written, evicted and scanned
+at startup in worker threads.
+"""
+
+import asyncio
+import math
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import anyio
+
+try:
+    from backend.mpeg_audio import find_mp3_frame, parse_mp3_header, id3v2_size
+except ImportError:
+    from mpeg_audio import find_mp3_frame, parse_mp3_header, id3v2_size
+
+# Configuration
+HLS_ENABLED = os.getenv("HLS_ENABLED", "1") == "1"
+SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "6"))
+# Relative paths are resolved against backend/, whatever the working directory
+HLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("HLS_CACHE_DIR", "hls_cache"))
+HLS_CACHE_MAX_BYTES = int(os.getenv("HLS_CACHE_MAX_MB", "512")) * 1024 * 1024
+SYNC_SLACK = 4096  # bytes read past a nominal cut to find the next frame header
+HEAD_BYTES = 16 * 1024  # enough for a frame header after a small ID3 tag
+
+ReadRange = Callable[[int, int], Awaitable[bytes]]
+
+# Storage
+# Format: key -> segment layout (see get_layout)
+_layouts: Dict[str, Dict[str, Any]] = {}
+_pending: Dict[str, "asyncio.Task[str]"] = {}
+
+# Statistics
+_stats = {
+    "playlists": 0,
+    "segments_cut": 0,
+    "segment_hits": 0,
+    "segments_evicted": 0
+}
+
+
+def _syncsafe(value: int) -> bytes:
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def timestamp_tag(seconds: float) -> bytes:
+    """ID3v2.4 tag with the PRIV transport stream timestamp (90 kHz clock)"""
+    pts = round(seconds * 90000) & ((1 << 33) - 1)
+    payload = b"com.apple.streaming.transportStreamTimestamp\x00" + pts.to_bytes(8, "big")
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+
+class SegmentStore:
+    """Segment files on disk, evicted least-recently-used over the quota"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._files: Dict[str, int] = {}  # path -> size, least recently used first
+        self.total_bytes = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if name.endswith(".tmp"):
+                        os.remove(path)  # interrupted write
+                        continue
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        return sorted(found)
+
+    async def load(self) -> None:
+        """Picks up stored segments from disk (oldest first) in a worker thread"""
+        found = await anyio.to_thread.run_sync(self._scan)
+        # Segments cut while the scan ran are the most recent ones
+        added = self._files
+        self._files = {path: size for _, path, size in found if path not in added}
+        self._files.update(added)
+        self.total_bytes = sum(self._files.values())
+        await self._evict()
+
+    def path_for(self, key: str, index: int) -> str:
+        return os.path.join(self.root, key[:2], key, f"{index}.mp3")
+
+    def lookup(self, path: str) -> bool:
+        size = self._files.pop(path, None)
+        if size is None:
+            return False
+        self._files[path] = size  # move to the most recently used end
+        return True
+
+    async def write(self, path: str, data: bytes) -> None:
+        await anyio.to_thread.run_sync(_write_file, path, data)
+        self.total_bytes += len(data) - self._files.pop(path, 0)
+        self._files[path] = len(data)
+        await self._evict()
+
+    async def _evict(self) -> None:
+        victims = []
+        while self.total_bytes > self.max_bytes and len(self._files) > 1:
+            oldest = next(iter(self._files))
+            self.total_bytes -= self._files.pop(oldest)
+            victims.append(oldest)
+            _stats["segments_evicted"] += 1
+        if victims:
+            await anyio.to_thread.run_sync(_remove_files, victims)
+
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+segment_store: Optional[SegmentStore] = None
+if HLS_ENABLED:
+    try:
+        segment_store = SegmentStore(HLS_DIR, HLS_CACHE_MAX_BYTES)
+    except OSError as e:
+        print(f"❌ HLS disabled: {e}")
+
+
+async def get_layout(key: str, size: int, duration: int, read_range: ReadRange) -> Optional[Dict[str, Any]]:
+    """
+    Segment layout of the file: where the audio starts (after the ID3 tag)
+    and how many bytes one segment spans. duration may be 0, in which case
+    it is estimated from the bitrate of the first frame (exact for CBR).
+    """
+    layout = _layouts.get(key)
+    if layout and layout["size"] == size:
+        return layout
+
+    head = await read_range(0, min(HEAD_BYTES, size) - 1)
+    audio_start = id3v2_size(head)
+    if audio_start >= size:
+        return None
+
+    if duration <= 0:
+        head = await read_range(audio_start, min(audio_start + HEAD_BYTES, size) - 1)
+        offset = find_mp3_frame(head)
+        header = parse_mp3_header(head, offset) if offset >= 0 else None
+        if not header or not header["bitrate"]:
+            return None
+        duration = (size - audio_start) * 8 / (header["bitrate"] * 1000)
+
+    bytes_per_second = (size - audio_start) / duration
+    segment_bytes = max(int(bytes_per_second * SEGMENT_SECONDS), SYNC_SLACK)
+    layout = {
+        "size": size,
+        "duration": duration,
+        "audio_start": audio_start,
+        "bytes_per_second": bytes_per_second,
+        "segment_bytes": segment_bytes,
+        "count": math.ceil((size - audio_start) / segment_bytes)
+    }
+    _layouts[key] = layout
+    return layout
+
+
+def build_playlist(layout: Dict[str, Any]) -> str:
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(SEGMENT_SECONDS)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    remaining = layout["duration"]
+    for index in range(layout["count"]):
+        length = min(SEGMENT_SECONDS, remaining) if index < layout["count"] - 1 else remaining
+        remaining -= length
+        lines.append(f"#EXTINF:{max(length, 0.001):.3f},")
+        lines.append(f"{index}.mp3")
+    lines.append("#EXT-X-ENDLIST")
+    _stats["playlists"] += 1
+    return "\n".join(lines) + "\n"
+
+
+async def _cut_segment(key: str, index: int, layout: Dict[str, Any], read_range: ReadRange) -> str:
+    size = layout["size"]
+    nominal_start = layout["audio_start"] + index * layout["segment_bytes"]
+    nominal_end = min(nominal_start + layout["segment_bytes"], size)
+    last = index == layout["count"] - 1
+
+    data = await read_range(nominal_start, min(nominal_end + SYNC_SLACK, size) - 1)
+
+    # Both cuts use the same rule, so adjacent segments share their boundary
+    start = 0
+    if index > 0:
+        start = max(find_mp3_frame(data), 0)
+    end = len(data)
+    if not last:
+        offset = find_mp3_frame(data, nominal_end - nominal_start)
+        end = offset if offset >= 0 else nominal_end - nominal_start
+
+    seconds = (nominal_start + start - layout["audio_start"]) / layout["bytes_per_second"]
+    path = segment_store.path_for(key, index)
+    await segment_store.write(path, timestamp_tag(seconds) + data[start:end])
+    _stats["segments_cut"] += 1
+    return path
+
+
+async def get_segment(key: str, index: int, layout: Dict[str, Any], read_range: ReadRange) -> Optional[str]:
+    """
+    Path of the segment file, cutting it on first request.
+    Returns None for an index outside the playlist.
+    """
+    if not 0 <= index < layout["count"]:
+        return None
+
+    path = segment_store.path_for(key, index)
+    if segment_store.lookup(path) and os.path.exists(path):
+        _stats["segment_hits"] += 1
+        return path
+
+    # Concurrent requests for the same segment wait for one cut
+    task = _pending.get(path)
+    if task is None:
+        task = asyncio.create_task(_cut_segment(key, index, layout, read_range))
+        _pending[path] = task
+        task.add_done_callback(lambda _: _pending.pop(path, None))
+    return await asyncio.shield(task)
+
+
+def get_hls_stats() -> Dict[str, Any]:
+    """
+    Returns current HLS packaging statistics.
+    """
+    return {
+        "enabled": segment_store is not None,
+        "segment_seconds": SEGMENT_SECONDS,
+        "stored_segments": len(segment_store._files) if segment_store else 0,
+        "disk_usage_bytes": segment_store.total_bytes if segment_store else 0,
+        **_stats
+    }
@@ -0,0 +1,83 @@
+"""
+HTTP caching semantics for read endpoints.
+
+Responses get a strong ETag (hash of the serialized JSON body) and a
+Cache-Control header chosen per endpoint. A request whose If-None-Match
+matches the current ETag is answered with 304 Not Modified and no body, so
+the Telegram WebView and any CDN in front of the API can revalidate cheaply.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+
+# Cache-Control per endpoint
+CACHE_POLICIES: Dict[str, str] = {
+    "search": os.getenv("HTTP_CACHE_SEARCH", "public, max-age=300, stale-while-revalidate=600"),
+    "genre": os.getenv("HTTP_CACHE_GENRE", "public, max-age=600, stale-while-revalidate=1800"),
+    # now_playing changes with every song
+    "radio": os.getenv("HTTP_CACHE_RADIO", "public, max-age=30, stale-while-revalidate=60"),
+    # lyrics are stored once per track and never change
+    "lyrics": os.getenv("HTTP_CACHE_LYRICS", "public, max-age=2592000, immutable"),
+}
+
+# Statistics
+_stats = {
+    "http_responses": 0,
+    "http_not_modified": 0
+}
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Match uses weak comparison: W/ prefixes are ignored.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def cached_json_response(request: Request, payload: Any, policy: str) -> Response:
+    """
+    Serializes payload as JSON with ETag and Cache-Control headers, or
+    returns 304 if the client already has this exact body.
+    """
+    body = json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {
+        "ETag": make_etag(body),
+        "Cache-Control": CACHE_POLICIES[policy]
+    }
+    _stats["http_responses"] += 1
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+        _stats["http_not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def get_http_cache_stats() -> Dict[str, Any]:
+    """
+    Returns conditional request statistics.
+    """
+    responses = _stats["http_responses"]
+    return {
+        "http_not_modified_ratio": round(_stats["http_not_modified"] / responses, 3) if responses else 0,
+        **_stats
+    }
@@ -3,33 +3,77 @@ FastAPI Backend for Telegram Music Mini App
 """
 
 from fastapi import FastAPI, HTTPException, Query, Depends, Body, BackgroundTasks, Request
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Tuple
 import uvicorn
 from sqlalchemy.orm import Session
 from datetime import datetime
+import os
+import json
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+
+# Модули ниже читают конфигурацию из окружения при импорте
+load_dotenv()
 
 try:
     from backend.hitmo_parser_light import HitmoParser
-    from backend.database import User, DownloadedMessage, Lyrics, Payment, Referral, get_db, init_db, SessionLocal
-    from backend.cache import make_cache_key, get_from_cache, set_to_cache, get_cache_stats, reset_cache
+    from backend.database import User, DownloadedMessage, DownloadJob, Lyrics, Payment, Referral, get_db, init_db, SessionLocal
+    from backend.telegram_delivery import send_track_to_chat, send_tracks_to_chat, get_delivery_stats
+    from backend.telegram_client import call as telegram_call, close as close_telegram_client, get_telegram_client_stats, TelegramAPIError, PRIORITY_PAYMENT, PRIORITY_USER, PRIORITY_BULK
+    from backend.download_jobs import enqueue as enqueue_download, enqueue_batch as enqueue_download_batch, get_job as get_download_job_by_id, job_to_dict, get_download_job_stats, run as run_download_jobs
+    from backend.cache import make_cache_key, get_from_cache, set_to_cache, is_cached, get_cache_stats, reset_cache
     from backend.lyrics_service import LyricsService
     from backend.payments import create_stars_invoice, verify_ton_transaction, grant_premium_after_payment
     from backend.tribute import verify_tribute_signature
+    from backend.track_registry import register_tracks, register_track, resolve_track
+    from backend.artist_index import artist_index, artist_matches, make_key, MIN_KEY_LENGTH, normalize as normalize_artist, build_from_registry as build_artist_index
+    from backend.prefetch import schedule_prefetch, get_prefetch_stats, configure as configure_prefetch
+    from backend.stream_upstream import open_upstream, parse_total_size, parse_body_span, UpstreamError
+    from backend.stream_resolver import get_resolved, get_resolver_stats, INVALIDATING_STATUSES
+    from backend.stream_fanin import shared_fetch, get_fanin_stats
+    from backend.radio_relay import get_relay, get_relay_stats
+    from backend.http_cache import cached_json_response, get_http_cache_stats
+    from backend.stream_handles import make_handle, parse_handle, HANDLES_STABLE
+    from backend.transcoder import transcode, transcode_cache, get_transcoder_stats, QUALITY_PRESETS
+    from backend.hls import segment_store, get_layout, build_playlist, get_segment, get_hls_stats
+    from backend.stream_relay import relay_body, resume_body, get_stream_relay_stats
+    from backend.stream_limits import acquire_stream, limit_response, StreamLease, StreamLimitExceeded, get_stream_limits_stats
+    from backend.telegram_auth import verify_init_data
+    from backend.request_scope import run_scoped, ClientDisconnected, ClosingStreamingResponse, CLIENT_CLOSED_REQUEST, get_request_scope_stats
+    from backend.radio_monitor import enrich_stations, get_station_status, get_monitor_stats, run as run_radio_monitor, MONITOR_ENABLED as RADIO_MONITOR_ENABLED
+    from backend.audio_cache import audio_cache, parse_range, CachedRangeResponse, get_audio_cache_stats
+    from backend.genre_crawler import get_crawled_tracks, get_crawler_stats, run as run_genre_crawler, CRAWLER_ENABLED as GENRE_CRAWLER_ENABLED
 except ImportError:
     from hitmo_parser_light import HitmoParser
-    from database import User, DownloadedMessage, Lyrics, Payment, Referral, get_db, init_db, SessionLocal
-    from cache import make_cache_key, get_from_cache, set_to_cache, get_cache_stats, reset_cache
+    from database import User, DownloadedMessage, DownloadJob, Lyrics, Payment, Referral, get_db, init_db, SessionLocal
+    from telegram_delivery import send_track_to_chat, send_tracks_to_chat, get_delivery_stats
+    from telegram_client import call as telegram_call, close as close_telegram_client, get_telegram_client_stats, TelegramAPIError, PRIORITY_PAYMENT, PRIORITY_USER, PRIORITY_BULK
+    from download_jobs import enqueue as enqueue_download, enqueue_batch as enqueue_download_batch, get_job as get_download_job_by_id, job_to_dict, get_download_job_stats, run as run_download_jobs
+    from cache import make_cache_key, get_from_cache, set_to_cache, is_cached, get_cache_stats, reset_cache
     from lyrics_service import LyricsService
     from payments import create_stars_invoice, verify_ton_transaction, grant_premium_after_payment
     from tribute import verify_tribute_signature
-
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+    from track_registry import register_tracks, register_track, resolve_track
+    from artist_index import artist_index, artist_matches, make_key, MIN_KEY_LENGTH, normalize as normalize_artist, build_from_registry as build_artist_index
+    from prefetch import schedule_prefetch, get_prefetch_stats, configure as configure_prefetch
+    from stream_upstream import open_upstream, parse_total_size, parse_body_span, UpstreamError
+    from stream_resolver import get_resolved, get_resolver_stats, INVALIDATING_STATUSES
+    from stream_fanin import shared_fetch, get_fanin_stats
+    from radio_relay import get_relay, get_relay_stats
+    from http_cache import cached_json_response, get_http_cache_stats
+    from stream_handles import make_handle, parse_handle, HANDLES_STABLE
+    from transcoder import transcode, transcode_cache, get_transcoder_stats, QUALITY_PRESETS
+    from hls import segment_store, get_layout, build_playlist, get_segment, get_hls_stats
+    from stream_relay import relay_body, resume_body, get_stream_relay_stats
+    from stream_limits import acquire_stream, limit_response, StreamLease, StreamLimitExceeded, get_stream_limits_stats
+    from telegram_auth import verify_init_data
+    from request_scope import run_scoped, ClientDisconnected, ClosingStreamingResponse, CLIENT_CLOSED_REQUEST, get_request_scope_stats
+    from radio_monitor import enrich_stations, get_station_status, get_monitor_stats, run as run_radio_monitor, MONITOR_ENABLED as RADIO_MONITOR_ENABLED
+    from audio_cache import audio_cache, parse_range, CachedRangeResponse, get_audio_cache_stats
+    from genre_crawler import get_crawled_tracks, get_crawler_stats, run as run_genre_crawler, CRAWLER_ENABLED as GENRE_CRAWLER_ENABLED
 
 
 # Pydantic модели
@@ -44,6 +88,7 @@ class Track(BaseModel):
 class SearchResponse(BaseModel):
     results: List[Track]
     count: int
+    suggestion: Optional[str] = None  # "Возможно, вы имели в виду" для исполнителя
 
 class RadioStation(BaseModel):
     id: str
@@ -51,6 +96,11 @@ class RadioStation(BaseModel):
     genre: str
     url: str
     image: str
+    relay_url: Optional[str] = None  # общий поток через наш сервер
+    alive: Optional[bool] = None  # None - станция ещё не проверялась
+    now_playing: Optional[str] = None
+    bitrate: Optional[int] = None
+    codec: Optional[str] = None
 
 class UserAuth(BaseModel):
     id: int
@@ -153,6 +203,21 @@ class CacheStats(BaseModel):
     hit_ratio: float
     ttl_seconds: int
     sample_keys: List[str]
+    prefetch_stored: int = 0
+    prefetch_hits: int = 0
+    prefetch_expired: int = 0
+    prefetch_hit_ratio: float = 0
+    prefetch_enabled: bool = False
+    prefetch_in_flight: int = 0
+    http_responses: int = 0
+    http_not_modified: int = 0
+    http_not_modified_ratio: float = 0
+    prefetch_scheduled: int = 0
+    prefetch_completed: int = 0
+    prefetch_failed: int = 0
+    prefetch_skipped_budget: int = 0
+    prefetch_skipped_pressure: int = 0
+    prefetch_cancelled_pressure: int = 0
 
 class UserListItem(BaseModel):
     id: int
@@ -202,6 +267,9 @@ app.add_middleware(
 # Глобальный экземпляр парсера
 parser = HitmoParser()
 
+# Префетч следующих страниц откладывается, пока Hitmo/прокси сыплют ошибками
+configure_prefetch(pressure_check=parser.upstream_pressure)
+
 # Telegram Bot Token
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
@@ -426,6 +494,9 @@ async def get_transactions(
 
 # --- Admin Phase 2 Endpoints ---
 
+# Сообщений рассылки в полете одновременно (темп все равно ограничен клиентом Bot API)
+BROADCAST_BATCH_SIZE = 100
+
 @app.post("/api/admin/broadcast")
 async def broadcast_message(
     request: BroadcastRequest,
@@ -441,29 +512,28 @@ async def broadcast_message(
         raise HTTPException(status_code=500, detail="BOT_TOKEN not configured")
         
     users = db.query(User).filter(User.is_blocked == False).all()
-    count = 0
+    user_ids = [u.id for u in users]
     
-    telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    # Темп рассылки задает клиент Bot API: общий лимит 30 сообщений/с,
+    # низкий приоритет - платежи и ответы пользователям идут вперед
     
-    # В реальном проекте это нужно делать через очередь задач (Celery/Redis)
-    # Здесь делаем просто в цикле с задержкой, чтобы не заблокировать event loop надолго
-    # используем asyncio.create_task для фона
+    async def send_one(chat_id: int) -> bool:
+        try:
+            await telegram_call("sendMessage", {
+                'chat_id': chat_id,
+                'text': request.message,
+                'parse_mode': 'HTML'
+            }, priority=PRIORITY_BULK, chat_id=chat_id)
+            return True
+        except Exception as e:
+            print(f"Failed to send to {chat_id}: {e}")
+            return False
     
     async def send_broadcast():
         sent = 0
-        async with httpx.AsyncClient() as client:
-            for u in users:
-                try:
-                    await client.post(telegram_url, json={
-                        'chat_id': u.id,
-                        'text': request.message,
-                        'parse_mode': 'HTML'
-                    })
-                    sent += 1
-                    # Rate limit protection
-                    await asyncio.sleep(0.05) 
-                except Exception as e:
-                    print(f"Failed to send to {u.id}: {e}")
+        for start in range(0, len(user_ids), BROADCAST_BATCH_SIZE):
+            results = await asyncio.gather(*(send_one(chat_id) for chat_id in user_ids[start:start + BROADCAST_BATCH_SIZE]))
+            sent += sum(results)
         print(f"📢 Broadcast completed. Sent to {sent} users.")
 
     asyncio.create_task(send_broadcast())
@@ -632,18 +702,15 @@ async def grant_rights(
                 
                 print(f"📤 Sending notification to user {request.user_id}...")
                 
-                telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                async with httpx.AsyncClient(timeout=10.0) as client:
-                    response = await client.post(telegram_url, json={
+                try:
+                    await telegram_call("sendMessage", {
                         'chat_id': request.user_id,
                         'text': message,
                         'parse_mode': 'HTML'
-                    })
-                    
-                    if response.status_code == 200:
-                        print(f"✅ Notification sent successfully to user {request.user_id}")
-                    else:
-                        print(f"❌ Failed to send notification: {response.status_code} - {response.text}")
+                    }, priority=PRIORITY_USER, chat_id=request.user_id)
+                    print(f"✅ Notification sent successfully to user {request.user_id}")
+                except TelegramAPIError as e:
+                    print(f"❌ Failed to send notification: {e.status_code} - {e.description}")
             except Exception as e:
                 print(f"❌ Exception while sending notification to user {request.user_id}: {e}")
         else:
@@ -655,6 +722,22 @@ async def grant_rights(
 
 import asyncio
 
+async def _delete_messages(messages: List[DownloadedMessage], priority: int) -> int:
+    """Удаляет скачанные треки из чатов; возвращает число удаленных сообщений"""
+    async def delete_one(msg: DownloadedMessage) -> bool:
+        try:
+            await telegram_call("deleteMessage", {
+                'chat_id': msg.chat_id,
+                'message_id': msg.message_id
+            }, priority=priority)
+            return True
+        except Exception as e:
+            print(f"Failed to delete message {msg.message_id}: {e}")
+            return False
+    
+    results = await asyncio.gather(*(delete_one(msg) for msg in messages))
+    return sum(results)
+
 async def background_deletion_task():
     """Фоновая задача для удаления треков"""
     print("🔄 Background deletion task started")
@@ -677,20 +760,7 @@ async def background_deletion_task():
                     messages = db.query(DownloadedMessage).filter(DownloadedMessage.user_id == user.id).all()
                     
                     if messages:
-                        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/deleteMessage"
-                        deleted_count = 0
-                        
-                        async with httpx.AsyncClient(timeout=30.0) as client:
-                            for msg in messages:
-                                try:
-                                    response = await client.post(telegram_url, json={
-                                        'chat_id': msg.chat_id,
-                                        'message_id': msg.message_id
-                                    })
-                                    if response.status_code == 200:
-                                        deleted_count += 1
-                                except Exception as e:
-                                    print(f"Failed to delete message {msg.message_id}: {e}")
+                        deleted_count = await _delete_messages(messages, PRIORITY_BULK)
                         
                         # Удаляем записи из БД
                         db.query(DownloadedMessage).filter(DownloadedMessage.user_id == user.id).delete()
@@ -708,11 +778,31 @@ async def background_deletion_task():
         # Проверяем каждые 10 секунд (для теста)
         await asyncio.sleep(10)
 
+# Фоновые задачи, которые нужно остановить при завершении приложения
+background_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    build_artist_index()
     # Фоновая задача удаления треков временно отключена
     # asyncio.create_task(background_deletion_task())
+    
+    # Обход дисковых кэшей - в фоне, чтобы не задерживать старт
+    if audio_cache is not None:
+        background_tasks.append(asyncio.create_task(audio_cache.load()))
+    if transcode_cache is not None:
+        background_tasks.append(asyncio.create_task(transcode_cache.load()))
+    if segment_store is not None:
+        background_tasks.append(asyncio.create_task(segment_store.load()))
+    if GENRE_CRAWLER_ENABLED:
+        background_tasks.append(asyncio.create_task(run_genre_crawler(parser, on_tracks=_remember_tracks)))
+    if RADIO_MONITOR_ENABLED:
+        background_tasks.append(asyncio.create_task(run_radio_monitor(parser)))
+    background_tasks.append(asyncio.create_task(run_download_jobs({
+        "track": _deliver_download_job,
+        "batch": _deliver_download_batch
+    })))
 
 # --- Payment Endpoints ---
 
@@ -765,13 +855,11 @@ async def telegram_webhook(update: Dict[str, Any] = Body(...), db: Session = Dep
             query = update["pre_checkout_query"]
             query_id = query["id"]
             
-            # Всегда подтверждаем
-            telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/answerPreCheckoutQuery"
-            async with httpx.AsyncClient() as client:
-                await client.post(telegram_url, json={
-                    "pre_checkout_query_id": query_id,
-                    "ok": True
-                })
+            # Всегда подтверждаем (Telegram ждет ответ не дольше 10 секунд)
+            await telegram_call("answerPreCheckoutQuery", {
+                "pre_checkout_query_id": query_id,
+                "ok": True
+            }, priority=PRIORITY_PAYMENT)
             return {"status": "ok"}
             
         # Обработка SuccessfulPayment (успешная оплата)
@@ -906,7 +994,7 @@ async def get_admin_cache_stats(user_id: int = Query(...), db: Session = Depends
     if not user or not user.is_admin:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return get_cache_stats()
+    return {**get_cache_stats(), **get_prefetch_stats(), **get_http_cache_stats()}
 
 @app.post("/api/admin/cache/reset")
 async def reset_admin_cache(admin_id: int = Query(...), db: Session = Depends(get_db)):
@@ -918,9 +1006,200 @@ async def reset_admin_cache(admin_id: int = Query(...), db: Session = Depends(ge
     reset_cache()
     return {"status": "ok", "message": "Cache cleared"}
 
+@app.get("/api/admin/stream/stats")
+async def get_admin_stream_stats(user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Статистика стриминга аудио (только для админов)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return {
+        "audio_cache": get_audio_cache_stats(),
+        "resolver": get_resolver_stats(),
+        "fanin": get_fanin_stats(),
+        "transcoder": get_transcoder_stats(),
+        "hls": get_hls_stats(),
+        "cancellation": get_request_scope_stats(),
+        "relay": get_stream_relay_stats(),
+        "limits": get_stream_limits_stats()
+    }
+
+@app.get("/api/admin/delivery/stats")
+async def get_admin_delivery_stats(user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Статистика отправки треков в чат (только для админов)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return {
+        **get_delivery_stats(db),
+        "jobs": get_download_job_stats(db)
+    }
+
+@app.get("/api/admin/telegram/stats")
+async def get_admin_telegram_stats(user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Статистика клиента Telegram Bot API: лимиты, 429, очередь (только для админов)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return get_telegram_client_stats()
+
+@app.get("/api/admin/radio/stats")
+async def get_admin_radio_stats(user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Статистика ретрансляции радио (только для админов)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return {
+        "relay": get_relay_stats(),
+        "monitor": get_monitor_stats()
+    }
+
+@app.get("/api/admin/crawler/stats")
+async def get_admin_crawler_stats(user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Статистика фонового краулера жанров (только для админов)"""
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return get_crawler_stats()
+
 
 # --- Music Endpoints ---
 
+def _remember_tracks(tracks: List[Dict[str, Any]]) -> None:
+    """Регистрирует треки в реестре и добавляет их исполнителей в индекс"""
+    # Каждый трек учитывается в популярности артиста один раз - при первой регистрации
+    artist_index.add_tracks(register_tracks(tracks))
+
+
+def _stream_url(track_id: str) -> str:
+    """Короткая подписанная ссылка на поток трека через наш прокси"""
+    return f"/api/stream/{make_handle(track_id)}"
+
+async def _load_search_page(
+    q: str,
+    limit: int,
+    page: int,
+    by_artist: bool,
+    by_track: bool,
+    user_agent: Optional[str] = None,
+    prefetched: bool = False
+) -> Dict[str, Any]:
+    """
+    Поиск через кэш.
+    Возвращает сериализованные данные: {"results": [...], "count": N}
+    """
+    # 1. Проверяем кэш
+    cache_key = make_cache_key("search", {
+        "q": q, 
+        "limit": limit, 
+        "page": page, 
+        "by_artist": by_artist,
+        "by_track": by_track
+    })
+    
+    cached_data = get_from_cache(cache_key)
+    if cached_data:
+        return cached_data
+
+    # 2. Если нет в кэше, делаем запрос
+    
+    # Исполнитель сначала разрешается через локальный индекс (кириллица/латиница, опечатки).
+    # Запрос заменяется только при точном совпадении ключа; исправление опечатки
+    # лишь предлагается, иначе отсутствующий в индексе артист подменялся бы другим
+    artist_match = artist_index.lookup(q) if by_artist else None
+    search_query = artist_match.name if artist_match and artist_match.distance == 0 else q
+    
+    async def deep_search(query: str) -> List[Dict[str, Any]]:
+        print(f"DEBUG: Deep search enabled for query='{query}' (Artist={by_artist}, Track={by_track})")
+        all_tracks = []
+        # Скачиваем первые 3 страницы (Hitmo обычно отдает по 48 треков на страницу)
+        # Это ~144 трека, что должно хватить для нахождения нужного артиста
+        for p in range(1, 4):
+            try:
+                print(f"DEBUG: Fetching page {p}...")
+                page_tracks = await parser.search(query, limit=48, page=p, user_agent=user_agent)
+                all_tracks.extend(page_tracks)
+                if len(page_tracks) < 20: # Если вернулось мало треков, значит страницы кончились
+                    break
+            except Exception as e:
+                print(f"DEBUG: Error fetching page {p}: {e}")
+                break
+        
+        print(f"DEBUG: Total tracks fetched: {len(all_tracks)}")
+        return all_tracks
+    
+    # Если включена фильтрация, делаем глубокий поиск (скачиваем несколько страниц)
+    if by_artist or by_track:
+        tracks = await deep_search(search_query)
+        if not tracks and search_query != q:
+            # По каноническому имени ничего не нашлось - ищем как ввел пользователь
+            tracks = await deep_search(q)
+    else:
+        # Обычный поиск - одна страница
+        tracks = await parser.search(q, limit=limit, page=page, user_agent=user_agent)
+        print(f"DEBUG: Search query='{q}', limit={limit}, page={page}. Found {len(tracks)} tracks before filtering.")
+    
+    # Регистрируем все найденные треки, чтобы их можно было получить по ID
+    _remember_tracks(tracks)
+    
+    # Фильтрация по артисту или треку если запрошено
+    query_lower = q.lower()
+    
+    if by_artist:
+        artist_key = make_key(q)
+        if len(artist_key) < MIN_KEY_LENGTH:
+            # Запрос из одной пунктуации/эмодзи: пустой ключ совпал бы с любым артистом
+            tracks = []
+        print(f"DEBUG: Filtering by artist. Query='{query_lower}', key='{artist_key}'")
+        tracks = [
+            track for track in tracks 
+            if artist_matches(artist_key, track['artist'])
+        ]
+        print(f"DEBUG: Found {len(tracks)} tracks after artist filtering.")
+    elif by_track:
+        print(f"DEBUG: Filtering by track. Query='{query_lower}'")
+        tracks = [
+            track for track in tracks 
+            if query_lower in track['title'].lower()
+        ]
+        print(f"DEBUG: Found {len(tracks)} tracks after track filtering.")
+
+    # Пагинация для отфильтрованных результатов (если был глубокий поиск)
+    if by_artist or by_track:
+        start_idx = (page - 1) * limit
+        end_idx = start_idx + limit
+        tracks = tracks[start_idx:end_idx]
+        print(f"DEBUG: Returning slice [{start_idx}:{end_idx}] (Count: {len(tracks)})")
+    
+    # Оборачиваем URL в прокси и готовим данные для кэша (чистые словари)
+    cacheable_results = [
+        Track(**{**track, 'url': _stream_url(track['id'])}).dict()
+        for track in tracks
+    ]
+    
+    # Подсказка: исполнитель распознан с исправлением, или поиск ничего не нашел
+    if artist_match is None and not cacheable_results:
+        artist_match = artist_index.lookup(q)
+    suggestion = None
+    if artist_match and normalize_artist(artist_match.name) != normalize_artist(q):
+        suggestion = artist_match.name
+    
+    response_data = {
+        "results": cacheable_results,
+        "count": len(cacheable_results),
+        "suggestion": suggestion
+    }
+    
+    # 3. Сохраняем в кэш
+    set_to_cache(cache_key, response_data, prefetched=prefetched)
+    
+    return response_data
+
+
 @app.get("/api/search", response_model=SearchResponse)
 async def search_tracks(
     request: Request,
@@ -937,107 +1216,34 @@ async def search_tracks(
         # Get user agent
         user_agent = request.headers.get('user-agent')
         
-        # 1. Проверяем кэш
-        cache_key = make_cache_key("search", {
-            "q": q, 
-            "limit": limit, 
-            "page": page, 
-            "by_artist": by_artist,
-            "by_track": by_track
-        })
-        
-        cached_data = get_from_cache(cache_key)
-        if cached_data:
-            # Возвращаем данные из кэша, но нужно преобразовать словари обратно в объекты Track
-            # так как в кэше мы храним сериализованные данные (список словарей)
-            track_models = [Track(**t) for t in cached_data["results"]]
-            return SearchResponse(
-                results=track_models,
-                count=cached_data["count"]
-            )
-
-        # 2. Если нет в кэше, делаем запрос
-        
-        # Если включена фильтрация, делаем глубокий поиск (скачиваем несколько страниц)
-        if by_artist or by_track:
-            print(f"DEBUG: Deep search enabled for query='{q}' (Artist={by_artist}, Track={by_track})")
-            all_tracks = []
-            # Скачиваем первые 3 страницы (Hitmo обычно отдает по 48 треков на страницу)
-            # Это ~144 трека, что должно хватить для нахождения нужного артиста
-            for p in range(1, 4):
-                try:
-                    print(f"DEBUG: Fetching page {p}...")
-                    page_tracks = await parser.search(q, limit=48, page=p, user_agent=user_agent)
-                    all_tracks.extend(page_tracks)
-                    if len(page_tracks) < 20: # Если вернулось мало треков, значит страницы кончились
-                        break
-                except Exception as e:
-                    print(f"DEBUG: Error fetching page {p}: {e}")
-                    break
-            
-            print(f"DEBUG: Total tracks fetched: {len(all_tracks)}")
-            tracks = all_tracks
-        else:
-            # Обычный поиск - одна страница
-            tracks = await parser.search(q, limit=limit, page=page, user_agent=user_agent)
-            print(f"DEBUG: Search query='{q}', limit={limit}, page={page}. Found {len(tracks)} tracks before filtering.")
-        
-        # Фильтрация по артисту или треку если запрошено
-        query_lower = q.lower()
-        
-        if by_artist:
-            print(f"DEBUG: Filtering by artist. Query='{query_lower}'")
-            tracks = [
-                track for track in tracks 
-                if query_lower in track['artist'].lower()
-            ]
-            print(f"DEBUG: Found {len(tracks)} tracks after artist filtering.")
-        elif by_track:
-            print(f"DEBUG: Filtering by track. Query='{query_lower}'")
-            tracks = [
-                track for track in tracks 
-                if query_lower in track['title'].lower()
-            ]
-            print(f"DEBUG: Found {len(tracks)} tracks after track filtering.")
-
-        # Пагинация для отфильтрованных результатов (если был глубокий поиск)
-        if by_artist or by_track:
-            start_idx = (page - 1) * limit
-            end_idx = start_idx + limit
-            tracks = tracks[start_idx:end_idx]
-            print(f"DEBUG: Returning slice [{start_idx}:{end_idx}] (Count: {len(tracks)})")
-        
-        # Конвертируем в Pydantic модели и оборачиваем URL в прокси
-        track_models = []
-        base_url = "" 
-        
-        # Подготавливаем данные для кэша (чистые словари)
-        cacheable_results = []
-        
-        for track in tracks:
-            original_url = track['url']
-            if original_url:
-                from urllib.parse import quote
-                encoded_url = quote(original_url)
-                track['url'] = f"{base_url}/api/stream?url={encoded_url}"
-            
-            track_model = Track(**track)
-            track_models.append(track_model)
-            cacheable_results.append(track_model.dict())
-        
-        response_data = {
-            "results": cacheable_results,
-            "count": len(cacheable_results)
-        }
-        
-        # 3. Сохраняем в кэш
-        set_to_cache(cache_key, response_data)
-        
-        return SearchResponse(
-            results=track_models,
-            count=len(track_models)
-        )
-        
+        # Если пользователь закрыл приложение, поиск и загрузка обложек отменяются
+        data = await run_scoped(request, _load_search_page(q, limit, page, by_artist, by_track, user_agent))
+        
+        # Полная страница - скорее всего, пользователь долистает до следующей.
+        # Поиск по артисту/названию заново читает несколько страниц Hitmo - его не предзагружаем
+        if data["count"] >= limit and not by_artist and not by_track:
+            next_key = make_cache_key("search", {
+                "q": q, 
+                "limit": limit, 
+                "page": page + 1, 
+                "by_artist": by_artist,
+                "by_track": by_track
+            })
+            if not is_cached(next_key):
+                schedule_prefetch(next_key, lambda: _load_search_page(
+                    q, limit, page + 1, by_artist, by_track, user_agent, prefetched=True
+                ))
+        
+        return cached_json_response(request, SearchResponse(
+            results=[Track(**t) for t in data["results"]],
+            count=data["count"],
+            suggestion=data.get("suggestion")
+        ), "search")
+        
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Поиск занял слишком много времени")
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1046,18 +1252,32 @@ async def search_tracks(
 
 
 @app.get("/api/track/{track_id}", response_model=Track)
-async def get_track(track_id: str):
+async def get_track(request: Request, track_id: str):
     """
-    Получение информации о конкретном треке
+    Получение информации о конкретном треке из реестра треков.
+    Если ссылка на поток устарела, она переразрешается через парсер.
     """
-    raise HTTPException(
-        status_code=501,
-        detail="Получение трека по ID пока не реализовано. Используйте поиск."
+    try:
+        entry = await run_scoped(request, resolve_track(track_id, parser, user_agent=request.headers.get('user-agent')))
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Track lookup timed out")
+    if not entry:
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    return Track(
+        id=entry['id'],
+        title=entry['title'],
+        artist=entry['artist'],
+        duration=entry['duration'],
+        url=_stream_url(entry['id']) if entry['source'] == 'hitmo' else entry['url'],
+        image=entry['image']
     )
 
 
 @app.get("/api/radio")
-async def get_radio_stations():
+async def get_radio_stations(request: Request):
     """
     Получение списка радиостанций (с кэшированием)
     """
@@ -1067,17 +1287,20 @@ async def get_radio_stations():
         cached_data = get_from_cache(cache_key)
         
         if cached_data:
-            station_models = [RadioStation(**s) for s in cached_data["results"]]
-            return {
+            station_models = [RadioStation(**s) for s in enrich_stations(cached_data["results"])]
+            return cached_json_response(request, {
                 "results": station_models,
                 "count": cached_data["count"]
-            }
+            }, "radio")
 
         # 2. Запрос
         stations = parser.get_radio_stations()
         
         # Конвертируем в Pydantic модели
-        station_models = [RadioStation(**station) for station in stations]
+        station_models = [
+            RadioStation(**station, relay_url=f"/api/radio/{station['id']}/stream")
+            for station in stations
+        ]
         
         # 3. Сохраняем в кэш
         cacheable_data = {
@@ -1086,10 +1309,13 @@ async def get_radio_stations():
         }
         set_to_cache(cache_key, cacheable_data)
         
-        return {
+        # 4. Статус и текущий трек от фонового монитора (не кэшируются)
+        station_models = [RadioStation(**s) for s in enrich_stations(cacheable_data["results"])]
+        
+        return cached_json_response(request, {
             "results": station_models,
             "count": len(station_models)
-        }
+        }, "radio")
         
     except Exception as e:
         raise HTTPException(
@@ -1098,6 +1324,92 @@ async def get_radio_stations():
         )
 
 
+@app.get("/api/radio/{station_id}/stream")
+async def stream_radio(station_id: str):
+    """
+    Ретрансляция радиостанции: одно подключение к источнику на станцию,
+    общее для всех слушателей
+    """
+    station = next((s for s in parser.get_radio_stations() if s['id'] == station_id), None)
+    if not station:
+        raise HTTPException(status_code=404, detail="Station not found")
+
+    status = get_station_status(station_id)
+    if status and not status["alive"] and not get_relay_stats()["stations"].get(station_id):
+        raise HTTPException(status_code=503, detail="Station unavailable")
+
+    relay = await get_relay(station_id, station['url'])
+    if relay is None:
+        raise HTTPException(status_code=503, detail="Station unavailable")
+
+    return ClosingStreamingResponse(
+        relay.listen(),
+        media_type=relay.content_type,
+        headers={"Cache-Control": "no-cache, no-store"}
+    )
+
+
+async def _load_track_page(
+    namespace: str,
+    params: Dict[str, Any],
+    fetch: Callable[[], Awaitable[List[Dict[str, Any]]]],
+    crawled: Optional[Callable[[], Optional[List[Dict[str, Any]]]]] = None,
+    prefetched: bool = False
+) -> Dict[str, Any]:
+    """
+    Загрузка страницы треков через кэш: кэш -> данные краулера (если есть) -> парсер.
+    Возвращает сериализованные данные: {"results": [...], "count": N}
+    """
+    cache_key = make_cache_key(namespace, params)
+    
+    cached_data = get_from_cache(cache_key)
+    if cached_data:
+        return cached_data
+    
+    # Сначала пробуем данные фонового краулера, чтобы не ждать Hitmo
+    tracks = crawled() if crawled else None
+    if tracks is None:
+        tracks = await fetch()
+        _remember_tracks(tracks)
+    
+    cacheable_results = [
+        Track(**{**track, 'url': _stream_url(track['id'])}).dict()
+        for track in tracks
+    ]
+    response_data = {
+        "results": cacheable_results,
+        "count": len(cacheable_results)
+    }
+    set_to_cache(cache_key, response_data, prefetched=prefetched)
+    return response_data
+
+
+async def _load_genre_page(
+    genre_id: int,
+    limit: int,
+    page: int,
+    user_agent: Optional[str] = None,
+    prefetched: bool = False
+) -> Dict[str, Any]:
+    """Загрузка страницы жанра через кэш"""
+    return await _load_track_page(
+        "genre",
+        {"genre_id": genre_id, "limit": limit, "page": page},
+        lambda: parser.get_genre_tracks(genre_id, limit=limit, page=page, user_agent=user_agent),
+        crawled=lambda: get_crawled_tracks(genre_id, limit, page),
+        prefetched=prefetched
+    )
+
+
+async def _load_chart_page(chart: str, limit: int, page: int, user_agent: Optional[str] = None) -> Dict[str, Any]:
+    """Загрузка страницы чарта Hitmo ('trending', 'recent') через кэш"""
+    return await _load_track_page(
+        "chart",
+        {"chart": chart, "limit": limit, "page": page},
+        lambda: parser.get_chart_tracks(chart, limit=limit, page=page, user_agent=user_agent)
+    )
+
+
 @app.get("/api/genre/{genre_id}")
 async def get_genre_tracks(
     request: Request,
@@ -1109,54 +1421,30 @@ async def get_genre_tracks(
     Получение треков конкретного жанра (с кэшированием)
     """
     try:
-        # 1. Проверяем кэш
-        cache_key = make_cache_key("genre", {
-            "genre_id": genre_id,
-            "limit": limit,
-            "page": page
-        })
-        
-        cached_data = get_from_cache(cache_key)
-        if cached_data:
-            track_models = [Track(**t) for t in cached_data["results"]]
-            return {
-                "results": track_models,
-                "count": cached_data["count"],
-                "genre_id": genre_id
-            }
-
-        # 2. Запрос
         user_agent = request.headers.get('user-agent')
-        tracks = await parser.get_genre_tracks(genre_id, limit=limit, page=page, user_agent=user_agent)
+        data = await run_scoped(request, _load_genre_page(genre_id, limit, page, user_agent))
         
-        track_models = []
-        base_url = ""
-        cacheable_results = []
-        
-        for track in tracks:
-            original_url = track['url']
-            if original_url:
-                from urllib.parse import quote
-                encoded_url = quote(original_url)
-                track['url'] = f"{base_url}/api/stream?url={encoded_url}"
-            
-            track_model = Track(**track)
-            track_models.append(track_model)
-            cacheable_results.append(track_model.dict())
-        
-        # 3. Сохраняем в кэш
-        response_data = {
-            "results": cacheable_results,
-            "count": len(cacheable_results)
-        }
-        set_to_cache(cache_key, response_data)
-        
-        return {
-            "results": track_models,
-            "count": len(track_models),
+        if data["count"] >= limit:
+            next_key = make_cache_key("genre", {
+                "genre_id": genre_id,
+                "limit": limit,
+                "page": page + 1
+            })
+            if not is_cached(next_key):
+                schedule_prefetch(next_key, lambda: _load_genre_page(
+                    genre_id, limit, page + 1, user_agent, prefetched=True
+                ))
+        
+        return cached_json_response(request, {
+            "results": [Track(**t) for t in data["results"]],
+            "count": data["count"],
             "genre_id": genre_id
-        }
+        }, "genre")
         
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Загрузка жанра заняла слишком много времени")
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1164,95 +1452,558 @@ async def get_genre_tracks(
         )
 
 
+# --- Home Feed ---
+
+def _parse_home_genres(value: str) -> List[tuple]:
+    """Разбор HOME_GENRES вида "2:Поп,6:Рок" в список (genre_id, title)"""
+    genres = []
+    for item in value.split(","):
+        if ":" not in item:
+            continue
+        genre_id, title = item.split(":", 1)
+        try:
+            genres.append((int(genre_id.strip()), title.strip()))
+        except ValueError:
+            print(f"WARNING: Invalid HOME_GENRES entry: {item}")
+    return genres
+
+HOME_GENRES = _parse_home_genres(os.getenv("HOME_GENRES", "2:Поп,6:Рок,3:Хип-хоп,8:Электроника,11:Танцевальная,7:Альтернатива"))
+HOME_CHARTS = [("trending", "В тренде"), ("recent", "Новинки")]
+HOME_DEADLINE = float(os.getenv("HOME_DEADLINE", "8"))  # seconds for the whole feed
+# Shelves are loaded with the same page size as the frontend genre view,
+# so they share cache entries with /api/genre/{id}
+HOME_SHELF_PAGE_SIZE = 20
+
+class HomeShelf(BaseModel):
+    id: str
+    title: str
+    kind: str  # 'chart' или 'genre'
+    genre_id: Optional[int] = None
+    tracks: List[Track]
+
+class HomeResponse(BaseModel):
+    shelves: List[HomeShelf]
+    complete: bool  # False, если часть полок не уложилась в дедлайн
+
+
+@app.get("/api/home", response_model=HomeResponse)
+async def get_home_feed(
+    request: Request,
+    limit: int = Query(10, description="Количество треков на полке", ge=1, le=HOME_SHELF_PAGE_SIZE)
+):
+    """
+    Главная лента: чарты и полки жанров одним запросом.
+    Все полки загружаются параллельно под общим дедлайном.
+    """
+    cache_key = make_cache_key("home", {"limit": limit})
+    cached_data = get_from_cache(cache_key)
+    if cached_data:
+        return HomeResponse(**cached_data)
+    
+    user_agent = request.headers.get('user-agent')
+    
+    shelf_specs = [
+        {"id": chart, "title": title, "kind": "chart", "genre_id": None,
+         "loader": _load_chart_page(chart, HOME_SHELF_PAGE_SIZE, 1, user_agent)}
+        for chart, title in HOME_CHARTS
+    ] + [
+        {"id": f"genre_{genre_id}", "title": title, "kind": "genre", "genre_id": genre_id,
+         "loader": _load_genre_page(genre_id, HOME_SHELF_PAGE_SIZE, 1, user_agent)}
+        for genre_id, title in HOME_GENRES
+    ]
+    
+    tasks = [asyncio.create_task(spec.pop("loader")) for spec in shelf_specs]
+    # Полки, не успевшие к дедлайну, не отменяем: они догрузятся в фоне и прогреют кэш
+    done, pending = await asyncio.wait(tasks, timeout=HOME_DEADLINE)
+    
+    shelves = []
+    for spec, task in zip(shelf_specs, tasks):
+        if task not in done or task.exception() is not None:
+            continue
+        results = task.result()["results"][:limit]
+        if results:
+            shelves.append({**spec, "tracks": results})
+    
+    response_data = {
+        "shelves": shelves,
+        "complete": not pending
+    }
+    
+    # Кэшируем только полную ленту, чтобы неполная не закрепилась на весь TTL
+    if response_data["complete"]:
+        set_to_cache(cache_key, response_data)
+    
+    return HomeResponse(**response_data)
 
-from fastapi.responses import StreamingResponse
-import httpx
+
+
+import time
 
 from fastapi import Request
 from starlette.background import BackgroundTask
 
-@app.get("/api/stream")
-async def stream_audio(request: Request, url: str = Query(..., description="URL аудио файла")):
+# Возвращает свежий URL источника трека (поиск заново, как в stream_track)
+UrlRefresher = Callable[[], Awaitable[str]]
+
+async def _open_source(source: Dict[str, str], user_agent: Optional[str], range_header: Optional[str],
+                       refresh: Optional[UrlRefresher] = None):
     """
-    Проксирование аудио потока с поддержкой Range requests
+    Открывает upstream по source["url"]. Если ссылка истекла (403/404/410) и есть refresh,
+    находит трек заново и запоминает новый URL в source.
     """
-    if not url:
-        raise HTTPException(status_code=400, detail="URL is required")
+    try:
+        return await open_upstream(source["url"], user_agent, range_header)
+    except UpstreamError as e:
+        if refresh is None or e.status_code not in INVALIDATING_STATUSES:
+            raise
+    source["url"] = await refresh()
+    return await open_upstream(source["url"], user_agent, range_header)
+
+
+async def _fetch_upstream_range(source: Dict[str, str], user_agent: Optional[str], start: int, end: int,
+                                refresh: Optional[UrlRefresher] = None):
+    """Читает байты [start, end] оригинального файла с upstream (с переподключением при обрыве)"""
+    started = time.monotonic()
+    client, r = await _open_source(source, user_agent, f"bytes={start}-{end}", refresh)
+    body = resume_body(source["url"], user_agent, client, r, started, start, end)
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        await body.aclose()
+
+
+async def _audio_file_meta(url: str, user_agent: Optional[str], key: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Размер и тип файла для дискового кэша и признак того, что upstream только что ответил.
+    meta = None, если размер неизвестен (live-поток) или upstream недоступен.
+    """
+    if audio_cache.is_uncacheable(key):
+        return None, False
     
-    # Load proxies
-    import os
-    import random
-    proxy_list_str = os.getenv("PROXY_LIST", "")
-    proxy_list = [p.strip() for p in proxy_list_str.split(",") if p.strip()]
+    meta = await audio_cache.get_meta(key)
+    if meta is not None:
+        return meta, False
     
-    proxies = None
-    if proxy_list:
-        proxy = random.choice(proxy_list)
-        proxies = {"http://": proxy, "https://": proxy}
-        print(f"Using proxy for stream: {proxy}")
+    resolved = get_resolved(url)
+    if resolved and resolved["size"]:
+        # Размер уже известен из кэша редиректов - пробный запрос не нужен
+        return await audio_cache.set_meta(key, resolved["size"], resolved["content_type"]), False
     
-    # Timeout configuration
-    timeout = httpx.Timeout(15.0, read=None)
-    client = httpx.AsyncClient(follow_redirects=True, timeout=timeout, proxies=proxies)
+    # Первое обращение к файлу: узнаем размер и тип одним байтом
+    try:
+        client, r = await open_upstream(url, user_agent, "bytes=0-0")
+    except Exception as e:
+        print(f"Audio cache probe failed for {url}: {e}")
+        return None, False
+    size = parse_total_size(r)
+    content_type = r.headers.get("content-type")
+    await r.aclose()
+    await client.aclose()
+    
+    if not size:
+        audio_cache.mark_uncacheable(key)
+        return None, False
+    return await audio_cache.set_meta(key, size, content_type), True
+
+
+def _cached_fetch(source: Dict[str, str], user_agent: Optional[str], key: str, refresh: Optional[UrlRefresher] = None):
+    """Функция дозагрузки недостающих блоков кэша с upstream"""
+    def fetch_independent(gap_start: int, gap_end: int):
+        return _fetch_upstream_range(source, user_agent, gap_start, gap_end, refresh)
+    
+    # Параллельные слушатели одного файла делят одно соединение с upstream
+    def fetch(gap_start: int, gap_end: int):
+        return shared_fetch(key, gap_start, gap_end, fetch_independent)
+    
+    return fetch
+
+
+async def _stream_from_cache(
+    url: str,
+    user_agent: Optional[str],
+    range_header: Optional[str],
+    cache_identity: str,
+    extra_headers: Dict[str, str],
+    refresh: Optional[UrlRefresher] = None
+):
+    """
+    Отдача через дисковый кэш блоков.
+    Возвращает None, если файл нельзя кэшировать (нет размера, live-поток, сложный Range).
+    """
+    key = audio_cache.key_for(cache_identity)
+    meta, upstream_checked = await _audio_file_meta(url, user_agent, key)
+    if meta is None:
+        return None
     
-    # Forward User-Agent from request or use default
-    user_agent = request.headers.get('user-agent')
-    if not user_agent:
-        user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    size = meta["size"]
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return None
+    start, end = byte_range or (0, size - 1)
+    
+    source = {"url": url}
+    gap = audio_cache.first_missing(key, size, start, end)
+    if gap is not None and not upstream_checked:
+        # Недостающие блоки докачиваются уже после отправки заголовков.
+        # Проверяем ссылку заранее, чтобы истекшая ссылка дала ошибку, а не обрезанный 200
+        client, r = await _open_source(source, user_agent, f"bytes={gap}-{gap}", refresh)
+        await r.aclose()
+        await client.aclose()
     
-    headers = {
-        'User-Agent': user_agent,
-        'Accept': '*/*',
-        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        **extra_headers
     }
+    if byte_range:
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    return CachedRangeResponse(
+        audio_cache.iter_range(key, size, start, end, _cached_fetch(source, user_agent, key, refresh)),
+        status_code=206 if byte_range else 200,
+        headers=response_headers,
+        media_type=meta["content_type"]
+    )
+
+
+async def _fetch_upstream_file(url: str, user_agent: Optional[str], refresh: Optional[UrlRefresher] = None):
+    """Читает файл с upstream целиком (источник для транскодера)"""
+    started = time.monotonic()
+    source = {"url": url}
+    client, r = await _open_source(source, user_agent, None, refresh)
+    size = parse_total_size(r)
+    if size:
+        body = resume_body(source["url"], user_agent, client, r, started, 0, size - 1)
+    else:
+        body = relay_body(r, started)
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        await body.aclose()
+        await r.aclose()
+        await client.aclose()
+
+
+async def _serve_transcoded(
+    url: str,
+    user_agent: Optional[str],
+    range_header: Optional[str],
+    cache_identity: str,
+    quality: str,
+    extra_headers: Dict[str, str],
+    refresh: Optional[UrlRefresher] = None
+):
+    """
+    Отдача в пониженном битрейте через ffmpeg.
+    Возвращает None, если транскодирование недоступно (нет ffmpeg, все слоты заняты)
+    или кодирование сорвалось до первых байтов - тогда отдается оригинал.
+    """
+    result = await transcode(
+        cache_identity,
+        quality,
+        lambda: _fetch_upstream_file(url, user_agent, refresh),
+        range_header
+    )
+    if result is None:
+        return None
+    
+    response_headers = dict(extra_headers)
+    size = result["size"]
+    if size is None:
+        # Кодирование еще идет: размер неизвестен, перемотка недоступна
+        response_headers["Accept-Ranges"] = "none"
+        response_headers["Cache-Control"] = "no-store"
+    else:
+        start, end = result["range"] or (0, size - 1)
+        response_headers["Accept-Ranges"] = "bytes"
+        response_headers["Content-Length"] = str(end - start + 1)
+        if result["range"]:
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    return CachedRangeResponse(
+        result["body"],
+        status_code=206 if result["range"] else 200,
+        headers=response_headers,
+        media_type=result["media_type"]
+    )
+
+
+async def _serve_stream(
+    url: str,
+    user_agent: Optional[str],
+    range_header: Optional[str],
+    cache_identity: str,
+    extra_headers: Optional[Dict[str, str]] = None,
+    quality: Optional[str] = None,
+    refresh: Optional[UrlRefresher] = None
+):
+    """
+    Отдает аудио через дисковый кэш, а если файл нельзя кэшировать - прямым проксированием.
+    С quality - в пониженном битрейте, если транскодер доступен.
+    refresh находит свежий URL, если ссылка истечет во время отдачи из кэша или транскодирования.
+    Ошибки upstream пробрасываются как UpstreamError.
+    """
+    extra_headers = extra_headers or {}
     
-    if "hitmotop.com" in url:
-        headers['Referer'] = 'https://rus.hitmotop.com/'
-        headers['Origin'] = 'https://rus.hitmotop.com'
+    if quality:
+        transcoded_response = await _serve_transcoded(
+            url, user_agent, range_header, cache_identity, quality, extra_headers, refresh
+        )
+        if transcoded_response is not None:
+            return transcoded_response
+    
+    if audio_cache is not None:
+        cached_response = await _stream_from_cache(url, user_agent, range_header, cache_identity, extra_headers, refresh)
+        if cached_response is not None:
+            return cached_response
+    
+    started = time.monotonic()
+    client, r = await open_upstream(url, user_agent, range_header)
     
-    range_header = request.headers.get("range")
-    if range_header:
-        headers['Range'] = range_header
-        
     async def close_client():
+        await r.aclose()
         await client.aclose()
-        
+    
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        **extra_headers
+    }
+    
+    if "content-length" in r.headers:
+        response_headers["Content-Length"] = r.headers["content-length"]
+    if "content-range" in r.headers:
+        response_headers["Content-Range"] = r.headers["content-range"]
+    if "content-type" in r.headers:
+        response_headers["Content-Type"] = r.headers["content-type"]
+    if "content-encoding" in r.headers:
+        # Тело передается как есть, без распаковки
+        response_headers["Content-Encoding"] = r.headers["content-encoding"]
+    
+    # Известен диапазон байтов - при обрыве upstream докачиваем с места разрыва
+    span = parse_body_span(r)
+    if span and "content-encoding" not in r.headers:
+        body = resume_body(url, user_agent, client, r, started, span[0], span[1])
+    else:
+        body = relay_body(r, started)
+        
+    return ClosingStreamingResponse(
+        body,
+        status_code=r.status_code,
+        headers=response_headers,
+        media_type=r.headers.get("content-type"),
+        background=BackgroundTask(close_client)
+    )
+
+
+def _stream_error(e: Exception) -> HTTPException:
+    """Преобразует ошибку upstream в ответ клиенту"""
+    if isinstance(e, UpstreamError):
+        # If 403/429, it might be blocking.
+        if e.status_code in [403, 429]:
+            return HTTPException(status_code=503, detail="Source blocked request")
+        return HTTPException(status_code=e.status_code, detail="Upstream error")
+    print(f"Error streaming audio: {type(e).__name__}: {e}")
+    return HTTPException(status_code=500, detail=f"Stream error: {str(e)}")
+
+
+# Поток по подписанной ссылке не зависит от upstream URL - его можно кэшировать на CDN.
+# Но если ключ подписи случайный, после перезапуска ссылки станут недействительны
+STREAM_HANDLE_CACHE_CONTROL = (
+    os.getenv("STREAM_HANDLE_CACHE_CONTROL", "public, max-age=604800, immutable") if HANDLES_STABLE else "no-cache"
+)
+
+# Устаревший /api/stream?url= проксирует только аудио Hitmo (домены и их поддомены)
+STREAM_PROXY_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("STREAM_PROXY_ALLOWED_HOSTS", "hitmotop.com").split(",") if host.strip()
+]
+
+
+def _is_allowed_stream_url(url: str) -> bool:
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        return False
+    return any(host == allowed or host.endswith("." + allowed) for allowed in STREAM_PROXY_ALLOWED_HOSTS)
+
+
+def _check_quality(quality: Optional[str]) -> None:
+    if quality and quality not in QUALITY_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown quality, expected one of: {', '.join(QUALITY_PRESETS)}"
+        )
+
+
+async def _acquire_stream(request: Request, init_data: Optional[str]) -> Optional[StreamLease]:
+    """
+    Слот потока пользователя и IP; 429, если очередь не освободилась.
+    Пользователь берется только из подписанного Telegram initData
+    (параметр init_data или заголовок X-Telegram-Init-Data), иначе лимит - по IP.
+    """
+    user_id = verify_init_data(init_data or request.headers.get("x-telegram-init-data", ""))
     try:
-        req = client.build_request("GET", url, headers=headers)
-        r = await client.send(req, stream=True)
-        
-        if r.status_code >= 400:
-            print(f"Stream error status: {r.status_code} for {url}")
-            await client.aclose()
-            # If 403/429, it might be blocking.
-            if r.status_code in [403, 429]:
-                 raise HTTPException(status_code=503, detail="Source blocked request")
-            raise HTTPException(status_code=r.status_code, detail="Upstream error")
-
-        response_headers = {
-            "Accept-Ranges": "bytes",
-        }
-        
-        if "content-length" in r.headers:
-            response_headers["Content-Length"] = r.headers["content-length"]
-        if "content-range" in r.headers:
-            response_headers["Content-Range"] = r.headers["content-range"]
-        if "content-type" in r.headers:
-            response_headers["Content-Type"] = r.headers["content-type"]
-            
-        return StreamingResponse(
-            r.aiter_bytes(),
-            status_code=r.status_code,
-            headers=response_headers,
-            media_type=r.headers.get("content-type"),
-            background=BackgroundTask(close_client)
+        return await acquire_stream(request, user_id)
+    except StreamLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many concurrent streams",
+            headers={"Retry-After": str(e.retry_after)}
         )
-    except HTTPException:
-        raise
+
+
+def _track_url_refresher(track_id: str, user_agent: Optional[str]) -> UrlRefresher:
+    """Повторный поиск трека в обход кэша реестра, когда ссылка Hitmo истекла раньше TTL"""
+    async def refresh() -> str:
+        entry = await resolve_track(track_id, parser, user_agent=user_agent, force=True)
+        if not entry:
+            raise UpstreamError(404)
+        return entry['url']
+    return refresh
+
+
+@app.get("/api/stream/{handle}")
+async def stream_track(
+    request: Request,
+    handle: str,
+    quality: Optional[str] = Query(None, description="Пониженное качество: low, medium, aac-low, aac-medium"),
+    init_data: Optional[str] = Query(None, description="Telegram.WebApp.initData слушателя (для лимитов потоков)")
+):
+    """
+    Проксирование аудио трека по короткой подписанной ссылке.
+    Актуальный URL источника берется из реестра треков.
+    """
+    _check_quality(quality)
+    track_id = parse_handle(handle)
+    if not track_id:
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    user_agent = request.headers.get('user-agent')
+    range_header = request.headers.get("range")
+    
+    entry = await resolve_track(track_id, parser, user_agent=user_agent)
+    if not entry or entry['source'] != 'hitmo':
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    headers = {"Cache-Control": STREAM_HANDLE_CACHE_CONTROL}
+    refresh = _track_url_refresher(track_id, user_agent)
+    lease = await _acquire_stream(request, init_data)
+    try:
+        try:
+            response = await _serve_stream(entry['url'], user_agent, range_header, f"track:{track_id}", headers, quality, refresh)
+        except UpstreamError as e:
+            if e.status_code not in INVALIDATING_STATUSES:
+                raise
+            # Ссылка Hitmo истекла раньше TTL - ищем трек заново
+            response = await _serve_stream(await refresh(), user_agent, range_header, f"track:{track_id}", headers, quality, refresh)
     except Exception as e:
-        await client.aclose()
-        print(f"Error streaming audio: {type(e).__name__}: {e}")
-        raise HTTPException(status_code=500, detail=f"Stream error: {str(e)}")
+        if lease:
+            lease.release()
+        raise _stream_error(e)
+    return limit_response(response, lease)
+
+
+@app.get("/api/stream")
+async def stream_audio(
+    request: Request,
+    url: str = Query(..., description="URL аудио файла"),
+    quality: Optional[str] = Query(None, description="Пониженное качество: low, medium, aac-low, aac-medium"),
+    init_data: Optional[str] = Query(None, description="Telegram.WebApp.initData слушателя (для лимитов потоков)")
+):
+    """
+    Проксирование аудио потока с поддержкой Range requests.
+    Файлы с известным размером отдаются через дисковый кэш блоков.
+    """
+    if not url:
+        raise HTTPException(status_code=400, detail="URL is required")
+    if not _is_allowed_stream_url(url):
+        raise HTTPException(status_code=403, detail="Source not allowed")
+    _check_quality(quality)
+    
+    # Forward User-Agent from request or use default
+    user_agent = request.headers.get('user-agent')
+    range_header = request.headers.get("range")
+    
+    lease = await _acquire_stream(request, init_data)
+    try:
+        response = await _serve_stream(url, user_agent, range_header, url, quality=quality)
+    except Exception as e:
+        if lease:
+            lease.release()
+        raise _stream_error(e)
+    return limit_response(response, lease)
+
+# --- HLS ---
+
+HLS_PLAYLIST_CACHE_CONTROL = "public, max-age=86400" if HANDLES_STABLE else "no-cache"
+HLS_SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable" if HANDLES_STABLE else "no-cache"
+
+
+async def _hls_track(request: Request, handle: str):
+    """Ключ кэша, раскладка сегментов и чтение байтов файла для HLS"""
+    if segment_store is None or audio_cache is None:
+        raise HTTPException(status_code=503, detail="HLS is not available")
+    
+    track_id = parse_handle(handle)
+    if not track_id:
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    user_agent = request.headers.get('user-agent')
+    entry = await resolve_track(track_id, parser, user_agent=user_agent)
+    if not entry or entry['source'] != 'hitmo':
+        raise HTTPException(status_code=404, detail="Track not found")
+    
+    key = audio_cache.key_for(f"track:{track_id}")
+    meta, _ = await _audio_file_meta(entry['url'], user_agent, key)
+    if meta is None:
+        raise HTTPException(status_code=503, detail="Source unavailable")
+    
+    fetch = _cached_fetch({"url": entry['url']}, user_agent, key, _track_url_refresher(track_id, user_agent))
+    
+    async def read_range(start: int, end: int) -> bytes:
+        return await audio_cache.read_range(key, meta["size"], start, end, fetch)
+    
+    try:
+        layout = await get_layout(key, meta["size"], entry['duration'], read_range)
+    except Exception as e:
+        raise _stream_error(e)
+    if layout is None:
+        raise HTTPException(status_code=415, detail="Track is not an MP3 file")
+    return key, layout, read_range
+
+
+@app.get("/api/hls/{handle}/index.m3u8")
+async def hls_playlist(request: Request, handle: str):
+    """
+    HLS-плейлист трека (handle - та же подписанная ссылка, что и в /api/stream/{handle}).
+    Сегменты нарезаются при первом запросе и хранятся на диске.
+    """
+    _, layout, _ = await _hls_track(request, handle)
+    return Response(
+        content=build_playlist(layout),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": HLS_PLAYLIST_CACHE_CONTROL}
+    )
+
+
+@app.get("/api/hls/{handle}/{index}.mp3")
+async def hls_segment(request: Request, handle: str, index: int):
+    """Сегмент HLS (MPEG audio с ID3-меткой времени)"""
+    key, layout, read_range = await _hls_track(request, handle)
+    try:
+        path = await get_segment(key, index, layout, read_range)
+    except Exception as e:
+        raise _stream_error(e)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    
+    return FileResponse(
+        path,
+        media_type="audio/mpeg",
+        headers={"Cache-Control": HLS_SEGMENT_CACHE_CONTROL}
+    )
 
 # --- Download to Chat Endpoints ---
 
@@ -1260,159 +2011,140 @@ class DownloadToChatRequest(BaseModel):
     user_id: int
     track: Track
 
-@app.post("/api/download/chat")
+class DownloadBatchToChatRequest(BaseModel):
+    user_id: int
+    tracks: List[Track]
+
+# Максимум треков в одной пакетной отправке
+DOWNLOAD_BATCH_MAX_TRACKS = int(os.getenv("DOWNLOAD_BATCH_MAX_TRACKS", "100"))
+
+def _protect_content(user: Optional[User]) -> bool:
+    """Premium Pro может пересылать треки, обычные пользователи - нет"""
+    return not (user and user.is_premium_pro)
+
+async def _hitmo_source_url(track: Track) -> Optional[str]:
+    """URL трека на Hitmo для ссылки /api/stream/<handle> (Telegram может скачать его сам)"""
+    path = track.url.split("?", 1)[0]
+    if "/api/stream/" not in path:
+        return None
+    track_id = parse_handle(path.rsplit("/", 1)[-1])
+    if not track_id:
+        return None
+    try:
+        entry = await resolve_track(track_id, parser)
+    except Exception as e:
+        print(f"Failed to resolve track {track_id} for chat delivery: {e}")
+        return None
+    if not entry or entry['source'] != 'hitmo':
+        return None
+    return entry['url']
+
+async def _deliver_download_job(db: Session, job, progress: Dict[str, Any]) -> int:
+    """Выполняет задачу очереди: отправляет трек в чат пользователя"""
+    track = Track(**json.loads(job.track_json))
+    
+    # Проверить статус подписки пользователя
+    user = db.query(User).filter(User.id == job.user_id).first()
+    protect_content = _protect_content(user)
+    
+    def on_progress(sent: int, total: Optional[int]):
+        progress.update(stage="uploading", bytes_sent=sent, bytes_total=total)
+    
+    # 1. Send to Telegram (по сохраненному file_id, по ссылке или загрузкой файла)
+    source_url = await _hitmo_source_url(track)
+    message = await send_track_to_chat(db, job.user_id, track, protect_content, on_progress, source_url)
+    message_id = message['message_id']
+    
+    # 2. Save to database
+    downloaded_msg = DownloadedMessage(
+        user_id=job.user_id,
+        chat_id=job.user_id,
+        message_id=message_id,
+        track_id=track.id
+    )
+    db.add(downloaded_msg)
+    
+    # 3. Increment download count
+    if user:
+        user.download_count = (user.download_count or 0) + 1
+    
+    db.commit()
+    return message_id
+
+async def _deliver_download_batch(db: Session, job, progress: Dict[str, Any]) -> Optional[int]:
+    """Выполняет пакетную задачу: отправляет треки плейлиста по порядку, продолжая с места остановки"""
+    tracks = [Track(**track) for track in json.loads(job.track_json)]
+    user = db.query(User).filter(User.id == job.user_id).first()
+    
+    progress.update(stage="sending", tracks_total=len(tracks), tracks_sent=job.items_done or 0, tracks_skipped=0)
+    
+    def on_sent(next_index: int, sent: List[Track], messages: List[Dict[str, Any]], skipped: List[Track]):
+        for track, message in zip(sent, messages):
+            db.add(DownloadedMessage(
+                user_id=job.user_id,
+                chat_id=job.user_id,
+                message_id=message['message_id'],
+                track_id=track.id
+            ))
+        if user:
+            user.download_count = (user.download_count or 0) + len(sent)
+        job.items_done = next_index
+        db.commit()
+        progress["tracks_sent"] = next_index
+        progress["tracks_skipped"] += len(skipped)
+    
+    return await send_tracks_to_chat(db, job.user_id, tracks, _protect_content(user), job.items_done or 0, on_sent,
+                                     resolve_source=_hitmo_source_url)
+
+@app.post("/api/download/chat", status_code=202)
 async def download_to_chat(request: DownloadToChatRequest, db: Session = Depends(get_db)):
     """
-    Download track to users Telegram chat via bot
+    Ставит отправку трека в чат пользователя в очередь.
+    Повторное нажатие для того же трека возвращает уже созданную задачу.
     """
     if not BOT_TOKEN:
         raise HTTPException(status_code=500, detail="Bot token not configured")
     
-    try:
-        # Проверить статус подписки пользователя
-        user = db.query(User).filter(User.id == request.user_id).first()
-        
-        # Premium Pro может пересылать треки, обычные пользователи - нет
-        protect_content = True
-        if user and user.is_premium_pro:
-            protect_content = False
-        
-        # 1. Download audio file from URL
-        # Проверяем, является ли это YouTube треком
-        is_youtube = 'youtube.com' in request.track.url or 'youtu.be' in request.track.url
-        
-        if is_youtube:
-            # Для YouTube используем yt-dlp
-            import yt_dlp
-            import os
-            import tempfile
-            
-            print(f"📥 Downloading YouTube track for chat: {request.track.url}")
-            
-            # Create temp directory
-            temp_dir = tempfile.mkdtemp()
-            temp_path = os.path.join(temp_dir, 'audio')
-            
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': temp_path,
-                'quiet': False,
-                'no_warnings': False,
-                'ffmpeg_location': r'C:\ffmpeg-2025-11-27-git-61b034a47c-essentials_build\bin',
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web'],
-                        'skip': ['dash', 'hls']
-                    }
-                },
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-            }
-            
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([request.track.url])
-                
-                # Find the downloaded file
-                downloaded_file = None
-                if os.path.exists(temp_path):
-                    downloaded_file = temp_path
-                else:
-                    for ext in ['.mp3', '.webm', '.m4a', '.opus', '.mp4']:
-                        test_path = temp_path + ext
-                        if os.path.exists(test_path):
-                            downloaded_file = test_path
-                            break
-                
-                if not downloaded_file:
-                    files_in_dir = os.listdir(temp_dir) if os.path.exists(temp_dir) else []
-                    raise Exception(f"Downloaded file not found. Dir contents: {files_in_dir}")
-                
-                # Read file content
-                with open(downloaded_file, 'rb') as f:
-                    audio_data = f.read()
-                
-                print(f"✅ YouTube track downloaded: {len(audio_data)} bytes")
-                
-            finally:
-                # Cleanup temp directory
-                try:
-                    import shutil
-                    if os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
-                        print(f"🗑️ Cleaned up: {temp_dir}")
-                except Exception as e:
-                    print(f"Error cleaning up temp dir: {e}")
-        else:
-            # Для обычных треков используем httpx (увеличен timeout для больших файлов)
-            async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as client:
-                audio_response = await client.get(request.track.url)
-                audio_response.raise_for_status()
-                audio_data = audio_response.content
-        
-        # 2. Send to Telegram
-        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendAudio"
-        
-        files = {
-            'audio': ('track.mp3', audio_data, 'audio/mpeg')
-        }
-        
-        # Скачиваем обложку, если есть
-        thumbnail_data = None
-        if request.track.image:
-            try:
-                async with httpx.AsyncClient(timeout=30.0) as thumb_client:
-                    thumb_response = await thumb_client.get(request.track.image)
-                    if thumb_response.status_code == 200:
-                        thumbnail_data = thumb_response.content
-                        files['thumbnail'] = ('thumb.jpg', thumbnail_data, 'image/jpeg')
-            except Exception as e:
-                print(f"Failed to download thumbnail: {e}")
-        
-        data = {
-            'chat_id': request.user_id,
-            'title': request.track.title,
-            'performer': request.track.artist,
-            'duration': request.track.duration if request.track.duration > 0 else None,
-            'protect_content': protect_content  # Premium Pro может пересылать
-        }
-        
-        # 2. Send to Telegram (увеличен timeout для загрузки больших файлов)
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            response = await client.post(telegram_url, files=files, data=data)
-            response.raise_for_status()
-            result = response.json()
-        
-        message_id = result['result']['message_id']
-        
-        # 3. Save to database
-        downloaded_msg = DownloadedMessage(
-            user_id=request.user_id,
-            chat_id=request.user_id,
-            message_id=message_id,
-            track_id=request.track.id
-        )
-        db.add(downloaded_msg)
-        
-        # 4. Increment download count
-        if user:
-            user.download_count = (user.download_count or 0) + 1
-        
-        db.commit()
-        
-        return {
-            "status": "ok",
-            "message": "Track sent to chat",
-            "message_id": message_id
-        }
-        
-    except Exception as e:
-        print(f"Error downloading to chat: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    job, created = enqueue_download(db, request.user_id, request.track.dict())
+    return {
+        "message": "Track queued" if created else "Track already queued",
+        "duplicate": not created,
+        **job_to_dict(db, job)
+    }
+
+@app.post("/api/download/chat/batch", status_code=202)
+async def download_batch_to_chat(request: DownloadBatchToChatRequest, db: Session = Depends(get_db)):
+    """
+    Ставит отправку плейлиста/альбома в чат в очередь.
+    Треки приходят в чат по порядку, группами до 10 (sendMediaGroup).
+    """
+    if not BOT_TOKEN:
+        raise HTTPException(status_code=500, detail="Bot token not configured")
+    if not request.tracks:
+        raise HTTPException(status_code=400, detail="No tracks")
+    if len(request.tracks) > DOWNLOAD_BATCH_MAX_TRACKS:
+        raise HTTPException(status_code=400, detail=f"Too many tracks, maximum is {DOWNLOAD_BATCH_MAX_TRACKS}")
+    
+    job, created = enqueue_download_batch(db, request.user_id, [track.dict() for track in request.tracks])
+    return {
+        "message": "Tracks queued" if created else "Tracks already queued",
+        "duplicate": not created,
+        **job_to_dict(db, job)
+    }
+
+@app.get("/api/download/jobs")
+async def list_download_jobs(user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Последние задачи отправки в чат пользователя"""
+    jobs = db.query(DownloadJob).filter(DownloadJob.user_id == user_id).order_by(DownloadJob.created_at.desc()).limit(20).all()
+    return {"jobs": [job_to_dict(db, job) for job in jobs]}
+
+@app.get("/api/download/jobs/{job_id}")
+async def get_download_job(job_id: str, user_id: int = Query(...), db: Session = Depends(get_db)):
+    """Статус и прогресс задачи отправки в чат"""
+    job = get_download_job_by_id(db, job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(db, job)
 
 @app.post("/api/debug/expire_downloads")
 async def expire_downloads(user_id: int = Query(...), db: Session = Depends(get_db)):
@@ -1430,20 +2162,7 @@ async def expire_downloads(user_id: int = Query(...), db: Session = Depends(get_
             return {"status": "ok", "message": "No messages to delete", "deleted_count": 0}
         
         # 2. Delete from Telegram
-        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/deleteMessage"
-        deleted_count = 0
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            for msg in messages:
-                try:
-                    response = await client.post(telegram_url, json={
-                        'chat_id': msg.chat_id,
-                        'message_id': msg.message_id
-                    })
-                    if response.status_code == 200:
-                        deleted_count += 1
-                except Exception as e:
-                    print(f"Failed to delete message {msg.message_id}: {e}")
+        deleted_count = await _delete_messages(messages, PRIORITY_USER)
         
         # 3. Delete from database
         db.query(DownloadedMessage).filter(DownloadedMessage.user_id == user_id).delete()
@@ -1506,14 +2225,16 @@ async def get_youtube_info(request: YouTubeRequest):
                 
             print(f"YouTube track created: id={video_id}, url={original_url}")
                 
-            return Track(
+            track = Track(
                 id=f"yt_{video_id}",
                 title=track_title,
                 artist=artist,
-                duration=duration,
+                duration=duration or 0,
                 url=original_url,  # Оригинальная YouTube ссылка
                 image=thumbnail
             )
+            register_track(track.dict())
+            return track
             
     except Exception as e:
         print(f"Error extracting YouTube info: {e}")
@@ -1642,6 +2363,7 @@ class LyricsResponse(BaseModel):
 
 @app.get("/api/lyrics/{track_id}", response_model=LyricsResponse)
 async def get_lyrics(
+    request: Request,
     track_id: str,
     title: str = Query(..., description="Song title"),
     artist: str = Query(..., description="Artist name"),
@@ -1657,13 +2379,13 @@ async def get_lyrics(
         
         if cached_lyrics:
             print(f"Lyrics found in cache for: {artist} - {title}")
-            return LyricsResponse(
+            return cached_json_response(request, LyricsResponse(
                 track_id=cached_lyrics.track_id,
                 title=cached_lyrics.title,
                 artist=cached_lyrics.artist,
                 lyrics_text=cached_lyrics.lyrics_text,
                 source=cached_lyrics.source
-            )
+            ), "lyrics")
         
         # 2. Fetch from Genius API
         if not lyrics_service:
@@ -1694,13 +2416,13 @@ async def get_lyrics(
         
         print(f"Lyrics cached for: {artist} - {title}")
         
-        return LyricsResponse(
+        return cached_json_response(request, LyricsResponse(
             track_id=new_lyrics.track_id,
             title=new_lyrics.title,
             artist=new_lyrics.artist,
             lyrics_text=new_lyrics.lyrics_text,
             source=new_lyrics.source
-        )
+        ), "lyrics")
         
     except HTTPException:
         raise
@@ -1785,20 +2507,16 @@ async def register_referral(
     # Send notification to referrer via Telegram
     if BOT_TOKEN:
         try:
-            import httpx
-            telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-            
             # Get new user name
             new_user_name = user.first_name or user.username or f"Пользователь {user.id}"
             
-            async with httpx.AsyncClient() as client:
-                await client.post(telegram_url, json={
-                    'chat_id': referrer.id,
-                    'text': f"🎉 <b>Новый реферал!</b>\n\n"
-                            f"{new_user_name} зарегистрировался по вашей ссылке.\n"
-                            f"Когда он оформит подписку, вы получите +30 дней Premium!",
-                    'parse_mode': 'HTML'
-                })
+            await telegram_call("sendMessage", {
+                'chat_id': referrer.id,
+                'text': f"🎉 <b>Новый реферал!</b>\n\n"
+                        f"{new_user_name} зарегистрировался по вашей ссылке.\n"
+                        f"Когда он оформит подписку, вы получите +30 дней Premium!",
+                'parse_mode': 'HTML'
+            }, priority=PRIORITY_USER, chat_id=referrer.id)
         except Exception as e:
             print(f"Failed to send referral joined notification: {e}")
     
@@ -1887,16 +2605,13 @@ async def complete_payment(
     # Send premium activation notification
     if BOT_TOKEN:
         try:
-            import httpx
-            telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-            async with httpx.AsyncClient() as client:
-                await client.post(telegram_url, json={
-                    'chat_id': user_id,
-                    'text': f"✨ <b>Premium активирован!</b>\n\n"
-                            f"Ваша подписка активна до {expires_at.strftime('%d.%m.%Y')}\n"
-                            f"Осталось дней: {(expires_at - datetime.utcnow()).days}",
-                    'parse_mode': 'HTML'
-                })
+            await telegram_call("sendMessage", {
+                'chat_id': user_id,
+                'text': f"✨ <b>Premium активирован!</b>\n\n"
+                        f"Ваша подписка активна до {expires_at.strftime('%d.%m.%Y')}\n"
+                        f"Осталось дней: {(expires_at - datetime.utcnow()).days}",
+                'parse_mode': 'HTML'
+            }, priority=PRIORITY_PAYMENT, chat_id=user_id)
         except Exception as e:
             print(f"Failed to send premium activation notification: {e}")
     
@@ -1924,20 +2639,16 @@ async def complete_payment(
                 # Send notification to referrer
                 if BOT_TOKEN:
                     try:
-                        import httpx
-                        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                        
                         # Get referred user name
                         referred_name = user.first_name or user.username or f"User {user.id}"
                         
-                        async with httpx.AsyncClient() as client:
-                            await client.post(telegram_url, json={
-                                'chat_id': referrer.id,
-                                'text': f"💎 <b>Бонус получен!</b>\n\n"
-                                        f"{referred_name} оформил подписку!\n"
-                                        f"Вы получили +30 дней Premium до {referrer_expires.strftime('%d.%m.%Y')}!",
-                                'parse_mode': 'HTML'
-                            })
+                        await telegram_call("sendMessage", {
+                            'chat_id': referrer.id,
+                            'text': f"💎 <b>Бонус получен!</b>\n\n"
+                                    f"{referred_name} оформил подписку!\n"
+                                    f"Вы получили +30 дней Premium до {referrer_expires.strftime('%d.%m.%Y')}!",
+                            'parse_mode': 'HTML'
+                        }, priority=PRIORITY_PAYMENT, chat_id=referrer.id)
                     except Exception as e:
                         print(f"Failed to send referral notification: {e}")
     
@@ -1951,6 +2662,9 @@ async def complete_payment(
 @app.on_event("shutdown")
 async def shutdown_event():
     """Закрытие ресурсов при остановке приложения"""
+    for task in background_tasks:
+        task.cancel()
+    await close_telegram_client()
     parser.close()
 
 
@@ -0,0 +1,48 @@
+"""
+Database Migration Script
+Adds kind and items_done columns to download_jobs table (batch send to chat)
+"""
+
+import sqlite3
+import os
+
+DB_PATH = "./users.db"
+
+COLUMNS = {
+    "kind": "ALTER TABLE download_jobs ADD COLUMN kind VARCHAR DEFAULT 'track'",
+    "items_done": "ALTER TABLE download_jobs ADD COLUMN items_done INTEGER DEFAULT 0"
+}
+
+def migrate():
+    if not os.path.exists(DB_PATH):
+        print("Database doesn't exist yet. No migration needed.")
+        return
+    
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    # Check which columns already exist
+    cursor.execute("PRAGMA table_info(download_jobs)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    if not columns:
+        print("Table 'download_jobs' doesn't exist yet. It will be created on startup.")
+        conn.close()
+        return
+    
+    try:
+        for name, statement in COLUMNS.items():
+            if name in columns:
+                print(f"Column '{name}' already exists.")
+                continue
+            cursor.execute(statement)
+            print(f"✅ Successfully added '{name}' column to download_jobs table")
+        conn.commit()
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,101 @@
+"""
+MPEG audio / ADTS frame header helpers.
+
+Used to find safe cut points in MP3 and AAC byte streams: radio late joiners
+start on a frame boundary, the radio monitor reads the bitrate, and HLS
+segments are cut between frames.
+"""
+
+from typing import Any, Dict, Optional
+
+# Highest valid ADTS sampling frequency index (13-15 are reserved)
+ADTS_MAX_SAMPLING_INDEX = 12
+
+# MPEG Layer III bitrates (kbps) by bitrate index, for MPEG-1 and MPEG-2/2.5
+MP3_BITRATES = {
+    "mpeg1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "mpeg2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+
+# Sample rates by the 2-bit version field (11 = MPEG-1, 10 = MPEG-2, 00 = MPEG-2.5)
+SAMPLE_RATES = {
+    0x03: [44100, 48000, 32000],
+    0x02: [22050, 24000, 16000],
+    0x00: [11025, 12000, 8000]
+}
+
+
+def find_frame_start(data: bytes, content_type: Optional[str], start: int = 0) -> int:
+    """
+    Offset of the first plausible MP3 or AAC ADTS frame header at or after
+    start, or -1.
+    """
+    is_aac = "aac" in (content_type or "")
+    for i in range(start, len(data) - 3):
+        if data[i] != 0xFF:
+            continue
+        b1, b2 = data[i + 1], data[i + 2]
+        if is_aac:
+            # ADTS: 12-bit sync, layer 00, valid sampling frequency index
+            if b1 & 0xF6 == 0xF0 and (b2 >> 2) & 0x0F <= ADTS_MAX_SAMPLING_INDEX:
+                return i
+        else:
+            # MPEG audio: 11-bit sync, version != reserved, layer != reserved,
+            # bitrate index not free/bad, sample rate index not reserved
+            if (b1 & 0xE0 == 0xE0 and (b1 >> 3) & 0x03 != 0x01 and (b1 >> 1) & 0x03 != 0x00
+                    and (b2 >> 4) not in (0x0, 0xF) and (b2 >> 2) & 0x03 != 0x03):
+                return i
+    return -1
+
+
+def parse_mp3_header(data: bytes, offset: int) -> Optional[Dict[str, Any]]:
+    """
+    Decodes the MPEG Layer III frame header at offset:
+    bitrate (kbps), sample_rate, samples per frame and frame length in bytes.
+    Returns None if there is no Layer III header there.
+    """
+    if offset + 4 > len(data) or find_frame_start(data[offset:offset + 4], "audio/mpeg") != 0:
+        return None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    if (b1 >> 1) & 0x03 != 0x01:
+        return None  # not Layer III
+
+    version = (b1 >> 3) & 0x03
+    mpeg1 = version == 0x03
+    bitrate = MP3_BITRATES["mpeg1" if mpeg1 else "mpeg2"][b2 >> 4]
+    sample_rate = SAMPLE_RATES[version][(b2 >> 2) & 0x03]
+    padding = (b2 >> 1) & 0x01
+    return {
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "samples": 1152 if mpeg1 else 576,
+        "length": (144 if mpeg1 else 72) * bitrate * 1000 // sample_rate + padding
+    }
+
+
+def find_mp3_frame(data: bytes, start: int = 0) -> int:
+    """
+    Like find_frame_start, but also requires the following frame header to
+    be where the first one says it ends, which rules out sync-like bytes
+    inside audio data. A frame that runs past the end of data is accepted.
+    """
+    offset = find_frame_start(data, "audio/mpeg", start)
+    while offset >= 0:
+        header = parse_mp3_header(data, offset)
+        if header:
+            following = offset + header["length"]
+            if following + 4 > len(data) or parse_mp3_header(data, following):
+                return offset
+        offset = find_frame_start(data, "audio/mpeg", offset + 1)
+    return -1
+
+
+def id3v2_size(data: bytes) -> int:
+    """Total size of a leading ID3v2 tag (cover art etc.), or 0"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)  # syncsafe integer
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
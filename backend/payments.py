@@ -6,8 +6,10 @@ from sqlalchemy.orm import Session
 
 try:
     from backend.database import User, Payment
+    from backend.telegram_client import PRIORITY_PAYMENT, TelegramAPIError, call as telegram_call
 except ImportError:
     from database import User, Payment
+    from telegram_client import PRIORITY_PAYMENT, TelegramAPIError, call as telegram_call
 
 # Константы для оплаты
 STARS_PRICE_MONTH = 100  # Цена в звездах за месяц (пример)
@@ -32,8 +34,6 @@ async def create_stars_invoice(user_id: int, plan: str) -> Dict[str, Any]:
     description = "Access to exclusive features and unlimited downloads"
     payload = f"stars_{plan}_{user_id}_{int(datetime.utcnow().timestamp())}"
     
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/createInvoiceLink"
-    
     data = {
         "title": title,
         "description": description,
@@ -44,14 +44,12 @@ async def create_stars_invoice(user_id: int, plan: str) -> Dict[str, Any]:
         "photo_url": "https://example.com/premium_image.jpg" # Можно добавить ссылку на картинку
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=data)
-        result = response.json()
+    try:
+        invoice_link = await telegram_call("createInvoiceLink", data, priority=PRIORITY_PAYMENT)
+    except TelegramAPIError as e:
+        raise Exception(f"Failed to create invoice: {e.description}")
         
-        if not result.get("ok"):
-            raise Exception(f"Failed to create invoice: {result.get('description')}")
-            
-        return {"invoice_link": result["result"]}
+    return {"invoice_link": invoice_link}
 
 async def verify_ton_transaction(boc: str, user_id: int, plan: str) -> bool:
     """
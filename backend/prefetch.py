@@ -0,0 +1,111 @@
+"""
+Background next-page prefetch.
+
+When page N of a search or genre is served, page N+1 can be loaded into the
+cache at low priority. Prefetch is bounded by a global budget (tokens per
+minute plus a cap on in-flight loads) and is skipped or cancelled while the
+upstream reports pressure.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+# Configuration
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+MAX_IN_FLIGHT = int(os.getenv("PREFETCH_MAX_IN_FLIGHT", "4"))
+BUDGET_PER_MINUTE = float(os.getenv("PREFETCH_BUDGET_PER_MINUTE", "30"))
+START_DELAY = 0.5  # seconds; lets the foreground response go out first
+PRESSURE_CHECK_INTERVAL = 0.5
+
+# Storage
+_in_flight: Dict[str, asyncio.Task] = {}
+_budget = {"tokens": BUDGET_PER_MINUTE, "updated_at": time.monotonic()}
+
+# Returns True when the upstream (Hitmo / proxies) is struggling
+_pressure_check: Callable[[], bool] = lambda: False
+
+# Statistics
+_stats = {
+    "scheduled": 0,
+    "completed": 0,
+    "failed": 0,
+    "skipped_budget": 0,
+    "skipped_pressure": 0,
+    "cancelled_pressure": 0
+}
+
+
+def configure(pressure_check: Callable[[], bool]) -> None:
+    global _pressure_check
+    _pressure_check = pressure_check
+
+
+def _take_token() -> bool:
+    now = time.monotonic()
+    elapsed = now - _budget["updated_at"]
+    _budget["updated_at"] = now
+    _budget["tokens"] = min(BUDGET_PER_MINUTE, _budget["tokens"] + elapsed * BUDGET_PER_MINUTE / 60)
+    if _budget["tokens"] < 1:
+        return False
+    _budget["tokens"] -= 1
+    return True
+
+
+async def _run(key: str, loader: Callable[[], Awaitable[Any]]) -> None:
+    try:
+        await asyncio.sleep(START_DELAY)
+        if _pressure_check():
+            _stats["skipped_pressure"] += 1
+            return
+
+        task = asyncio.ensure_future(loader())
+        while not task.done():
+            await asyncio.wait({task}, timeout=PRESSURE_CHECK_INTERVAL)
+            if not task.done() and _pressure_check():
+                task.cancel()
+                _stats["cancelled_pressure"] += 1
+                return
+
+        if task.exception() is not None:
+            _stats["failed"] += 1
+            print(f"Prefetch error for {key}: {task.exception()}")
+        else:
+            _stats["completed"] += 1
+    finally:
+        _in_flight.pop(key, None)
+
+
+def schedule_prefetch(key: str, loader: Callable[[], Awaitable[Any]]) -> bool:
+    """
+    Schedules loader() (which must store its result in the cache) unless the
+    key is already being prefetched, the budget is exhausted or the upstream
+    is under pressure. Returns True if the prefetch was scheduled.
+    """
+    if not PREFETCH_ENABLED or key in _in_flight:
+        return False
+
+    # Pressure first, so a skipped prefetch does not spend the budget
+    if _pressure_check():
+        _stats["skipped_pressure"] += 1
+        return False
+
+    if len(_in_flight) >= MAX_IN_FLIGHT or not _take_token():
+        _stats["skipped_budget"] += 1
+        return False
+
+    _stats["scheduled"] += 1
+    _in_flight[key] = asyncio.create_task(_run(key, loader))
+    return True
+
+
+def get_prefetch_stats() -> Dict[str, Any]:
+    """
+    Returns current prefetch scheduler statistics.
+    """
+    return {
+        "prefetch_enabled": PREFETCH_ENABLED,
+        "prefetch_in_flight": len(_in_flight),
+        **{f"prefetch_{name}": value for name, value in _stats.items()}
+    }
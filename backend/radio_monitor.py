@@ -0,0 +1,224 @@
+"""
+Background health and now-playing poller for radio stations.
+
+Every POLL_INTERVAL seconds each station is probed with a short streamed GET
+that asks for ICY metadata: the probe records connect time, codec and
+bitrate, and reads the first metadata block for the current StreamTitle.
+Probes run with bounded concurrency and random start jitter, so stations on
+the same host are not hit at once. /api/radio merges the cached results into
+its response.
+"""
+
+import asyncio
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+try:
+    from backend.stream_upstream import build_headers, pick_proxy
+    from backend.mpeg_audio import find_frame_start, parse_mp3_header
+except ImportError:
+    from stream_upstream import build_headers, pick_proxy
+    from mpeg_audio import find_frame_start, parse_mp3_header
+
+# Configuration
+MONITOR_ENABLED = os.getenv("RADIO_MONITOR_ENABLED", "1") == "1"
+POLL_INTERVAL = int(os.getenv("RADIO_MONITOR_INTERVAL", "120"))  # seconds between probes of a station
+MAX_CONCURRENT = int(os.getenv("RADIO_MONITOR_CONCURRENCY", "3"))
+JITTER = POLL_INTERVAL / 4  # random delay before each probe
+PROBE_TIMEOUT = 10.0
+MAX_METAINT = 64 * 1024  # do not read more audio than this waiting for metadata
+STATUS_TTL = POLL_INTERVAL * 3  # older results are reported as unknown
+
+STREAM_TITLE_RE = re.compile(r"StreamTitle='(.*?)';", re.S)
+
+# Storage
+# Format: station_id -> status
+_status: Dict[str, Dict[str, Any]] = {}
+
+# Statistics
+_stats = {
+    "probes": 0,
+    "failures": 0,
+    "titles_read": 0
+}
+
+
+def detect_codec(content_type: Optional[str]) -> Optional[str]:
+    content_type = (content_type or "").lower()
+    if "mpeg" in content_type or "mp3" in content_type:
+        return "mp3"
+    if "aac" in content_type:
+        return "aac"
+    if "ogg" in content_type:
+        return "ogg"
+    return None
+
+
+def mp3_bitrate(data: bytes) -> Optional[int]:
+    """Bitrate from the first MPEG Layer III frame header in data"""
+    offset = find_frame_start(data, "audio/mpeg")
+    if offset < 0:
+        return None
+    header = parse_mp3_header(data, offset)
+    return header["bitrate"] if header else None
+
+
+def parse_stream_title(metadata: bytes) -> Optional[str]:
+    """StreamTitle from an ICY metadata block (UTF-8, falling back to cp1251)"""
+    metadata = metadata.rstrip(b"\x00")
+    try:
+        text = metadata.decode("utf-8")
+    except UnicodeDecodeError:
+        text = metadata.decode("cp1251", errors="replace")
+    match = STREAM_TITLE_RE.search(text)
+    if not match:
+        return None
+    return match.group(1).strip() or None
+
+
+async def _read_exactly(iterator, buffer: bytearray, count: int) -> bool:
+    while len(buffer) < count:
+        try:
+            buffer += await iterator.__anext__()
+        except StopAsyncIteration:
+            return False
+    return True
+
+
+async def probe_station(station: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Connects to the station stream and returns its status:
+    alive, connect_ms, codec, bitrate, now_playing.
+    """
+    headers = build_headers(station["url"])
+    headers["Icy-MetaData"] = "1"
+    proxy = pick_proxy()
+    proxies = {"http://": proxy, "https://": proxy} if proxy else None
+
+    status = {"alive": False, "connect_ms": None, "codec": None, "bitrate": None, "now_playing": None}
+    started = time.monotonic()
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=PROBE_TIMEOUT, proxies=proxies) as client:
+        async with client.stream("GET", station["url"], headers=headers) as r:
+            status["connect_ms"] = round((time.monotonic() - started) * 1000)
+            if r.status_code >= 400:
+                status["error"] = f"HTTP {r.status_code}"
+                return status
+
+            content_type = r.headers.get("content-type")
+            status["codec"] = detect_codec(content_type)
+            icy_br = r.headers.get("icy-br", "").split(",")[0].strip()
+            if icy_br.isdigit():
+                status["bitrate"] = int(icy_br)
+
+            metaint = r.headers.get("icy-metaint", "")
+            metaint = int(metaint) if metaint.isdigit() else 0
+            chunks = r.aiter_raw()
+            buffer = bytearray()
+
+            # Audio up to the first metadata block (or a few KB without ICY)
+            wanted = metaint + 1 if 0 < metaint <= MAX_METAINT else 4096
+            if not await _read_exactly(chunks, buffer, wanted):
+                status["error"] = "Stream ended"
+                return status
+            status["alive"] = True
+
+            if status["bitrate"] is None and status["codec"] == "mp3":
+                status["bitrate"] = mp3_bitrate(bytes(buffer[:wanted - 1]))
+
+            if 0 < metaint <= MAX_METAINT:
+                length = buffer[metaint] * 16
+                if length and await _read_exactly(chunks, buffer, metaint + 1 + length):
+                    status["now_playing"] = parse_stream_title(bytes(buffer[metaint + 1:metaint + 1 + length]))
+                    if status["now_playing"]:
+                        _stats["titles_read"] += 1
+
+    return status
+
+
+async def _check(station: Dict[str, Any], semaphore: asyncio.Semaphore) -> None:
+    await asyncio.sleep(random.uniform(0, JITTER))
+    async with semaphore:
+        _stats["probes"] += 1
+        try:
+            status = await asyncio.wait_for(probe_station(station), timeout=PROBE_TIMEOUT * 2)
+        except Exception as e:
+            status = {"alive": False, "error": str(e) or type(e).__name__}
+
+    if not status["alive"]:
+        _stats["failures"] += 1
+        previous = _status.get(station["id"], {})
+        status["consecutive_failures"] = previous.get("consecutive_failures", 0) + 1
+        print(f"📻 Radio monitor: {station['id']} is down ({status.get('error')})")
+    else:
+        status["consecutive_failures"] = 0
+
+    status["checked_at"] = time.time()
+    _status[station["id"]] = status
+
+
+def get_station_status(station_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the latest probe result for the station, or None if unknown or stale.
+    """
+    status = _status.get(station_id)
+    if status is None or time.time() - status["checked_at"] > STATUS_TTL:
+        return None
+    return status
+
+
+def enrich_stations(stations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Adds alive / now_playing / bitrate / codec to station dicts.
+    Stations that were never probed keep alive=None.
+    """
+    enriched = []
+    for station in stations:
+        status = get_station_status(station["id"]) or {}
+        enriched.append({
+            **station,
+            "alive": status.get("alive"),
+            "now_playing": status.get("now_playing"),
+            "bitrate": status.get("bitrate"),
+            "codec": status.get("codec")
+        })
+    return enriched
+
+
+async def run(parser) -> None:
+    """
+    Monitor loop: probes every station once per POLL_INTERVAL.
+    """
+    print("🔄 Radio monitor started")
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    while True:
+        try:
+            stations = {}
+            for station in parser.get_radio_stations():
+                stations.setdefault(station["id"], station)
+            started = time.monotonic()
+            await asyncio.gather(*(_check(station, semaphore) for station in stations.values()))
+            await asyncio.sleep(max(POLL_INTERVAL - (time.monotonic() - started), 1))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error in radio monitor: {e}")
+            await asyncio.sleep(60)
+
+
+def get_monitor_stats() -> Dict[str, Any]:
+    """
+    Returns current monitor statistics.
+    """
+    return {
+        "enabled": MONITOR_ENABLED,
+        "stations_known": len(_status),
+        "stations_alive": sum(1 for status in _status.values() if status.get("alive")),
+        "interval_seconds": POLL_INTERVAL,
+        **_stats
+    }
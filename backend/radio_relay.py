@@ -0,0 +1,198 @@
+"""
+Radio relay: one upstream connection per station, fanned out to listeners.
+
+A StationRelay reads the Icecast/AAC stream once and keeps the most recent
+chunks in a ring buffer. Every listener follows the ring with its own
+sequence number; late joiners get a short pre-roll that is cut to the first
+MP3/ADTS frame header, so decoders start cleanly. Listeners that fall behind
+the ring skip ahead (and resync on a frame boundary) instead of slowing the
+station down. The upstream is closed shortly after the last listener leaves.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Optional
+
+try:
+    from backend.stream_upstream import open_upstream
+    from backend.mpeg_audio import find_frame_start
+except ImportError:
+    from stream_upstream import open_upstream
+    from mpeg_audio import find_frame_start
+
+# Configuration
+RING_CHUNKS = int(os.getenv("RADIO_RELAY_RING_CHUNKS", "64"))
+PREROLL_CHUNKS = int(os.getenv("RADIO_RELAY_PREROLL_CHUNKS", "8"))  # burst sent to late joiners
+LINGER_SECONDS = float(os.getenv("RADIO_RELAY_LINGER", "3"))  # keep upstream briefly for quick reconnects
+CONNECT_TIMEOUT = 10.0
+MAX_RECONNECTS = 3
+
+
+class StationRelay:
+    def __init__(self, station_id: str, url: str):
+        self.station_id = station_id
+        self.url = url
+        self.content_type: Optional[str] = None
+        self.ring: deque = deque(maxlen=RING_CHUNKS)
+        self.next_seq = 0  # sequence number of the next chunk from upstream
+        self.listeners = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.started_at = time.time()
+        self.stats = {
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "listeners_total": 0,
+            "lag_skips": 0,
+            "reconnects": 0
+        }
+        self._data = asyncio.Condition()
+        # Stops a relay nobody attaches to (the requesting client went away while connecting)
+        self._stop_handle: Optional[asyncio.TimerHandle] = asyncio.get_running_loop().call_later(
+            CONNECT_TIMEOUT + LINGER_SECONDS, self.stop
+        )
+        self._task = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        failures = 0
+        try:
+            while not self.closed:
+                try:
+                    client, r = await open_upstream(self.url)
+                except Exception as e:
+                    failures += 1
+                    print(f"❌ Radio relay {self.station_id}: connect failed: {e}")
+                    if failures > MAX_RECONNECTS:
+                        break
+                    await asyncio.sleep(failures)
+                    continue
+
+                self.content_type = r.headers.get("content-type", "audio/mpeg")
+                self.ready.set()
+                try:
+                    async for chunk in r.aiter_raw():
+                        failures = 0
+                        async with self._data:
+                            self.ring.append(chunk)
+                            self.next_seq += 1
+                            self.stats["bytes_in"] += len(chunk)
+                            self._data.notify_all()
+                except Exception as e:
+                    print(f"Radio relay {self.station_id}: upstream interrupted: {e}")
+                finally:
+                    await r.aclose()
+                    await client.aclose()
+
+                if not self.closed:
+                    failures += 1
+                    self.stats["reconnects"] += 1
+                    if failures > MAX_RECONNECTS:
+                        break
+                    await asyncio.sleep(failures)
+        finally:
+            self.closed = True
+            self.ready.set()
+            if self._stop_handle:
+                self._stop_handle.cancel()
+            # A replacement relay may already be registered for the station
+            if _relays.get(self.station_id) is self:
+                del _relays[self.station_id]
+            async with self._data:
+                self._data.notify_all()
+
+    def _attach(self) -> None:
+        self.listeners += 1
+        self.stats["listeners_total"] += 1
+        if self._stop_handle:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+    def _detach(self) -> None:
+        self.listeners -= 1
+        if self.listeners == 0 and not self.closed:
+            self._stop_handle = asyncio.get_running_loop().call_later(LINGER_SECONDS, self.stop)
+
+    def stop(self) -> None:
+        if self.listeners == 0:
+            self.closed = True
+            self._task.cancel()
+
+    async def listen(self) -> AsyncIterator[bytes]:
+        self._attach()
+        try:
+            seq = max(self.next_seq - PREROLL_CHUNKS, self.next_seq - len(self.ring))
+            resync = True
+            while True:
+                async with self._data:
+                    await self._data.wait_for(lambda: self.next_seq > seq or self.closed)
+                    if self.next_seq <= seq:
+                        break  # upstream gone for good
+
+                    oldest = self.next_seq - len(self.ring)
+                    if seq < oldest:
+                        # Too slow for the ring: skip the lost chunks
+                        self.stats["lag_skips"] += 1
+                        seq = oldest
+                        resync = True
+                    data = b"".join(self.ring[i - oldest] for i in range(seq, self.next_seq))
+                    seq = self.next_seq
+
+                if resync:
+                    offset = find_frame_start(data, self.content_type)
+                    if offset < 0:
+                        continue  # no frame header yet, wait for more data
+                    data = data[offset:]
+                    resync = False
+
+                self.stats["bytes_out"] += len(data)
+                yield data
+        finally:
+            self._detach()
+
+    def get_stats(self) -> Dict[str, Any]:
+        bytes_in = self.stats["bytes_in"]
+        return {
+            "listeners": self.listeners,
+            "content_type": self.content_type,
+            "uptime_seconds": round(time.time() - self.started_at),
+            "fanout_ratio": round(self.stats["bytes_out"] / bytes_in, 2) if bytes_in else 0,
+            **self.stats
+        }
+
+
+# Active relays: station id -> relay
+_relays: Dict[str, StationRelay] = {}
+
+
+async def get_relay(station_id: str, url: str) -> Optional[StationRelay]:
+    """
+    Returns the running relay for the station (starting one if needed) once
+    its upstream is connected, or None if the station cannot be reached.
+    """
+    relay = _relays.get(station_id)
+    if relay is None or relay.closed:
+        relay = StationRelay(station_id, url)
+        _relays[station_id] = relay
+
+    try:
+        await asyncio.wait_for(relay.ready.wait(), timeout=CONNECT_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    if relay.closed or relay.content_type is None:
+        if relay.listeners == 0:
+            relay.stop()
+        return None
+    return relay
+
+
+def get_relay_stats() -> Dict[str, Any]:
+    """
+    Returns fan-out statistics of the active relays.
+    """
+    return {
+        "active_stations": len(_relays),
+        "total_listeners": sum(relay.listeners for relay in _relays.values()),
+        "stations": {station_id: relay.get_stats() for station_id, relay in _relays.items()}
+    }
@@ -179,13 +179,10 @@ async def complete_payment(
                 # Send notification to referrer
                 if BOT_TOKEN:
                     try:
-                        import httpx
-                        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                        async with httpx.AsyncClient() as client:
-                            await client.post(telegram_url, json={
-                                'chat_id': referrer.id,
-                                'text': f"🎉 Ваш реферал оформил подписку! Вы получили +30 дней Premium до {referrer_expires.strftime('%d.%m.%Y')}!"
-                            })
+                        await telegram_call("sendMessage", {
+                            'chat_id': referrer.id,
+                            'text': f"🎉 Ваш реферал оформил подписку! Вы получили +30 дней Premium до {referrer_expires.strftime('%d.%m.%Y')}!"
+                        }, priority=PRIORITY_PAYMENT, chat_id=referrer.id)
                     except Exception as e:
                         print(f"Failed to send referral notification: {e}")
     
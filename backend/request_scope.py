@@ -0,0 +1,105 @@
+"""
+Request-scoped cancellation.
+
+run_scoped() runs a handler's upstream work as a task and cancels it as soon
+as the client disconnects or the request deadline passes, so parser and
+cover lookups stop instead of finishing for nobody. ClosingStreamingResponse
+closes its body iterator the moment a streamed response ends, including on
+disconnect, which releases upstream connections without waiting for
+garbage collection.
+"""
+
+import asyncio
+import os
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional
+
+from fastapi import Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# Configuration
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "25"))  # seconds for search/genre work
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# nginx's "client closed request"; never seen by the client
+CLIENT_CLOSED_REQUEST = 499
+
+# Statistics
+_stats = {
+    "requests_cancelled": 0,  # client went away while upstream work was running
+    "deadlines_exceeded": 0,
+    "streams_completed": 0,
+    "streams_cancelled": 0  # streamed responses cut short by the client
+}
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the response was ready"""
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def run_scoped(request: Request, work: Awaitable[Any], deadline: Optional[float] = REQUEST_DEADLINE) -> Any:
+    """
+    Awaits work, cancelling it if the client disconnects (ClientDisconnected)
+    or the deadline passes (asyncio.TimeoutError).
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+
+        task.cancel()
+        if watcher in done:
+            _stats["requests_cancelled"] += 1
+            raise ClientDisconnected()
+        _stats["deadlines_exceeded"] += 1
+        raise asyncio.TimeoutError()
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that closes its body iterator when the response ends,
+    whether it completed or the client disconnected.
+    """
+
+    def __init__(self, content: AsyncIterator[Any], *args, **kwargs):
+        self._source = content
+        self._finished = False
+        super().__init__(self._track(content), *args, **kwargs)
+
+    async def _track(self, content: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        async for part in content:
+            yield part
+        self._finished = True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self._finished:
+                _stats["streams_completed"] += 1
+            else:
+                _stats["streams_cancelled"] += 1
+            await self.body_iterator.aclose()
+            if hasattr(self._source, "aclose"):
+                await self._source.aclose()
+
+
+def get_request_scope_stats() -> Dict[str, Any]:
+    """
+    Returns cancellation statistics.
+    """
+    return {
+        "deadline_seconds": REQUEST_DEADLINE,
+        **_stats
+    }
@@ -0,0 +1,176 @@
+"""
+Upstream fan-in for concurrent listeners of the same audio file.
+
+A SharedTransfer reads one upstream byte range and keeps a bounded window of
+recent bytes in memory. Requests for an overlapping range of the same file
+attach to the running transfer instead of opening their own upstream
+connection. The producer is paced by its fastest subscriber; subscribers
+that fall out of the retained window detach and continue with an
+independent fetch.
+"""
+
+import asyncio
+import itertools
+import os
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+# Configuration
+FANIN_ENABLED = os.getenv("STREAM_FANIN_ENABLED", "1") == "1"
+BUFFER_BYTES = int(os.getenv("STREAM_FANIN_BUFFER_KB", "2048")) * 1024  # retained window per transfer
+READ_AHEAD_BYTES = BUFFER_BYTES // 2  # how far the producer may run ahead of the fastest subscriber
+JOIN_AHEAD_BYTES = 256 * 1024  # a request may attach if its start is this close ahead of the transfer
+
+Fetch = Callable[[int, int], AsyncIterator[bytes]]
+
+# Storage
+# Format: file key -> running transfers
+_transfers: Dict[str, List["SharedTransfer"]] = {}
+_subscriber_ids = itertools.count()
+
+# Statistics
+_stats = {
+    "transfers_started": 0,
+    "subscribers_joined": 0,  # requests that attached to an existing transfer
+    "bytes_fanned_out": 0,  # bytes delivered to joined subscribers (upstream bytes saved)
+    "lagging_fallbacks": 0
+}
+
+
+class SubscriberLagging(Exception):
+    """The subscriber's position was trimmed from the shared buffer"""
+
+
+class TransferCancelled(IOError):
+    """The transfer was stopped because all of its subscribers left"""
+
+
+class SharedTransfer:
+    def __init__(self, key: str, start: int, end: int, fetch: Fetch):
+        self.key = key
+        self.start = start
+        self.end = end
+        self.base = start  # absolute offset of buffer[0]
+        self.position = start  # absolute offset of the next byte from upstream
+        self.buffer = bytearray()
+        self.done = False
+        self.closing = False
+        self.error = None
+        self._subscribers: Dict[int, int] = {}  # subscriber id -> absolute offset
+        self._data = asyncio.Condition()
+        self._task = asyncio.create_task(self._produce(fetch))
+
+    def can_join(self, offset: int) -> bool:
+        return not (self.done or self.closing) and self.base <= offset <= min(self.position + JOIN_AHEAD_BYTES, self.end)
+
+    async def _produce(self, fetch: Fetch) -> None:
+        try:
+            async for chunk in fetch(self.start, self.end):
+                async with self._data:
+                    # Backpressure: wait for the fastest subscriber to catch up
+                    await self._data.wait_for(
+                        lambda: not self._subscribers
+                        or self.position - max(self._subscribers.values()) < READ_AHEAD_BYTES
+                    )
+                    self.buffer += chunk
+                    self.position += len(chunk)
+                    overflow = len(self.buffer) - BUFFER_BYTES
+                    if overflow > 0:
+                        del self.buffer[:overflow]
+                        self.base += overflow
+                    self._data.notify_all()
+        except asyncio.CancelledError:
+            self.error = TransferCancelled("Shared transfer cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            if self in _transfers.get(self.key, []):
+                _transfers[self.key].remove(self)
+                if not _transfers[self.key]:
+                    del _transfers[self.key]
+            async with self._data:
+                self._data.notify_all()
+
+    async def read(self, offset: int, end: int, joined: bool) -> AsyncIterator[bytes]:
+        """
+        Yields bytes [offset, min(end, self.end)] from the shared buffer.
+        Raises SubscriberLagging if the data was already trimmed.
+        """
+        subscriber = next(_subscriber_ids)
+        self._subscribers[subscriber] = offset
+        stop = min(end, self.end)
+        try:
+            while offset <= stop:
+                async with self._data:
+                    await self._data.wait_for(lambda: self.position > offset or self.done)
+                    if offset < self.base:
+                        raise SubscriberLagging()
+                    if self.position <= offset:
+                        # Producer finished without reaching offset
+                        raise self.error or IOError(f"Shared transfer ended at byte {self.position}")
+                    data = bytes(self.buffer[offset - self.base:min(self.position, stop + 1) - self.base])
+
+                offset += len(data)
+                if joined:
+                    _stats["bytes_fanned_out"] += len(data)
+                yield data
+
+                async with self._data:
+                    self._subscribers[subscriber] = offset
+                    self._data.notify_all()
+        finally:
+            self._subscribers.pop(subscriber, None)
+            if not self._subscribers and not self.done:
+                # Last listener left: stop pulling from upstream
+                self.closing = True
+                self._task.cancel()
+
+
+async def shared_fetch(key: str, start: int, end: int, fetch: Fetch) -> AsyncIterator[bytes]:
+    """
+    Drop-in replacement for fetch(start, end) that shares upstream transfers
+    between concurrent requests for the same file key.
+    """
+    if not FANIN_ENABLED:
+        async for chunk in fetch(start, end):
+            yield chunk
+        return
+
+    offset = start
+    while offset <= end:
+        transfer = next((t for t in _transfers.get(key, []) if t.can_join(offset)), None)
+        joined = transfer is not None
+        if transfer is None:
+            transfer = SharedTransfer(key, offset, end, fetch)
+            _transfers.setdefault(key, []).append(transfer)
+            _stats["transfers_started"] += 1
+        else:
+            _stats["subscribers_joined"] += 1
+
+        try:
+            async for chunk in transfer.read(offset, end, joined):
+                offset += len(chunk)
+                yield chunk
+        except TransferCancelled:
+            # Joined just as the previous listeners left: start a new transfer
+            continue
+        except SubscriberLagging:
+            # Too slow for the shared window: continue on our own connection
+            _stats["lagging_fallbacks"] += 1
+            async for chunk in fetch(offset, end):
+                offset += len(chunk)
+                yield chunk
+
+
+def get_fanin_stats() -> Dict[str, Any]:
+    """
+    Returns current fan-in statistics.
+    """
+    return {
+        "enabled": FANIN_ENABLED,
+        "active_transfers": sum(len(transfers) for transfers in _transfers.values()),
+        "active_subscribers": sum(len(t._subscribers) for transfers in _transfers.values() for t in transfers),
+        "buffer_bytes": BUFFER_BYTES,
+        **_stats
+    }
@@ -0,0 +1,58 @@
+"""
+Signed stream handles.
+
+Track URLs in API responses point to /api/stream/<handle>, where the handle
+is "<track_id>.<signature>". The signature (truncated HMAC-SHA256) keeps
+clients from asking the proxy for arbitrary track IDs; the upstream URL is
+looked up in the track registry at request time, so the handle never
+expires and the stream is cacheable by URL - as long as the signing key is
+configured (HANDLES_STABLE). Without one the key is random per process and
+handles stop working after a restart.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from typing import Optional
+
+SIGNATURE_BYTES = 9  # 12 base64url characters
+
+
+def _load_secret() -> bytes:
+    secret = os.getenv("STREAM_HANDLE_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+
+    bot_token = os.getenv("BOT_TOKEN")
+    if bot_token:
+        # Derived key: stable across restarts without extra configuration
+        return hmac.new(bot_token.encode("utf-8"), b"stream-handles", hashlib.sha256).digest()
+
+    print("WARNING: STREAM_HANDLE_SECRET not set, stream handles will change on restart")
+    return secrets.token_bytes(32)
+
+
+_secret = _load_secret()
+# Handles survive restarts only with a configured key
+HANDLES_STABLE = bool(os.getenv("STREAM_HANDLE_SECRET") or os.getenv("BOT_TOKEN"))
+
+
+def _sign(track_id: str) -> str:
+    digest = hmac.new(_secret, track_id.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode("ascii")
+
+
+def make_handle(track_id: str) -> str:
+    return f"{track_id}.{_sign(track_id)}"
+
+
+def parse_handle(handle: str) -> Optional[str]:
+    """
+    Returns the track ID of a valid handle, or None if the signature does not match.
+    """
+    track_id, _, signature = handle.rpartition(".")
+    if not track_id or not hmac.compare_digest(signature, _sign(track_id)):
+        return None
+    return track_id
@@ -0,0 +1,278 @@
+"""
+Per-listener stream limits.
+
+Every stream is charged to two identities: the Telegram user (when the
+client sends validly signed initData) and the client IP. Each identity has a cap on
+concurrent streams and a token bucket for aggregate bandwidth shared by all
+of its streams. A stream over the concurrency cap waits in a FIFO queue for
+up to QUEUE_SECONDS and is then rejected with 429. Bandwidth is enforced in
+the relay loop: a chunk is passed on once its bytes are covered by the
+bucket, so one heavy client slows down only its own streams while everyone
+else keeps their full rate. Buckets allow a burst, so players can fill
+their buffer quickly on start and seek.
+"""
+
+import asyncio
+import ipaddress
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import Request
+
+# Configuration
+STREAM_LIMITS_ENABLED = os.getenv("STREAM_LIMITS_ENABLED", "1") == "1"
+MAX_STREAMS_PER_USER = int(os.getenv("STREAM_MAX_PER_USER", "4"))
+MAX_STREAMS_PER_IP = int(os.getenv("STREAM_MAX_PER_IP", "12"))  # several users behind one NAT
+USER_RATE = int(os.getenv("STREAM_USER_KBPS", "1024")) * 1024  # bytes per second
+IP_RATE = int(os.getenv("STREAM_IP_KBPS", "4096")) * 1024
+BURST_SECONDS = float(os.getenv("STREAM_BURST_SECONDS", "4"))  # bucket size in seconds of rate
+QUEUE_SECONDS = float(os.getenv("STREAM_QUEUE_SECONDS", "10"))
+MAX_IDENTITIES = 10000  # idle identities are pruned above this
+# Reverse proxies whose X-Forwarded-For is honored (addresses or networks, comma separated)
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if entry.strip()
+]
+
+# Statistics
+_stats = {
+    "streams_admitted": 0,
+    "streams_queued": 0,  # had to wait for a free slot
+    "streams_rejected": 0,  # 429
+    "throttle_waits": 0,  # chunks held back by a bandwidth bucket
+    "throttle_seconds": 0.0,
+    "bytes": 0
+}
+
+
+class StreamLimitExceeded(Exception):
+    """No stream slot became free within QUEUE_SECONDS"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many streams, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Bandwidth bucket. Tokens may go negative so chunks larger than the burst still pass."""
+
+    def __init__(self, rate: int, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: int) -> float:
+        """Takes amount tokens; returns how many seconds the caller must wait before using them"""
+        self._refill()
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class _Identity:
+    def __init__(self, key: str, max_streams: int, rate: int):
+        self.key = key
+        self.max_streams = max_streams
+        self.active = 0
+        self.waiters: deque = deque()
+        self.bucket = TokenBucket(rate, int(rate * BURST_SECONDS))
+
+    def idle(self) -> bool:
+        return self.active == 0 and not self.waiters
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.active < self.max_streams and not self.waiters:
+            self.active += 1
+            return True
+
+        _stats["streams_queued"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True  # the slot was handed over by release()
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self) -> None:
+        # Hand the slot straight to the longest waiting stream
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+# Storage
+# Format: "user:<id>" / "ip:<address>" -> identity
+_identities: Dict[str, _Identity] = {}
+
+
+def _get_identity(key: str, max_streams: int, rate: int) -> _Identity:
+    identity = _identities.get(key)
+    if identity is None:
+        if len(_identities) >= MAX_IDENTITIES:
+            for stale in [k for k, v in _identities.items() if v.idle()]:
+                del _identities[stale]
+        identity = _Identity(key, max_streams, rate)
+        _identities[key] = identity
+    return identity
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    """
+    Client address. X-Forwarded-For is honored only when the connection comes
+    from a trusted proxy: hops are taken from the right, skipping trusted
+    proxies, so a client cannot pick its identity by sending the header itself.
+    """
+    address = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or not _is_trusted_proxy(address):
+        return address
+    for hop in reversed(forwarded.split(",")):
+        hop = hop.strip()
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+
+class StreamLease:
+    """Concurrency slots of one stream, released once"""
+
+    def __init__(self, identities: List[_Identity]):
+        self.identities = identities
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            for identity in self.identities:
+                identity.release()
+
+
+class ThrottledBody:
+    """
+    Response body within the lease's bandwidth buckets. Closing it releases
+    the lease, also when the body was never iterated.
+    """
+
+    def __init__(self, lease: StreamLease, body: AsyncIterator[Any]):
+        self.lease = lease
+        self.body = body
+
+    def __aiter__(self) -> "ThrottledBody":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            part = await self.body.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+        # bytes, or a FileSegment of the audio cache
+        size = len(part) if isinstance(part, (bytes, bytearray, memoryview)) else part.count
+        wait = max(identity.bucket.reserve(size) for identity in self.lease.identities)
+        if wait > 0:
+            _stats["throttle_waits"] += 1
+            _stats["throttle_seconds"] += wait
+            await asyncio.sleep(wait)
+        _stats["bytes"] += size
+        return part
+
+    async def aclose(self) -> None:
+        self.lease.release()
+        if hasattr(self.body, "aclose"):
+            await self.body.aclose()
+
+
+async def acquire_stream(request: Request, user_id: Optional[int] = None) -> Optional[StreamLease]:
+    """
+    Takes a stream slot for the user and the client IP, queueing if needed.
+    user_id must come from verified initData, never from a request parameter.
+    Returns None when limits are disabled. Raises StreamLimitExceeded.
+    """
+    if not STREAM_LIMITS_ENABLED:
+        return None
+
+    identities = [_get_identity(f"ip:{client_ip(request)}", MAX_STREAMS_PER_IP, IP_RATE)]
+    if user_id:
+        identities.insert(0, _get_identity(f"user:{user_id}", MAX_STREAMS_PER_USER, USER_RATE))
+
+    deadline = time.monotonic() + QUEUE_SECONDS
+    acquired: List[_Identity] = []
+    try:
+        for identity in identities:
+            if not await identity.acquire(max(deadline - time.monotonic(), 0)):
+                _stats["streams_rejected"] += 1
+                raise StreamLimitExceeded(retry_after=max(int(QUEUE_SECONDS), 1))
+            acquired.append(identity)
+    except BaseException:
+        for identity in acquired:
+            identity.release()
+        raise
+
+    _stats["streams_admitted"] += 1
+    return StreamLease(identities)
+
+
+def limit_response(response: Any, lease: Optional[StreamLease]) -> Any:
+    """
+    Applies the lease to a streamed response (which must close its body
+    iterator, see ClosingStreamingResponse), or releases it right away for
+    other responses.
+    """
+    if lease is None:
+        return response
+    if hasattr(response, "body_iterator"):
+        response.body_iterator = ThrottledBody(lease, response.body_iterator)
+    else:
+        lease.release()
+    return response
+
+
+def get_stream_limits_stats() -> Dict[str, Any]:
+    """
+    Returns stream limit statistics and the busiest identities.
+    """
+    busiest = sorted(_identities.values(), key=lambda i: (i.active, len(i.waiters)), reverse=True)[:10]
+    return {
+        "enabled": STREAM_LIMITS_ENABLED,
+        "max_streams_per_user": MAX_STREAMS_PER_USER,
+        "max_streams_per_ip": MAX_STREAMS_PER_IP,
+        "user_rate_bytes": USER_RATE,
+        "ip_rate_bytes": IP_RATE,
+        "active_streams": sum(i.active for i in _identities.values() if i.key.startswith("ip:")),
+        "queued_streams": sum(len(i.waiters) for i in _identities.values()),
+        "identities": len(_identities),
+        "busiest": [
+            {"identity": i.key, "active": i.active, "queued": len(i.waiters)}
+            for i in busiest if not i.idle()
+        ],
+        **{**_stats, "throttle_seconds": round(_stats["throttle_seconds"], 1)}
+    }
@@ -0,0 +1,234 @@
+"""
+Tuned upstream byte relay with per-stream metrics.
+
+Audio is requested with Accept-Encoding: identity and read with aiter_raw(),
+so bytes go from the upstream socket to the client without decoder passes.
+By default socket reads are passed through as they arrive; a non-zero
+STREAM_RELAY_CHUNK_KB coalesces them into fewer, larger writes to the client
+at the cost of one extra copy. Every relayed stream records
+its time to first byte, throughput, stalls (upstream gaps longer than
+STALL_SECONDS) and how long it waited on the upstream versus the client,
+aggregated per upstream host.
+
+resume_body() adds mid-stream failover on top: when the upstream resets or
+ends before the expected last byte, the file is reopened through another
+proxy with a Range starting at the first byte not yet delivered, so the
+client sees one uninterrupted body.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    from backend.stream_upstream import open_upstream, parse_body_span, parse_total_size
+except ImportError:
+    from stream_upstream import open_upstream, parse_body_span, parse_total_size
+
+# Configuration
+RELAY_CHUNK_SIZE = int(os.getenv("STREAM_RELAY_CHUNK_KB", "0")) * 1024 or None  # None: pass reads through
+STALL_SECONDS = float(os.getenv("STREAM_RELAY_STALL_SECONDS", "2"))
+MAX_FAILOVERS = int(os.getenv("STREAM_FAILOVER_MAX", "3"))  # reconnects per stream
+FAILOVER_BACKOFF = 0.5  # seconds, multiplied by the attempt number
+RECENT_STREAMS = 50
+
+# Storage
+# Format: upstream host -> aggregate counters
+_hosts: Dict[str, Dict[str, float]] = {}
+_recent: deque = deque(maxlen=RECENT_STREAMS)
+_active = 0
+
+# Statistics
+_failover_stats = {
+    "failovers": 0,  # reconnects after a reset or truncated body
+    "failover_errors": 0,  # reconnect attempts that failed themselves
+    "streams_recovered": 0,  # streams that completed after at least one failover
+    "streams_failed": 0,  # streams that ran out of failover attempts
+    "bytes_resumed": 0  # bytes delivered over resumed connections
+}
+
+
+def _record(metrics: Dict[str, Any]) -> None:
+    host = _hosts.setdefault(metrics["host"], {
+        "streams": 0,
+        "bytes": 0,
+        "stalls": 0,
+        "ttfb_total_ms": 0,
+        "upstream_wait_seconds": 0.0,
+        "client_wait_seconds": 0.0
+    })
+    host["streams"] += 1
+    host["bytes"] += metrics["bytes"]
+    host["stalls"] += metrics["stalls"]
+    host["ttfb_total_ms"] += metrics["ttfb_ms"] or 0
+    host["upstream_wait_seconds"] += metrics["upstream_wait_seconds"]
+    host["client_wait_seconds"] += metrics["client_wait_seconds"]
+    _recent.append(metrics)
+
+
+async def relay_body(response: httpx.Response, started: float) -> AsyncIterator[bytes]:
+    """
+    Yields the raw upstream body. started is the time.monotonic() at which
+    the upstream request was issued, for the TTFB measurement.
+    """
+    global _active
+    metrics = {
+        "host": urlsplit(str(response.url)).hostname or "unknown",
+        "bytes": 0,
+        "ttfb_ms": None,
+        "stalls": 0,
+        "upstream_wait_seconds": 0.0,  # waiting for the next upstream chunk
+        "client_wait_seconds": 0.0,  # waiting for the client to take a chunk (backpressure)
+        "completed": False
+    }
+    _active += 1
+    first_byte_at = None
+    last = time.monotonic()
+    try:
+        async for chunk in response.aiter_raw(RELAY_CHUNK_SIZE):
+            now = time.monotonic()
+            gap = now - last
+            metrics["upstream_wait_seconds"] += gap
+            if first_byte_at is None:
+                first_byte_at = now
+                metrics["ttfb_ms"] = round((now - started) * 1000)
+            elif gap > STALL_SECONDS:
+                metrics["stalls"] += 1
+            metrics["bytes"] += len(chunk)
+
+            yield chunk
+
+            last = time.monotonic()
+            metrics["client_wait_seconds"] += last - now
+        metrics["completed"] = True
+    finally:
+        _active -= 1
+        elapsed = time.monotonic() - first_byte_at if first_byte_at else 0
+        metrics["bytes_per_second"] = round(metrics["bytes"] / elapsed) if elapsed > 0 else 0
+        metrics["upstream_wait_seconds"] = round(metrics["upstream_wait_seconds"], 3)
+        metrics["client_wait_seconds"] = round(metrics["client_wait_seconds"], 3)
+        _record(metrics)
+
+
+async def _reopen(
+    url: str,
+    user_agent: Optional[str],
+    position: int,
+    end: int,
+    total_size: Optional[int],
+    failed_proxy: Optional[str]
+):
+    """Opens the file again from position; returns (client, response, bytes to skip)"""
+    client, r = await open_upstream(url, user_agent, f"bytes={position}-{end}", exclude_proxy=failed_proxy)
+    span = parse_body_span(r)
+    size = parse_total_size(r)
+    if span is None or span[0] > position or (total_size and size and size != total_size):
+        # Not the same file or not the bytes we need: cannot splice it in
+        await r.aclose()
+        await client.aclose()
+        raise IOError(f"Upstream cannot resume at byte {position}")
+    return client, r, position - span[0]
+
+
+async def resume_body(
+    url: str,
+    user_agent: Optional[str],
+    client: httpx.AsyncClient,
+    response: httpx.Response,
+    started: float,
+    start: int,
+    end: int
+) -> AsyncIterator[bytes]:
+    """
+    Yields bytes [start, end] of the file, beginning with the already opened
+    response (which may be a 200 that ignored the Range), and fails over to a
+    new upstream connection if it breaks off early. Owns and closes the
+    client and response.
+    """
+    total_size = parse_total_size(response)
+    skip = start if response.status_code == 200 else 0
+    position = start
+    failovers = 0
+    try:
+        while True:
+            try:
+                async for chunk in relay_body(response, started):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    wanted = chunk[:end - position + 1]
+                    if wanted:
+                        position += len(wanted)
+                        if failovers:
+                            _failover_stats["bytes_resumed"] += len(wanted)
+                        yield wanted
+                    if len(wanted) < len(chunk):
+                        break  # upstream sends past end (ignored Range)
+                if position > end:
+                    if failovers:
+                        _failover_stats["streams_recovered"] += 1
+                    return
+                error = IOError(f"Upstream ended at byte {position} of {end + 1}")
+            except httpx.TransportError as e:
+                error = e
+
+            failed_proxy = response.extensions.get("proxy")
+            await response.aclose()
+            await client.aclose()
+
+            # Reconnect from the first byte the client has not received yet
+            while True:
+                if failovers >= MAX_FAILOVERS:
+                    _failover_stats["streams_failed"] += 1
+                    print(f"❌ Stream failover exhausted at byte {position}: {error}")
+                    raise error
+                failovers += 1
+                _failover_stats["failovers"] += 1
+                print(f"🔁 Stream failover {failovers}/{MAX_FAILOVERS} at byte {position}: {type(error).__name__}: {error}")
+                await asyncio.sleep(FAILOVER_BACKOFF * (failovers - 1))
+                started = time.monotonic()
+                try:
+                    client, response, skip = await _reopen(url, user_agent, position, end, total_size, failed_proxy)
+                    break
+                except Exception as e:
+                    _failover_stats["failover_errors"] += 1
+                    error = e
+    finally:
+        await response.aclose()
+        await client.aclose()
+
+
+def get_stream_relay_stats() -> Dict[str, Any]:
+    """
+    Returns relay throughput statistics per upstream host plus the most
+    recent streams.
+    """
+    hosts = {}
+    for name, host in _hosts.items():
+        busy = host["upstream_wait_seconds"] + host["client_wait_seconds"]
+        hosts[name] = {
+            "streams": host["streams"],
+            "bytes": host["bytes"],
+            "stalls": host["stalls"],
+            "avg_ttfb_ms": round(host["ttfb_total_ms"] / host["streams"]),
+            "bytes_per_second": round(host["bytes"] / busy) if busy else 0,
+            # Share of time spent waiting on clients: high means the relay is not the bottleneck
+            "client_wait_ratio": round(host["client_wait_seconds"] / busy, 3) if busy else 0
+        }
+    return {
+        "chunk_size": RELAY_CHUNK_SIZE,
+        "stall_seconds": STALL_SECONDS,
+        "active_streams": _active,
+        "max_failovers": MAX_FAILOVERS,
+        **_failover_stats,
+        "hosts": hosts,
+        "recent": list(_recent)
+    }
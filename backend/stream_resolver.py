@@ -0,0 +1,88 @@
+"""
+Resolver cache for stream URLs.
+
+Hitmo download links answer with one or more redirects before the CDN file.
+The final URL, content length and type are remembered per original URL, so
+seeks and replays go straight to the file host. Entries expire after
+RESOLVER_TTL and are dropped as soon as the CDN answers 403/404/410.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Configuration
+RESOLVER_TTL = int(os.getenv("STREAM_RESOLVER_TTL", "1800"))  # seconds
+MAX_ENTRIES = 10000
+
+# Statuses that mean the resolved CDN URL is no longer valid
+INVALIDATING_STATUSES = (403, 404, 410)
+
+# Storage
+# Format: original_url -> {final_url, size, content_type, expires_at}
+_resolved: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# Statistics
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stored": 0,
+    "invalidations": 0
+}
+
+
+def get_resolved(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the resolved target for url if it is still fresh.
+    """
+    entry = _resolved.get(url)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+
+    if time.time() >= entry["expires_at"]:
+        del _resolved[url]
+        _stats["misses"] += 1
+        return None
+
+    _resolved.move_to_end(url)
+    _stats["hits"] += 1
+    return entry
+
+
+def remember(url: str, final_url: str, size: Optional[int], content_type: Optional[str]) -> None:
+    entry = _resolved.get(url)
+    if entry and entry["final_url"] == final_url:
+        # Same target: keep known metadata, extend the lifetime
+        entry["size"] = size or entry["size"]
+        entry["content_type"] = content_type or entry["content_type"]
+        entry["expires_at"] = time.time() + RESOLVER_TTL
+        return
+
+    _resolved[url] = {
+        "final_url": final_url,
+        "size": size,
+        "content_type": content_type,
+        "expires_at": time.time() + RESOLVER_TTL
+    }
+    _resolved.move_to_end(url)
+    _stats["stored"] += 1
+    while len(_resolved) > MAX_ENTRIES:
+        _resolved.popitem(last=False)
+
+
+def invalidate(url: str) -> None:
+    if _resolved.pop(url, None) is not None:
+        _stats["invalidations"] += 1
+
+
+def get_resolver_stats() -> Dict[str, Any]:
+    """
+    Returns current resolver cache statistics.
+    """
+    return {
+        "entries": len(_resolved),
+        "ttl_seconds": RESOLVER_TTL,
+        **_stats
+    }
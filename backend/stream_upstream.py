@@ -0,0 +1,160 @@
+"""
+Upstream connections for /api/stream.
+
+Builds the Hitmo-friendly request (proxy, User-Agent, Referer, Range) and
+opens a streamed httpx response, skipping redirect hops through the resolver
+cache. Shared by the plain relay and the on-disk range cache.
+"""
+
+import os
+import random
+import re
+from typing import Optional, Tuple
+
+import httpx
+
+try:
+    from backend.stream_resolver import get_resolved, remember, invalidate, INVALIDATING_STATUSES
+except ImportError:
+    from stream_resolver import get_resolved, remember, invalidate, INVALIDATING_STATUSES
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Seconds without a byte from upstream before the read fails; stream relays
+# then reconnect (Range-resumed) and the radio relay reconnects the station
+READ_TIMEOUT = float(os.getenv("STREAM_UPSTREAM_READ_TIMEOUT", "30"))
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class UpstreamError(Exception):
+    """Upstream answered with an error status"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Upstream status {status_code}")
+        self.status_code = status_code
+
+
+def pick_proxy(exclude: Optional[str] = None) -> Optional[str]:
+    """Random proxy from PROXY_LIST, avoiding exclude when there is another choice"""
+    proxy_list_str = os.getenv("PROXY_LIST", "")
+    proxy_list = [p.strip() for p in proxy_list_str.split(",") if p.strip()]
+    if not proxy_list:
+        return None
+    candidates = [p for p in proxy_list if p != exclude] or proxy_list
+    return random.choice(candidates)
+
+
+def build_headers(url: str, user_agent: Optional[str] = None, range_header: Optional[str] = None) -> dict:
+    headers = {
+        'User-Agent': user_agent or DEFAULT_USER_AGENT,
+        'Accept': '*/*',
+        'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+        # Audio is relayed as raw bytes: no compressed transfer to decode
+        'Accept-Encoding': 'identity',
+    }
+
+    if "hitmotop.com" in url:
+        headers['Referer'] = 'https://rus.hitmotop.com/'
+        headers['Origin'] = 'https://rus.hitmotop.com'
+
+    if range_header:
+        headers['Range'] = range_header
+
+    return headers
+
+
+async def _send(url: str, headers: dict, exclude_proxy: Optional[str] = None) -> Tuple[httpx.AsyncClient, httpx.Response]:
+    proxy = pick_proxy(exclude_proxy)
+    proxies = {"http://": proxy, "https://": proxy} if proxy else None
+    if proxy:
+        print(f"Using proxy for stream: {proxy}")
+
+    # Timeout configuration
+    timeout = httpx.Timeout(15.0, read=READ_TIMEOUT)
+    client = httpx.AsyncClient(follow_redirects=True, timeout=timeout, proxies=proxies)
+
+    try:
+        req = client.build_request("GET", url, headers=headers)
+        r = await client.send(req, stream=True)
+    except Exception:
+        await client.aclose()
+        raise
+    # Remembered so a failover can go through a different proxy
+    r.extensions["proxy"] = proxy
+    return client, r
+
+
+async def open_upstream(
+    url: str,
+    user_agent: Optional[str] = None,
+    range_header: Optional[str] = None,
+    exclude_proxy: Optional[str] = None
+) -> Tuple[httpx.AsyncClient, httpx.Response]:
+    """
+    Opens a streamed GET. The caller owns the returned client and must close it.
+    Raises UpstreamError (with the client already closed) on status >= 400.
+
+    A previously resolved CDN URL is used directly when known; if the CDN
+    rejects it, the entry is invalidated and the original URL is retried.
+    exclude_proxy avoids the proxy of a connection that just failed.
+    """
+    headers = build_headers(url, user_agent, range_header)
+
+    resolved = get_resolved(url)
+    if resolved:
+        client, r = await _send(resolved["final_url"], headers, exclude_proxy)
+        if r.status_code < 400:
+            return client, r
+
+        await r.aclose()
+        await client.aclose()
+        if r.status_code not in INVALIDATING_STATUSES:
+            raise UpstreamError(r.status_code)
+
+        print(f"Resolved stream URL rejected ({r.status_code}), re-resolving {url}")
+        invalidate(url)
+
+    client, r = await _send(url, headers, exclude_proxy)
+
+    if r.status_code >= 400:
+        print(f"Stream error status: {r.status_code} for {url}")
+        await r.aclose()
+        await client.aclose()
+        raise UpstreamError(r.status_code)
+
+    remember(url, str(r.url), parse_total_size(r), r.headers.get("content-type"))
+    return client, r
+
+
+def parse_body_span(response: httpx.Response) -> Optional[Tuple[int, int]]:
+    """
+    Byte span [start, end] of the file that the response body carries, from
+    Content-Range (206) or Content-Length (200). None if unknown.
+    """
+    content_range = response.headers.get("content-range")
+    if content_range:
+        match = CONTENT_RANGE_RE.match(content_range)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        return None
+
+    if response.status_code == 200 and "content-length" in response.headers:
+        return 0, int(response.headers["content-length"]) - 1
+    return None
+
+
+def parse_total_size(response: httpx.Response) -> Optional[int]:
+    """
+    Full file size from Content-Range (206) or Content-Length (200).
+    """
+    content_range = response.headers.get("content-range")
+    if content_range:
+        match = CONTENT_RANGE_RE.match(content_range)
+        if match and match.group(3) != "*":
+            return int(match.group(3))
+        return None
+
+    if response.status_code == 200 and "content-length" in response.headers:
+        return int(response.headers["content-length"])
+    return None
@@ -0,0 +1,56 @@
+"""
+Telegram Mini App initData validation.
+
+The Mini App receives a signed initData string from Telegram
+(Telegram.WebApp.initData). Its hash is an HMAC-SHA256 of the other fields
+under a key derived from the bot token, so a valid string proves which
+Telegram user opened the app. Request parameters like user_id prove
+nothing and must not be used to identify the caller.
+
+See https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+# Configuration
+INIT_DATA_MAX_AGE = int(os.getenv("TELEGRAM_INIT_DATA_MAX_AGE", "86400"))  # seconds since auth_date
+
+
+def _secret_key(bot_token: str) -> bytes:
+    return hmac.new(b"WebAppData", bot_token.encode("utf-8"), hashlib.sha256).digest()
+
+
+def verify_init_data(init_data: str, bot_token: Optional[str] = None, now: Optional[float] = None) -> Optional[int]:
+    """
+    Returns the Telegram user ID from a validly signed, fresh initData string,
+    or None when it is missing, forged, expired or no bot token is configured.
+    """
+    bot_token = bot_token if bot_token is not None else os.getenv("BOT_TOKEN")
+    if not init_data or not bot_token:
+        return None
+
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+    received_hash = fields.pop("hash", "")
+    data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    expected_hash = hmac.new(_secret_key(bot_token), data_check_string.encode("utf-8"), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received_hash, expected_hash):
+        return None
+
+    try:
+        auth_date = int(fields.get("auth_date", "0"))
+        user_id = int(json.loads(fields.get("user", "{}"))["id"])
+    except (ValueError, KeyError, TypeError):
+        return None
+    current = time.time() if now is None else now
+    if INIT_DATA_MAX_AGE > 0 and current - auth_date > INIT_DATA_MAX_AGE:
+        return None
+    return user_id
@@ -0,0 +1,267 @@
+"""
+Telegram Bot API client.
+
+Every Bot API call of the backend goes through call(), which shares one
+pooled HTTP connection and keeps the bot within Telegram's limits:
+
+- a global token bucket of GLOBAL_RATE requests per second (Telegram allows
+  about 30 messages per second in total) and a bucket per chat for calls
+  that send into a chat (about one message per second);
+- requests wait for a global slot in a priority queue, so payment calls and
+  notifications overtake a running broadcast or bulk message deletion; the
+  slot goes to the most urgent caller waiting when it frees up;
+- a 429 answer holds back further calls for its retry_after: only calls into
+  the same chat when the call was chat-scoped, otherwise all calls except
+  payment calls. The call is retried, up to MAX_RETRIES times. Streamed
+  uploads cannot be replayed and raise instead; their download job retries
+  them later.
+
+Errors are raised as TelegramAPIError (ok=false answers) or httpx errors.
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+try:
+    from backend.stream_limits import TokenBucket
+except ImportError:
+    from stream_limits import TokenBucket
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# Configuration
+GLOBAL_RATE = int(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # requests per second
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # messages per second into one chat
+CHAT_BURST = 3
+MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))  # after 429
+MAX_CONNECTIONS = 20
+TIMEOUT = 30.0
+UPLOAD_TIMEOUT = 180.0  # large audio files
+MAX_CHATS = 10000  # idle chat buckets are pruned above this
+
+# Priorities, lower is served first
+PRIORITY_PAYMENT = 0  # invoices, pre-checkout answers, payment notifications
+PRIORITY_USER = 1  # responses to a user's action
+PRIORITY_BULK = 2  # broadcasts, scheduled message deletion
+PRIORITY_NAMES = {PRIORITY_PAYMENT: "payment", PRIORITY_USER: "user", PRIORITY_BULK: "bulk"}
+
+# Storage
+_client: Optional[httpx.AsyncClient] = None
+_dispatcher: Optional["asyncio.Task[None]"] = None
+# Format: (priority, sequence, future granted a global slot)
+_queue: "asyncio.PriorityQueue" = asyncio.PriorityQueue()
+_sequence = itertools.count()
+_global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+# Format: chat_id -> bucket
+_chat_buckets: Dict[int, TokenBucket] = {}
+_paused_until = 0.0  # monotonic time, set by a 429 outside a chat
+_arrived = asyncio.Event()  # wakes the dispatcher during a pause
+
+# Statistics
+_stats = {
+    "requests": 0,
+    "errors": 0,  # ok=false answers other than 429
+    "transport_errors": 0,
+    "rate_limited": 0,  # 429 answers
+    "chat_rate_limited": 0,  # of them on chat-scoped calls, held back in that chat only
+    "retried": 0,
+    "retry_after_seconds": 0,
+    "chat_waits": 0,  # held back by a chat bucket
+    "queue_seconds": 0.0,  # spent waiting for a global slot
+    "request_seconds": 0.0
+}
+_method_stats: Dict[str, int] = defaultdict(int)
+_priority_stats: Dict[str, int] = defaultdict(int)
+
+
+class TelegramAPIError(Exception):
+    """Telegram Bot API answered with ok=false"""
+
+    def __init__(self, status_code: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(f"Telegram API error {status_code}: {description}")
+        self.status_code = status_code
+        self.description = description
+        self.retry_after = retry_after
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+        )
+    return _client
+
+
+async def _dispatch() -> None:
+    """Grants global slots in priority order within the global bucket"""
+    while True:
+        item = await _queue.get()
+        priority, _, granted = item
+        if granted.done():
+            continue  # caller gave up
+        pause = _paused_until - time.monotonic()
+        if pause > 0 and priority != PRIORITY_PAYMENT:
+            # Payment calls are not paused: wake up when one arrives
+            _arrived.clear()
+            try:
+                await asyncio.wait_for(_arrived.wait(), timeout=pause)
+            except asyncio.TimeoutError:
+                pass
+            _queue.put_nowait(item)
+            continue
+        wait = _global_bucket.reserve(1)
+        if wait > 0:
+            await asyncio.sleep(wait)
+            # A more urgent call may have arrived meanwhile: it gets this slot
+            _queue.put_nowait(item)
+            _, _, granted = _queue.get_nowait()
+        if not granted.done():
+            granted.set_result(None)
+
+
+def _ensure_dispatcher() -> None:
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.done() or _dispatcher.get_loop() is not asyncio.get_running_loop():
+        _dispatcher = asyncio.create_task(_dispatch())
+
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) >= MAX_CHATS:
+            now = time.monotonic()
+            for stale in [c for c, b in _chat_buckets.items() if now - b.updated > CHAT_BURST / CHAT_RATE]:
+                del _chat_buckets[stale]
+        bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+        _chat_buckets[chat_id] = bucket
+    return bucket
+
+
+async def _acquire(priority: int, chat_id: Optional[int]) -> None:
+    if chat_id is not None:
+        wait = _chat_bucket(chat_id).reserve(1)
+        if wait > 0:
+            _stats["chat_waits"] += 1
+            await asyncio.sleep(wait)
+
+    _ensure_dispatcher()
+    granted = asyncio.get_running_loop().create_future()
+    started = time.monotonic()
+    _queue.put_nowait((priority, next(_sequence), granted))
+    _arrived.set()
+    try:
+        await granted
+    finally:
+        granted.cancel()  # no-op once granted; tells the dispatcher to skip it otherwise
+    _stats["queue_seconds"] += time.monotonic() - started
+
+
+async def call(
+    method: str,
+    data: Optional[Dict[str, Any]] = None,
+    *,
+    priority: int = PRIORITY_USER,
+    chat_id: Optional[int] = None,
+    content: Optional[AsyncIterator[bytes]] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Any:
+    """
+    Calls a Bot API method and returns its result.
+    data is sent as JSON (None values are dropped); a streamed multipart
+    upload is passed as content with its headers instead. chat_id applies
+    the per-chat limit and should be given for calls that send into a chat.
+    Raises TelegramAPIError.
+    """
+    global _paused_until
+    if not BOT_TOKEN:
+        raise TelegramAPIError(0, "BOT_TOKEN not configured")
+
+    url = f"https://api.telegram.org/bot{BOT_TOKEN}/{method}"
+    payload = {k: v for k, v in (data or {}).items() if v is not None}
+    _method_stats[method] += 1
+    _priority_stats[PRIORITY_NAMES.get(priority, str(priority))] += 1
+
+    attempt = 0
+    while True:
+        await _acquire(priority, chat_id)
+        _stats["requests"] += 1
+        started = time.monotonic()
+        try:
+            if content is not None:
+                response = await _get_client().post(url, content=content, headers=headers, timeout=UPLOAD_TIMEOUT)
+            else:
+                response = await _get_client().post(url, json=payload)
+            result = response.json()
+        except (httpx.HTTPError, ValueError):
+            _stats["transport_errors"] += 1
+            raise
+        finally:
+            _stats["request_seconds"] += time.monotonic() - started
+
+        if result.get("ok"):
+            return result["result"]
+
+        description = result.get("description", "")
+        retry_after = (result.get("parameters") or {}).get("retry_after")
+        if response.status_code != 429:
+            _stats["errors"] += 1
+            raise TelegramAPIError(response.status_code, description)
+
+        _stats["rate_limited"] += 1
+        retry_after = int(retry_after or 1)
+        _stats["retry_after_seconds"] += retry_after
+        if chat_id is not None:
+            # Лимит этого чата: задерживаем только вызовы в этот чат
+            _stats["chat_rate_limited"] += 1
+            bucket = _chat_bucket(chat_id)
+            bucket.reserve(0)  # refill
+            # The next call into the chat has to wait retry_after seconds
+            bucket.tokens = min(bucket.tokens, 0.0) + 1 - retry_after * bucket.rate
+        else:
+            # Лимит общий для бота: приостанавливаем все вызовы, кроме платежных
+            _paused_until = max(_paused_until, time.monotonic() + retry_after)
+        print(f"⚠️ Telegram rate limit on {method}, retry after {retry_after}s")
+        attempt += 1
+        if content is not None or attempt > MAX_RETRIES:
+            raise TelegramAPIError(429, description, retry_after)
+        _stats["retried"] += 1
+
+
+async def close() -> None:
+    """Stops the dispatcher and closes the pooled connection"""
+    global _client, _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.cancel()
+        _dispatcher = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_telegram_client_stats() -> Dict[str, Any]:
+    """
+    Returns Bot API client statistics.
+    """
+    requests = _stats["requests"]
+    pause = _paused_until - time.monotonic()
+    return {
+        "global_rate": GLOBAL_RATE,
+        "chat_rate": CHAT_RATE,
+        "queued": _queue.qsize(),
+        "paused_seconds": round(pause, 1) if pause > 0 else 0,
+        "chats": len(_chat_buckets),
+        **_stats,
+        "queue_seconds": round(_stats["queue_seconds"], 1),
+        "request_seconds": round(_stats["request_seconds"], 1),
+        "avg_request_ms": round(_stats["request_seconds"] * 1000 / requests) if requests else 0,
+        "by_method": dict(_method_stats),
+        "by_priority": dict(_priority_stats)
+    }
@@ -0,0 +1,734 @@
+"""
+Delivery of tracks to the user's Telegram chat.
+
+The first delivery of a track downloads the audio (yt-dlp for YouTube,
+HTTP otherwise) and uploads it with sendAudio. Telegram answers with an
+audio.file_id that this bot may reuse, so it is stored per track ID and
+every later delivery of the same track is a sendAudio with that file_id -
+no download, no upload. If Telegram rejects a stored file_id, it is dropped
+and the track is uploaded again.
+
+Audio is fetched only from a URL the server derived from the track ID
+itself: the Hitmo URL that the track registry resolves for a signed stream
+handle, or the watch URL rebuilt from a YouTube video ID. The URL sent by
+the client is never fetched, so a client can neither attach its own audio
+to another track nor make the server request arbitrary addresses. Handle
+links with a quality parameter are sent but not cached.
+
+Uploads are streamed: the multipart body is generated on the fly from the
+source response (or the yt-dlp temp file) in UPLOAD_CHUNK_SIZE pieces, so
+a delivery holds one chunk of audio in memory instead of the whole file.
+
+A Hitmo track that is not cached yet is first offered to Telegram by URL
+(sendAudio accepts HTTP URLs of files up to 20 MB), so the audio never
+passes through this server: the resolved CDN URL first, then the signed
+handle on our own /api/stream endpoint if TELEGRAM_PUBLIC_BASE_URL is set.
+If Telegram cannot fetch either, the track is relayed as an upload. Every
+strategy records its successes, failures and latency.
+
+Batches (playlists, albums) are sent in order as media groups of up to ten
+tracks. Tracks without a cached file_id are downloaded to temp files up to
+BATCH_FETCH_CONCURRENCY at a time, one group ahead of the group being sent.
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import anyio
+import httpx
+from sqlalchemy.orm import Session
+
+try:
+    from backend.database import TelegramFile
+    from backend.stream_handles import make_handle, parse_handle
+    from backend.stream_upstream import UpstreamError, open_upstream, parse_total_size
+    from backend.stream_resolver import get_resolved
+    from backend.thumbnails import get_thumbnail, get_thumbnail_stats
+    from backend.telegram_client import PRIORITY_USER, TelegramAPIError, call as telegram_call
+except ImportError:
+    from database import TelegramFile
+    from stream_handles import make_handle, parse_handle
+    from stream_upstream import UpstreamError, open_upstream, parse_total_size
+    from stream_resolver import get_resolved
+    from thumbnails import get_thumbnail, get_thumbnail_stats
+    from telegram_client import PRIORITY_USER, TelegramAPIError, call as telegram_call
+
+FILE_ID_CACHE_ENABLED = os.getenv("TELEGRAM_FILE_ID_CACHE", "1") == "1"
+UPLOAD_CHUNK_SIZE = int(os.getenv("TELEGRAM_UPLOAD_CHUNK_KB", "64")) * 1024
+RECENT_UPLOADS = 20
+MEDIA_GROUP_SIZE = 10  # Telegram's limit for sendMediaGroup
+BATCH_FETCH_CONCURRENCY = int(os.getenv("TELEGRAM_BATCH_FETCH_CONCURRENCY", "3"))
+URL_SEND_ENABLED = os.getenv("TELEGRAM_URL_SEND_ENABLED", "1") == "1"
+URL_SEND_MAX_BYTES = int(os.getenv("TELEGRAM_URL_SEND_MAX_MB", "20")) * 1024 * 1024  # Telegram's limit for files sent by URL
+# Public address of this API for handle URLs; without it handle URLs are not offered
+PUBLIC_BASE_URL = os.getenv("TELEGRAM_PUBLIC_BASE_URL", "").rstrip("/")
+STRATEGIES = ("file_id", "cdn_url", "handle_url", "upload")
+# ffmpeg for yt-dlp's mp3 conversion, shared with the transcoder; a bare name is looked up in PATH
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+# Called with (audio bytes sent, total audio bytes or None) during an upload
+ProgressCallback = Callable[[int, Optional[int]], None]
+# Returns the Hitmo URL that the track registry resolves for a handle track, or None
+SourceResolver = Callable[[Any], Awaitable[Optional[str]]]
+
+_YOUTUBE_ID = re.compile(r"[A-Za-z0-9_-]{11}")
+
+# Statistics
+_stats = {
+    "file_id_hits": 0,  # sent by file_id, nothing uploaded
+    "file_id_misses": 0,
+    "file_id_rejected": 0,  # stored file_id refused by Telegram, uploaded again
+    "uploads": 0,
+    "upload_bytes": 0,
+    "uncacheable": 0,  # audio not derivable from the track ID on the server
+    # Most upload data one request held in memory at once: covers (kept whole)
+    # plus the audio chunk in flight; httpx socket buffers are not included
+    "upload_peak_buffered_bytes": 0,
+    "batches": 0,
+    "media_groups": 0,  # sendMediaGroup calls
+    "batch_tracks": 0,
+    "batch_tracks_skipped": 0,  # could not be downloaded
+    "url_ineligible": 0  # Hitmo track too large or of unknown size for a send by URL
+}
+_recent_uploads: deque = deque(maxlen=RECENT_UPLOADS)
+# Format: strategy -> {attempts, successes, failures, seconds}
+_strategy_stats: Dict[str, Dict[str, Any]] = {
+    name: {"attempts": 0, "successes": 0, "failures": 0, "seconds": 0.0} for name in STRATEGIES
+}
+
+
+def is_youtube_url(url: str) -> bool:
+    return 'youtube.com' in url or 'youtu.be' in url
+
+
+def cache_key(track: Any) -> Optional[str]:
+    """
+    Track ID to cache the file_id under, or None if the server cannot derive
+    the audio from the ID. Handle URLs with a quality parameter are not cached.
+    """
+    parts = urlsplit(track.url)
+    if parts.path.startswith("/api/stream/"):
+        if parts.query or parse_handle(parts.path.rsplit("/", 1)[-1]) != track.id:
+            return None
+        return track.id
+    if track.id.startswith("yt_") and _YOUTUBE_ID.fullmatch(track.id[3:]):
+        return track.id
+    return None
+
+
+def server_audio_url(track: Any, source_url: Optional[str]) -> Optional[str]:
+    """
+    URL of the track's audio derived on the server: the resolved Hitmo URL
+    of a handle track, or the watch URL for a YouTube video ID. None if
+    there is none; URLs sent by the client are never fetched.
+    """
+    if source_url:
+        return source_url
+    if track.id.startswith("yt_") and _YOUTUBE_ID.fullmatch(track.id[3:]):
+        return f"https://www.youtube.com/watch?v={track.id[3:]}"
+    return None
+
+
+def download_youtube_file(url: str, temp_dir: str) -> str:
+    """Downloads a YouTube track as mp3 into temp_dir with yt-dlp (blocking); returns the file path"""
+    import yt_dlp
+
+    print(f"📥 Downloading YouTube track for chat: {url}")
+
+    temp_path = os.path.join(temp_dir, 'audio')
+
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': temp_path,
+        'quiet': False,
+        'no_warnings': False,
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web'],
+                'skip': ['dash', 'hls']
+            }
+        },
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+    }
+
+    if os.path.dirname(FFMPEG_PATH):
+        ydl_opts['ffmpeg_location'] = FFMPEG_PATH
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([url])
+
+    # Find the downloaded file
+    if os.path.exists(temp_path):
+        downloaded_file = temp_path
+    else:
+        downloaded_file = None
+        for ext in ['.mp3', '.webm', '.m4a', '.opus', '.mp4']:
+            test_path = temp_path + ext
+            if os.path.exists(test_path):
+                downloaded_file = test_path
+                break
+
+    if not downloaded_file:
+        files_in_dir = os.listdir(temp_dir) if os.path.exists(temp_dir) else []
+        raise Exception(f"Downloaded file not found. Dir contents: {files_in_dir}")
+
+    print(f"✅ YouTube track downloaded: {os.path.getsize(downloaded_file)} bytes")
+    return downloaded_file
+
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    # Чтение с диска - в отдельном потоке, чтобы не блокировать event loop
+    with open(path, 'rb') as f:
+        while True:
+            chunk = await anyio.to_thread.run_sync(f.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+@asynccontextmanager
+async def open_track_audio(url: str):
+    """
+    Opens the track audio for a streamed upload.
+    Yields (size or None if unknown, iterator of chunks of at most UPLOAD_CHUNK_SIZE).
+    """
+    if is_youtube_url(url):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # yt-dlp блокирующий - запускаем в отдельном потоке
+            path = await asyncio.to_thread(download_youtube_file, url, temp_dir)
+            yield os.path.getsize(path), _file_chunks(path)
+        finally:
+            # Cleanup temp directory
+            try:
+                if os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir)
+                    print(f"🗑️ Cleaned up: {temp_dir}")
+            except Exception as e:
+                print(f"Error cleaning up temp dir: {e}")
+        return
+
+    # Увеличен timeout для больших файлов
+    async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as client:
+        async with client.stream("GET", url) as audio_response:
+            audio_response.raise_for_status()
+            size = None
+            if "content-length" in audio_response.headers and "content-encoding" not in audio_response.headers:
+                size = int(audio_response.headers["content-length"])
+            yield size, audio_response.aiter_bytes(UPLOAD_CHUNK_SIZE)
+
+
+class _MultipartUpload:
+    """
+    multipart/form-data body generated while it is sent. Content-Length is
+    set when every part size is known, otherwise the body goes chunked.
+    A file part is either an iterator of chunks or bytes already in memory
+    (a cover); peak_buffered tracks the in-memory parts plus the chunk being
+    sent. on_progress follows the first file part.
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        files: List[Tuple[str, str, str, Optional[int], Union[bytes, AsyncIterator[bytes]]]],
+        on_progress: Optional[ProgressCallback] = None
+    ):
+        self.on_progress = on_progress
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            head = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            self.parts.append((head.encode() + str(value).encode() + b"\r\n", None, None))
+        for name, filename, content_type, size, chunks in files:
+            head = (
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            )
+            self.parts.append((head.encode(), size, chunks))
+        self.progress_chunks = self.parts[len(self.parts) - len(files)][2] if files else None  # first file part
+        self.tail = f"--{self.boundary}--\r\n".encode()
+        self.file_bytes = 0
+        self.resident = sum(len(chunks) for _, _, _, _, chunks in files if isinstance(chunks, bytes))
+        self.peak_buffered = self.resident
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": f"multipart/form-data; boundary={self.boundary}"}
+        length = len(self.tail)
+        for head, size, chunks in self.parts:
+            if chunks is not None and size is None:
+                return headers
+            length += len(head) + (size + 2 if chunks is not None else 0)
+        headers["Content-Length"] = str(length)
+        return headers
+
+    async def body(self) -> AsyncIterator[bytes]:
+        for head, size, chunks in self.parts:
+            yield head
+            if chunks is None:
+                continue
+            if isinstance(chunks, bytes):
+                self.file_bytes += len(chunks)
+                yield chunks
+                yield b"\r\n"
+                continue
+            sent = 0
+            async for chunk in chunks:
+                sent += len(chunk)
+                self.file_bytes += len(chunk)
+                self.peak_buffered = max(self.peak_buffered, self.resident + len(chunk))
+                yield chunk
+                if self.on_progress and chunks is self.progress_chunks:
+                    self.on_progress(sent, size)
+            yield b"\r\n"
+        yield self.tail
+
+
+async def _bot_request(method: str, data: Dict[str, Any], upload: Optional[_MultipartUpload] = None) -> Any:
+    """Bot API call into data's chat, with JSON fields or a streamed upload; raises TelegramAPIError"""
+    if upload:
+        try:
+            return await telegram_call(method, priority=PRIORITY_USER, chat_id=data['chat_id'],
+                                       content=upload.body(), headers=upload.headers)
+        finally:
+            _stats["upload_peak_buffered_bytes"] = max(_stats["upload_peak_buffered_bytes"], upload.peak_buffered)
+    return await telegram_call(method, data, priority=PRIORITY_USER, chat_id=data['chat_id'])
+
+
+async def _send_audio(data: Dict[str, Any], upload: Optional[_MultipartUpload] = None) -> Dict[str, Any]:
+    """sendAudio; returns the sent Message"""
+    return await _bot_request("sendAudio", data, upload)
+
+
+async def _upload_audio(data: Dict[str, Any], track: Any, audio_url: str,
+                        on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Uploads the track file, streaming it from audio_url into the request"""
+    started = time.monotonic()
+    # Обложка готовится параллельно с загрузкой/открытием аудио
+    thumbnail_task = asyncio.create_task(get_thumbnail(track.image))
+    try:
+        async with open_track_audio(audio_url) as (size, chunks):
+            thumbnail_data = await thumbnail_task
+            files = [('audio', 'track.mp3', 'audio/mpeg', size, chunks)]
+            if thumbnail_data:
+                files.append(('thumbnail', 'thumb.jpg', 'image/jpeg', len(thumbnail_data), thumbnail_data))
+            upload = _MultipartUpload(data, files, on_progress)
+            message = await _send_audio(data, upload)
+    finally:
+        thumbnail_task.cancel()
+
+    audio_bytes = upload.file_bytes - len(thumbnail_data or b"")
+    _stats["uploads"] += 1
+    _stats["upload_bytes"] += audio_bytes
+    _recent_uploads.append({
+        "track_id": track.id,
+        "bytes": audio_bytes,
+        "peak_buffered_bytes": upload.peak_buffered,
+        "seconds": round(time.monotonic() - started, 2)
+    })
+    return message
+
+
+def _remember(db: Session, track_id: str, message: Dict[str, Any]) -> None:
+    audio = message.get("audio")
+    if not audio or not audio.get("file_id"):
+        return
+    thumbnail = audio.get("thumbnail") or audio.get("thumb") or {}
+    db.merge(TelegramFile(
+        track_id=track_id,
+        file_id=audio["file_id"],
+        file_unique_id=audio.get("file_unique_id"),
+        thumbnail_file_id=thumbnail.get("file_id"),
+        file_size=audio.get("file_size") or 0,
+        uses=0,
+        created_at=datetime.utcnow(),
+        last_used_at=datetime.utcnow()
+    ))
+    db.commit()
+
+
+def _record(strategy: str, ok: bool, started: float) -> None:
+    stats = _strategy_stats[strategy]
+    stats["attempts"] += 1
+    stats["successes" if ok else "failures"] += 1
+    stats["seconds"] += time.monotonic() - started
+
+
+def _is_public_host(host: Optional[str]) -> bool:
+    if not host or host == "localhost":
+        return False
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return "." in host  # domain name
+    return address.is_global
+
+
+def _handle_url(track: Any) -> Optional[str]:
+    """
+    Absolute signed /api/stream/<handle> URL of the track on this API, if
+    PUBLIC_BASE_URL is configured. The host of the client's track URL is
+    never used, so Telegram only fetches from our own server.
+    """
+    if not PUBLIC_BASE_URL:
+        return None
+    path = urlsplit(track.url).path
+    track_id = parse_handle(path.rsplit("/", 1)[-1]) if path.startswith("/api/stream/") else None
+    if not track_id:
+        return None
+    return f"{PUBLIC_BASE_URL}/api/stream/{make_handle(track_id)}"
+
+
+async def _probe_source(source_url: str) -> Tuple[Optional[str], Optional[int]]:
+    """(resolved CDN URL, file size) of a Hitmo source, from the resolver cache or a one-byte request"""
+    resolved = get_resolved(source_url)
+    if resolved and resolved["size"]:
+        return resolved["final_url"], resolved["size"]
+    try:
+        client, response = await open_upstream(source_url, range_header="bytes=0-0")
+    except (UpstreamError, httpx.HTTPError) as e:
+        print(f"Failed to probe track source: {e}")
+        return None, None
+    try:
+        return str(response.url), parse_total_size(response)
+    finally:
+        await response.aclose()
+        await client.aclose()
+
+
+async def _send_by_url(data: Dict[str, Any], track: Any, source_url: str) -> Optional[Dict[str, Any]]:
+    """
+    Offers the audio to Telegram by URL: the CDN URL, then our handle URL.
+    Returns the sent Message, or None if the track has to be uploaded.
+    """
+    final_url, size = await _probe_source(source_url)
+    if not size or size > URL_SEND_MAX_BYTES:
+        _stats["url_ineligible"] += 1
+        return None
+
+    candidates = []
+    if final_url and _is_public_host(urlsplit(final_url).hostname):
+        candidates.append(("cdn_url", final_url))
+    handle_url = _handle_url(track)
+    if handle_url:
+        candidates.append(("handle_url", handle_url))
+    if not candidates:
+        return None
+
+    thumbnail_data = await get_thumbnail(track.image)
+    for strategy, url in candidates:
+        fields = {**data, 'audio': url}
+        upload = None
+        if thumbnail_data:
+            # Обложку Telegram принимает только файлом
+            upload = _MultipartUpload(fields, [
+                ('thumbnail', 'thumb.jpg', 'image/jpeg', len(thumbnail_data), thumbnail_data)
+            ])
+        started = time.monotonic()
+        try:
+            message = await _send_audio(fields, upload)
+        except TelegramAPIError as e:
+            _record(strategy, False, started)
+            if e.status_code != 400:
+                raise
+            # Telegram не смог скачать файл по ссылке - пробуем следующую стратегию
+            print(f"Telegram could not fetch {strategy} for {track.id}: {e.description}")
+            continue
+        _record(strategy, True, started)
+        return message
+    return None
+
+
+async def send_track_to_chat(
+    db: Session,
+    chat_id: int,
+    track: Any,
+    protect_content: bool,
+    on_progress: Optional[ProgressCallback] = None,
+    source_url: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Sends the track as audio to the chat, by cached file_id when possible.
+    source_url is the Hitmo URL that the track registry resolved for a
+    handle track; the audio is fetched from it (first offered to Telegram by
+    URL), and only then is the file_id cached. Tracks with neither a
+    source_url nor a YouTube video ID are refused; the client's track URL
+    is never fetched. Returns the sent Telegram Message.
+    """
+    data = {
+        'chat_id': chat_id,
+        'title': track.title,
+        'performer': track.artist,
+        'duration': track.duration if track.duration > 0 else None,
+        'protect_content': protect_content  # Premium Pro может пересылать
+    }
+
+    key = cache_key(track) if FILE_ID_CACHE_ENABLED else None
+    if FILE_ID_CACHE_ENABLED and key is None:
+        _stats["uncacheable"] += 1
+
+    cached = db.query(TelegramFile).filter(TelegramFile.track_id == key).first() if key else None
+    if cached:
+        started = time.monotonic()
+        try:
+            message = await _send_audio({**data, 'audio': cached.file_id})
+            _record("file_id", True, started)
+            cached.uses = (cached.uses or 0) + 1
+            cached.last_used_at = datetime.utcnow()
+            db.commit()
+            _stats["file_id_hits"] += 1
+            return message
+        except TelegramAPIError as e:
+            _record("file_id", False, started)
+            if e.status_code != 400:
+                raise
+            # file_id больше не действителен - загружаем файл заново
+            print(f"Telegram rejected cached file_id for {key}: {e.description}")
+            _stats["file_id_rejected"] += 1
+            db.delete(cached)
+            db.commit()
+    elif key:
+        _stats["file_id_misses"] += 1
+
+    audio_url = server_audio_url(track, source_url)
+    if audio_url is None:
+        raise Exception(f"No server-side audio source for track {track.id}")
+
+    message = None
+    if URL_SEND_ENABLED and source_url and not is_youtube_url(audio_url):
+        message = await _send_by_url(data, track, source_url)
+
+    if message is None:
+        started = time.monotonic()
+        try:
+            message = await _upload_audio(data, track, audio_url, on_progress)
+        except Exception:
+            _record("upload", False, started)
+            raise
+        _record("upload", True, started)
+
+    if key:
+        _remember(db, key, message)
+    return message
+
+
+def _audio_fields(track: Any) -> Dict[str, Any]:
+    return {
+        'title': track.title,
+        'performer': track.artist,
+        'duration': track.duration if track.duration > 0 else None
+    }
+
+
+async def _prepare_item(track: Any, key: Optional[str], file_id: Optional[str], path: str,
+                        semaphore: asyncio.Semaphore, resolve_source: Optional[SourceResolver] = None) -> Dict[str, Any]:
+    """Batch item: a cached file_id, or the audio downloaded to path plus its cover"""
+    item = {"track": track, "key": key, "file_id": file_id, "path": None, "size": 0, "thumbnail": None}
+    if file_id:
+        return item
+    async with semaphore:
+        source_url = await resolve_source(track) if resolve_source else None
+        audio_url = server_audio_url(track, source_url)
+        if audio_url is None:
+            raise Exception(f"No server-side audio source for track {track.id}")
+        thumbnail_task = asyncio.create_task(get_thumbnail(track.image))
+        try:
+            async with open_track_audio(audio_url) as (_, chunks):
+                with open(path, 'wb') as f:
+                    async for chunk in chunks:
+                        f.write(chunk)
+            item["thumbnail"] = await thumbnail_task
+        finally:
+            thumbnail_task.cancel()
+    item["path"] = path
+    item["size"] = os.path.getsize(path)
+    return item
+
+
+async def _send_items(chat_id: int, items: List[Dict[str, Any]], protect_content: bool) -> List[Dict[str, Any]]:
+    """Sends items as one media group (or one audio); returns the messages in order"""
+    if len(items) == 1:
+        item = items[0]
+        data = {'chat_id': chat_id, **_audio_fields(item["track"]), 'protect_content': protect_content}
+        if item["file_id"]:
+            return [await _send_audio({**data, 'audio': item["file_id"]})]
+        files = [('audio', 'track.mp3', 'audio/mpeg', item["size"], _file_chunks(item["path"]))]
+        if item["thumbnail"]:
+            files.append(('thumbnail', 'thumb.jpg', 'image/jpeg', len(item["thumbnail"]), item["thumbnail"]))
+        return [await _send_audio(data, _MultipartUpload(data, files))]
+
+    media = []
+    files = []
+    for index, item in enumerate(items):
+        entry = {"type": "audio", **{k: v for k, v in _audio_fields(item["track"]).items() if v is not None}}
+        if item["file_id"]:
+            entry["media"] = item["file_id"]
+        else:
+            entry["media"] = f"attach://audio{index}"
+            files.append((f'audio{index}', f'track{index}.mp3', 'audio/mpeg', item["size"], _file_chunks(item["path"])))
+            if item["thumbnail"]:
+                entry["thumbnail"] = f"attach://thumb{index}"
+                files.append((f'thumb{index}', f'thumb{index}.jpg', 'image/jpeg', len(item["thumbnail"]), item["thumbnail"]))
+        media.append(entry)
+
+    data = {'chat_id': chat_id, 'media': media, 'protect_content': protect_content}
+    _stats["media_groups"] += 1
+    if not files:
+        return await _bot_request("sendMediaGroup", data)
+    data['media'] = json.dumps(media, ensure_ascii=False)  # multipart fields are strings
+    return await _bot_request("sendMediaGroup", data, _MultipartUpload(data, files))
+
+
+async def send_tracks_to_chat(
+    db: Session,
+    chat_id: int,
+    tracks: List[Any],
+    protect_content: bool,
+    start: int = 0,
+    on_sent: Optional[Callable[[int, List[Any], List[Dict[str, Any]], List[Any]], None]] = None,
+    resolve_source: Optional[SourceResolver] = None
+) -> Optional[int]:
+    """
+    Sends tracks[start:] to the chat in order, as media groups of up to
+    MEDIA_GROUP_SIZE. Tracks that cannot be downloaded are skipped. After
+    each group on_sent(index of the next track, sent tracks, their messages,
+    skipped tracks) is called. resolve_source gives the Hitmo URL of a handle
+    track, which is then downloaded from there and cached like in
+    send_track_to_chat. Returns the id of the last message sent.
+    """
+    _stats["batches"] += 1
+    keys = [cache_key(track) if FILE_ID_CACHE_ENABLED else None for track in tracks]
+    temp_dir = tempfile.mkdtemp()
+    semaphore = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+    tasks: Dict[int, "asyncio.Task[Dict[str, Any]]"] = {}
+
+    def prepare(index: int) -> "asyncio.Task[Dict[str, Any]]":
+        cached = None
+        if keys[index]:
+            cached = db.query(TelegramFile).filter(TelegramFile.track_id == keys[index]).first()
+        path = os.path.join(temp_dir, f"{index}.mp3")
+        return asyncio.create_task(_prepare_item(
+            tracks[index], keys[index], cached.file_id if cached else None, path, semaphore, resolve_source
+        ))
+
+    last_message_id = None
+    try:
+        for group_start in range(start, len(tracks), MEDIA_GROUP_SIZE):
+            group = range(group_start, min(group_start + MEDIA_GROUP_SIZE, len(tracks)))
+            # Следующая группа скачивается, пока отправляется текущая
+            for index in range(group_start, min(group_start + 2 * MEDIA_GROUP_SIZE, len(tracks))):
+                if index not in tasks:
+                    tasks[index] = prepare(index)
+            results = await asyncio.gather(*(tasks[index] for index in group), return_exceptions=True)
+            items = []
+            skipped = []
+            for index, result in zip(group, results):
+                if isinstance(result, Exception):
+                    print(f"❌ Batch: skipping track {tracks[index].id}: {result}")
+                    _stats["batch_tracks_skipped"] += 1
+                    skipped.append(tracks[index])
+                else:
+                    items.append(result)
+            if not items:
+                if on_sent:
+                    on_sent(group.stop, [], [], skipped)
+                continue
+
+            try:
+                messages = await _send_items(chat_id, items, protect_content)
+            except TelegramAPIError as e:
+                stale = [item for item in items if item["file_id"]]
+                if e.status_code != 400 or not stale:
+                    raise
+                # Один из file_id больше не действителен - загружаем эти треки файлами
+                print(f"Telegram rejected cached file_ids in batch: {e.description}")
+                for item in stale:
+                    db.query(TelegramFile).filter(TelegramFile.track_id == item["key"]).delete()
+                    _stats["file_id_rejected"] += 1
+                db.commit()
+                items = [
+                    await _prepare_item(item["track"], item["key"], None, os.path.join(temp_dir, f"retry_{i}.mp3"),
+                                        semaphore, resolve_source)
+                    if item["file_id"] else item
+                    for i, item in enumerate(items)
+                ]
+                messages = await _send_items(chat_id, items, protect_content)
+
+            for item, message in zip(items, messages):
+                if item["file_id"]:
+                    _stats["file_id_hits"] += 1
+                else:
+                    _stats["uploads"] += 1
+                    _stats["upload_bytes"] += item["size"]
+                    os.remove(item["path"])
+                    if item["key"]:
+                        _remember(db, item["key"], message)
+            _stats["batch_tracks"] += len(items)
+            last_message_id = messages[-1]["message_id"]
+            if on_sent:
+                on_sent(group.stop, [item["track"] for item in items], messages, skipped)
+    finally:
+        for task in tasks.values():
+            if task.done() and not task.cancelled():
+                task.exception()  # already reported, or not needed any more
+            else:
+                task.cancel()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return last_message_id
+
+
+def get_delivery_stats(db: Session) -> Dict[str, Any]:
+    """
+    Returns chat delivery statistics.
+    """
+    sends = _stats["file_id_hits"] + _stats["uploads"]
+    rss_peak_mb = None
+    if resource is not None:
+        # ru_maxrss is in KB on Linux
+        rss_peak_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return {
+        "file_id_cache_enabled": FILE_ID_CACHE_ENABLED,
+        "cached_file_ids": db.query(TelegramFile).count(),
+        "file_id_hit_rate": round(_stats["file_id_hits"] / sends, 3) if sends else 0,
+        "upload_chunk_size": UPLOAD_CHUNK_SIZE,
+        "process_rss_peak_mb": rss_peak_mb,
+        **_stats,
+        "url_send_enabled": URL_SEND_ENABLED,
+        "strategies": {
+            name: {
+                **stats,
+                "seconds": round(stats["seconds"], 1),
+                "success_rate": round(stats["successes"] / stats["attempts"], 3) if stats["attempts"] else 0,
+                "avg_seconds": round(stats["seconds"] / stats["attempts"], 2) if stats["attempts"] else 0
+            }
+            for name, stats in _strategy_stats.items()
+        },
+        "thumbnails": get_thumbnail_stats(),
+        "recent_uploads": list(_recent_uploads)
+    }
@@ -0,0 +1,69 @@
+"""
+Unit tests for the artist index: transliteration keys, fuzzy lookup and
+the exact-only rule for short names.
+"""
+
+try:
+    from backend.artist_index import ArtistIndex, edit_distance, make_key, split_artists
+except ImportError:
+    from artist_index import ArtistIndex, edit_distance, make_key, split_artists
+
+
+def _index(*artists):
+    index = ArtistIndex()
+    for artist in artists:
+        index.add(artist)
+    return index
+
+
+def test_cyrillic_and_latin_share_a_key():
+    assert make_key("Мияги") == make_key("Miyagi")
+    assert make_key("Andy Panda") == make_key("andy  panda!")
+
+
+def test_split_artists():
+    assert split_artists("Miyagi & Andy Panda feat. Kyivstoner") == ["Miyagi", "Andy Panda", "Kyivstoner"]
+    assert split_artists("Skriptonit x 104, T-Fest") == ["Skriptonit", "104", "T-Fest"]
+
+
+def test_edit_distance_counts_transpositions_and_stops_early():
+    assert edit_distance("panda", "pnada", 2) == 1
+    assert edit_distance("panda", "panda", 2) == 0
+    assert edit_distance("a", "abcdef", 2) == 3
+
+
+def test_exact_lookup_returns_canonical_name():
+    index = _index("Miyagi", "Miyagi", "MIYAGI")
+    match = index.lookup("мияги")
+    assert match is not None
+    assert match.name == "Miyagi"
+    assert match.distance == 0
+
+
+def test_typo_resolves_to_closest_artist():
+    index = _index("Andy Panda", "Miyagi & Andy Panda")
+    match = index.lookup("Andi Pamda")
+    assert match is not None
+    assert match.name == "Andy Panda"
+    assert match.distance == 1
+
+
+def test_more_frequent_artist_wins_a_tie():
+    index = _index("Pandax", "Pandaz", "Pandaz")
+    match = index.lookup("Pandas")
+    assert match is not None
+    assert match.name == "Pandaz"
+
+
+def test_short_names_are_matched_exactly():
+    index = _index("Ann", "Мот")
+    assert index.lookup("Anna") is None
+    assert index.lookup("Mota") is None
+    assert index.lookup("Ам") is None
+    assert index.lookup("Ann").distance == 0
+
+
+def test_unknown_and_too_short_queries():
+    index = _index("Miyagi")
+    assert index.lookup("Completely Different") is None
+    assert index.lookup("m") is None
@@ -0,0 +1,95 @@
+"""
+Unit tests for the audio block cache: Range parsing, block arithmetic,
+gap filling from upstream and LRU eviction.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+try:
+    from backend.audio_cache import AudioDiskCache, parse_range
+except ImportError:
+    from audio_cache import AudioDiskCache, parse_range
+
+BLOCK = 10
+DATA = bytes(range(35))  # 3 full blocks and a 5-byte tail
+
+
+def _fetcher(calls):
+    async def fetch(start, end):
+        calls.append((start, end))
+        for offset in range(start, end + 1, 4):
+            yield DATA[offset:min(offset + 4, end + 1)]
+    return fetch
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-", 100) == (0, 99)
+    assert parse_range("bytes=10-19", 100) == (10, 19)
+    assert parse_range("bytes=90-500", 100) == (90, 99)
+    assert parse_range("bytes=-30", 100) == (70, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=20-10", "bytes=-0", "bytes=-", "bytes=0-1,5-6", "items=0-1"])
+def test_parse_range_rejects(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_block_math(tmp_path):
+    cache = AudioDiskCache(str(tmp_path), 1000, BLOCK)
+    assert [cache.block_length(len(DATA), i) for i in range(4)] == [10, 10, 10, 5]
+    assert cache.first_missing("k", len(DATA), 0, 34) == 0
+    assert cache.first_missing("k", len(DATA), 13, 34) == 13
+
+
+def test_gaps_are_fetched_once_and_cached(tmp_path):
+    cache = AudioDiskCache(str(tmp_path), 1000, BLOCK)
+    calls = []
+
+    async def scenario():
+        assert await cache.read_range("k", len(DATA), 12, 27, _fetcher(calls)) == DATA[12:28]
+        # The request was widened to whole blocks 1 and 2
+        assert calls == [(10, 29)]
+        assert cache.first_missing("k", len(DATA), 10, 29) is None
+        assert cache.first_missing("k", len(DATA), 0, 34) == 0
+        assert cache.first_missing("k", len(DATA), 25, 34) == 30
+
+        # Blocks 1-2 come from disk, only 0 and the tail are fetched
+        assert await cache.read_range("k", len(DATA), 0, 34, _fetcher(calls)) == DATA
+        assert calls[1:] == [(0, 9), (30, 34)]
+        assert cache.first_missing("k", len(DATA), 0, 34) is None
+
+    asyncio.run(scenario())
+    assert cache.total_bytes == len(DATA)
+
+
+def test_eviction_keeps_recently_used_blocks(tmp_path):
+    cache = AudioDiskCache(str(tmp_path), 2 * BLOCK, BLOCK)
+
+    async def scenario():
+        for index in range(3):
+            await cache.write_block("k", index, DATA[index * BLOCK:(index + 1) * BLOCK])
+            if index == 1:
+                cache.has_block("k", 0)  # touch block 0, so block 1 is the oldest
+
+    asyncio.run(scenario())
+    assert cache.total_bytes == 2 * BLOCK
+    assert cache.has_block("k", 0) and cache.has_block("k", 2)
+    assert not cache.has_block("k", 1)
+    assert not os.path.exists(cache.block_path("k", 1))
+
+
+def test_load_picks_up_blocks_from_disk(tmp_path):
+    first = AudioDiskCache(str(tmp_path), 1000, BLOCK)
+    asyncio.run(first.write_block("k", 0, DATA[:BLOCK]))
+
+    second = AudioDiskCache(str(tmp_path), 1000, BLOCK)
+    assert not second.has_block("k", 0)
+    asyncio.run(second.load())
+    assert second.has_block("k", 0)
+    assert second.total_bytes == BLOCK
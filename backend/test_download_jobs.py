@@ -0,0 +1,147 @@
+"""
+Unit tests for the download-to-chat job queue: deduplication, retries and
+resuming jobs after a restart. Runs against a temporary SQLite database.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+try:
+    from backend import download_jobs
+    from backend.database import Base
+except ImportError:
+    import download_jobs
+    from database import Base
+
+TRACK = {"id": "123", "title": "Song", "artist": "Artist"}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(download_jobs, "SessionLocal", session_factory)
+    monkeypatch.setattr(download_jobs, "_queue", asyncio.Queue())
+    monkeypatch.setattr(download_jobs, "_stats", dict.fromkeys(download_jobs._stats, 0))
+    monkeypatch.setattr(download_jobs, "RETRY_DELAY", 0)
+    session = session_factory()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_repeat_request_returns_the_pending_job(db):
+    job, created = download_jobs.enqueue(db, 1, TRACK)
+    again, created_again = download_jobs.enqueue(db, 1, TRACK)
+    other_user, created_other = download_jobs.enqueue(db, 2, TRACK)
+
+    assert created and not created_again and created_other
+    assert again.id == job.id
+    assert other_user.id != job.id
+    assert download_jobs._queue.qsize() == 2
+    assert download_jobs._stats["deduplicated"] == 1
+
+
+def test_finished_jobs_deduplicate_only_within_the_window(db):
+    job, _ = download_jobs.enqueue(db, 1, TRACK)
+    job.status = "done"
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    assert download_jobs.enqueue(db, 1, TRACK)[0].id == job.id
+
+    job.finished_at = datetime.utcnow() - timedelta(seconds=download_jobs.DEDUP_SECONDS + 1)
+    db.commit()
+    fresh, created = download_jobs.enqueue(db, 1, TRACK)
+    assert created and fresh.id != job.id
+
+
+def test_batches_deduplicate_on_the_track_list(db):
+    tracks = [TRACK, {**TRACK, "id": "456"}]
+    batch, _ = download_jobs.enqueue_batch(db, 1, tracks)
+    assert download_jobs.enqueue_batch(db, 1, list(tracks))[0].id == batch.id
+    assert download_jobs.enqueue_batch(db, 1, tracks[::-1])[0].id != batch.id
+    assert download_jobs.job_to_dict(db, batch)["tracks_total"] == 2
+
+
+def test_failed_job_is_retried_then_marked_failed(db):
+    calls = []
+
+    async def flaky(session, job, progress):
+        calls.append(job.attempts)
+        raise RuntimeError("upstream down")
+
+    async def scenario():
+        job, _ = download_jobs.enqueue(db, 1, TRACK)
+        for _ in range(download_jobs.MAX_ATTEMPTS):
+            job_id = await asyncio.wait_for(download_jobs._queue.get(), 1)
+            await download_jobs._perform(job_id, {"track": flaky})
+        return job.id
+
+    job_id = asyncio.run(scenario())
+    db.expire_all()
+    job = download_jobs.get_job(db, job_id)
+    assert calls == list(range(1, download_jobs.MAX_ATTEMPTS + 1))
+    assert job.status == "failed"
+    assert job.error == "upstream down"
+    assert download_jobs._stats["retried"] == download_jobs.MAX_ATTEMPTS - 1
+    assert download_jobs._stats["failed"] == 1
+
+
+def test_retry_succeeds_and_records_the_message(db):
+    async def second_time_lucky(session, job, progress):
+        progress.update(stage="uploading", bytes_sent=5, bytes_total=10)
+        if job.attempts == 1:
+            raise RuntimeError("timeout")
+        return 99
+
+    async def scenario():
+        job, _ = download_jobs.enqueue(db, 1, TRACK)
+        for _ in range(2):
+            job_id = await asyncio.wait_for(download_jobs._queue.get(), 1)
+            await download_jobs._perform(job_id, {"track": second_time_lucky})
+        return job.id
+
+    job_id = asyncio.run(scenario())
+    db.expire_all()
+    job = download_jobs.get_job(db, job_id)
+    assert (job.status, job.attempts, job.message_id, job.error) == ("done", 2, 99, None)
+    assert "progress" not in download_jobs.job_to_dict(db, job)
+
+
+def test_restore_resumes_interrupted_jobs_and_drops_old_ones(db):
+    queued, _ = download_jobs.enqueue(db, 1, TRACK)
+    running, _ = download_jobs.enqueue(db, 2, TRACK)
+    old, _ = download_jobs.enqueue(db, 3, TRACK)
+    running.status = "running"
+    old.status = "done"
+    old.finished_at = datetime.utcnow() - timedelta(days=download_jobs.RETENTION_DAYS + 1)
+    db.commit()
+    queued_id, running_id, old_id = queued.id, running.id, old.id
+    while not download_jobs._queue.empty():
+        download_jobs._queue.get_nowait()  # a restart starts with an empty queue
+
+    download_jobs._restore()
+
+    db.expire_all()
+    assert download_jobs.get_job(db, running_id).status == "queued"
+    assert download_jobs.get_job(db, old_id) is None
+    resumed = [download_jobs._queue.get_nowait() for _ in range(download_jobs._queue.qsize())]
+    assert sorted(resumed) == sorted([queued_id, running_id])
+    assert download_jobs._stats["resumed"] == 2
+
+
+def test_job_taken_by_another_worker_is_skipped(db):
+    async def never(session, job, progress):
+        raise AssertionError("must not run")
+
+    job, _ = download_jobs.enqueue(db, 1, TRACK)
+    job.status = "running"
+    db.commit()
+    asyncio.run(download_jobs._perform(job.id, {"track": never}))
+    db.expire_all()
+    assert download_jobs.get_job(db, job.id).attempts in (None, 0)
@@ -0,0 +1,36 @@
+"""
+Unit tests for signed stream handles.
+"""
+
+try:
+    from backend.stream_handles import SIGNATURE_BYTES, make_handle, parse_handle
+except ImportError:
+    from stream_handles import SIGNATURE_BYTES, make_handle, parse_handle
+
+
+def test_round_trip():
+    handle = make_handle("12345")
+    track_id, _, signature = handle.rpartition(".")
+    assert track_id == "12345"
+    assert len(signature) == SIGNATURE_BYTES * 4 // 3
+    assert parse_handle(handle) == "12345"
+
+
+def test_track_ids_with_dots_and_prefixes():
+    for track_id in ("yt_dQw4w9WgXcQ", "a.b.c"):
+        assert parse_handle(make_handle(track_id)) == track_id
+
+
+def test_handles_are_url_safe():
+    handle = make_handle("track-with-a-long-id-0001")
+    assert all(ch.isalnum() or ch in "-_." for ch in handle)
+
+
+def test_forged_handles_are_rejected():
+    handle = make_handle("12345")
+    signature = handle.rpartition(".")[2]
+    assert parse_handle(f"12346.{signature}") is None
+    assert parse_handle(handle[:-1] + ("A" if handle[-1] != "A" else "B")) is None
+    assert parse_handle("12345") is None
+    assert parse_handle(f".{signature}") is None
+    assert parse_handle("") is None
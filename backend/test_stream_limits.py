@@ -0,0 +1,161 @@
+"""
+Unit tests for per-user / per-IP stream limits and Telegram initData checks.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+from urllib.parse import urlencode
+
+import pytest
+from starlette.requests import Request
+
+try:
+    from backend import stream_limits
+    from backend.stream_limits import StreamLease, StreamLimitExceeded, TokenBucket, _Identity, acquire_stream, client_ip
+    from backend.telegram_auth import verify_init_data
+except ImportError:
+    import stream_limits
+    from stream_limits import StreamLease, StreamLimitExceeded, TokenBucket, _Identity, acquire_stream, client_ip
+    from telegram_auth import verify_init_data
+
+BOT_TOKEN = "123456:TEST"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _request(host, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (host, 5000), "headers": headers})
+
+
+def _init_data(user_id, auth_date, bot_token=BOT_TOKEN):
+    fields = {"auth_date": str(auth_date), "query_id": "AAE", "user": json.dumps({"id": user_id, "first_name": "T"})}
+    data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+@pytest.fixture(autouse=True)
+def fresh_identities(monkeypatch):
+    monkeypatch.setattr(stream_limits, "_identities", {})
+    monkeypatch.setattr(stream_limits, "STREAM_LIMITS_ENABLED", True)
+
+
+def test_token_bucket_burst_then_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(stream_limits, "time", clock)
+    bucket = TokenBucket(rate=100, capacity=200)
+
+    assert bucket.reserve(200) == 0.0  # the burst passes at once
+    assert bucket.reserve(50) == pytest.approx(0.5)  # then the rate applies
+    clock.now += 0.5
+    assert bucket.reserve(50) == pytest.approx(0.5)
+    clock.now += 60
+    assert bucket.reserve(0) == 0.0
+    assert bucket.tokens == pytest.approx(200)  # refill stops at capacity
+
+
+def test_slot_is_handed_to_the_first_waiter():
+    async def scenario():
+        identity = _Identity("ip:test", max_streams=1, rate=1000)
+        assert await identity.acquire(1)
+        first = asyncio.create_task(identity.acquire(1))
+        second = asyncio.create_task(identity.acquire(1))
+        await asyncio.sleep(0)
+        assert len(identity.waiters) == 2
+
+        identity.release()
+        assert await first
+        assert not second.done()
+        assert identity.active == 1
+
+        identity.release()
+        assert await second
+        identity.release()
+        assert identity.idle()
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_and_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        identity = _Identity("ip:test", max_streams=1, rate=1000)
+        assert await identity.acquire(1)
+        assert not await identity.acquire(0.01)
+        assert not identity.waiters
+
+        waiting = asyncio.create_task(identity.acquire(1))
+        await asyncio.sleep(0)
+        waiting.cancel()  # the client went away while queued
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not identity.waiters
+
+        identity.release()
+        assert identity.idle()
+
+    asyncio.run(scenario())
+
+
+def test_lease_releases_once():
+    async def scenario():
+        identity = _Identity("ip:test", max_streams=2, rate=1000)
+        await identity.acquire(1)
+        lease = StreamLease([identity])
+        lease.release()
+        lease.release()
+        assert identity.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_acquire_stream_limits_per_user_and_ip(monkeypatch):
+    monkeypatch.setattr(stream_limits, "MAX_STREAMS_PER_USER", 1)
+    monkeypatch.setattr(stream_limits, "MAX_STREAMS_PER_IP", 2)
+    monkeypatch.setattr(stream_limits, "QUEUE_SECONDS", 0.01)
+
+    async def scenario():
+        lease = await acquire_stream(_request("10.0.0.1"), user_id=7)
+        with pytest.raises(StreamLimitExceeded):
+            await acquire_stream(_request("10.0.0.2"), user_id=7)
+        # The failed attempt did not keep the IP slot of 10.0.0.2
+        assert stream_limits._identities["ip:10.0.0.2"].active == 0
+
+        other = await acquire_stream(_request("10.0.0.1"))
+        with pytest.raises(StreamLimitExceeded):
+            await acquire_stream(_request("10.0.0.1"))
+        lease.release()
+        other.release()
+        assert all(identity.idle() for identity in stream_limits._identities.values())
+
+    asyncio.run(scenario())
+
+
+def test_client_ip_trusts_forwarded_for_only_from_proxies():
+    assert client_ip(_request("203.0.113.5", "1.2.3.4")) == "203.0.113.5"
+    assert client_ip(_request("127.0.0.1", "1.2.3.4")) == "1.2.3.4"
+    # A spoofed left-most hop is ignored: the first untrusted hop from the right wins
+    assert client_ip(_request("127.0.0.1", "6.6.6.6, 1.2.3.4, 127.0.0.1")) == "1.2.3.4"
+
+
+def test_init_data_identifies_the_user():
+    assert verify_init_data(_init_data(42, 1000), BOT_TOKEN, now=1060) == 42
+
+
+def test_init_data_rejects_forgeries_and_old_data():
+    valid = _init_data(42, 1000)
+    assert verify_init_data(valid.replace("42", "43"), BOT_TOKEN, now=1060) is None
+    assert verify_init_data(_init_data(42, 1000, bot_token="999:OTHER"), BOT_TOKEN, now=1060) is None
+    assert verify_init_data(valid, BOT_TOKEN, now=1000 + 10 ** 6) is None
+    assert verify_init_data("user=%7B%22id%22%3A42%7D", BOT_TOKEN, now=1060) is None
+    assert verify_init_data("", BOT_TOKEN) is None
+    assert verify_init_data(valid, "", now=1060) is None
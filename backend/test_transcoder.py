@@ -0,0 +1,108 @@
+"""
+Unit tests for the transcoder: the on-disk cache, serving a finished encode
+and falling back when the source stalls. A shell script that copies stdin
+to stdout stands in for ffmpeg.
+"""
+
+import asyncio
+import os
+import stat
+
+import pytest
+
+try:
+    from backend import transcoder
+    from backend.audio_cache import FileSegment
+    from backend.transcoder import TranscodeCache
+except ImportError:
+    import transcoder
+    from audio_cache import FileSegment
+    from transcoder import TranscodeCache
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="fake ffmpeg is a shell script")
+
+AUDIO = b"ID3" + bytes(range(256)) * 8
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text("#!/bin/sh\nexec cat\n")
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    cache = TranscodeCache(str(tmp_path / "cache"), 10 * 1024)
+    monkeypatch.setattr(transcoder, "FFMPEG_PATH", str(ffmpeg))
+    monkeypatch.setattr(transcoder, "transcode_cache", cache)
+    monkeypatch.setattr(transcoder, "_jobs", {})
+    monkeypatch.setattr(transcoder, "_slots", asyncio.Semaphore(1))
+    monkeypatch.setattr(transcoder, "_stats", dict.fromkeys(transcoder._stats, 0))
+    monkeypatch.setattr(transcoder, "FIRST_OUTPUT_TIMEOUT", 0.3)
+    return cache
+
+
+async def _source():
+    for offset in range(0, len(AUDIO), 500):
+        await asyncio.sleep(0.01)
+        yield AUDIO[offset:offset + 500]
+
+
+async def _stalled_source():
+    await asyncio.sleep(60)
+    yield b""
+
+
+async def _drain(response):
+    data = b""
+    async for part in response["body"]:
+        if isinstance(part, FileSegment):
+            with open(part.path, "rb") as f:
+                f.seek(part.offset)
+                part = f.read(part.count)
+        data += part
+    return data
+
+
+def test_load_drops_interrupted_encodes_and_evicts_over_quota(tmp_path):
+    root = tmp_path / "cache"
+    root.mkdir()
+    for index, name in enumerate(["old.mp3", "new.mp3"]):
+        (root / name).write_bytes(b"x" * 600)
+        os.utime(root / name, (1000 + index, 1000 + index))
+    (root / "running.mp3.tmp").write_bytes(b"x")
+
+    cache = TranscodeCache(str(root), 1000)
+    asyncio.run(cache.load())
+
+    assert sorted(os.listdir(root)) == ["new.mp3"]
+    assert cache.total_bytes == 600
+    assert cache.lookup(str(root / "new.mp3")) == 600
+
+
+def test_encode_is_streamed_then_served_from_cache(cache):
+    async def scenario():
+        first = await transcoder.transcode("track:1", "low", _source)
+        assert first["size"] is None
+        assert await _drain(first) == AUDIO
+        await asyncio.sleep(0.1)  # the job renames its output when done
+
+        second = await transcoder.transcode("track:1", "low", _source, "bytes=3-")
+        assert second["size"] == len(AUDIO)
+        assert second["range"] == (3, len(AUDIO) - 1)
+        assert await _drain(second) == AUDIO[3:]
+
+    asyncio.run(scenario())
+    assert transcoder._stats["jobs_started"] == 1
+    assert transcoder._stats["cache_hits"] == 1
+    assert cache.total_bytes == len(AUDIO)
+
+
+def test_stalled_source_falls_back_and_frees_the_slot(cache):
+    async def scenario():
+        assert await transcoder.transcode("track:2", "low", _stalled_source) is None
+        await asyncio.sleep(0.1)  # let the cancelled job clean up
+        assert transcoder._slots._value == 1
+        assert not transcoder._jobs
+
+    asyncio.run(scenario())
+    assert transcoder._stats["first_output_timeouts"] == 1
+    assert transcoder._stats["fallbacks"] == 1
+    assert os.listdir(cache.root) == []
@@ -0,0 +1,183 @@
+"""
+Thumbnails for audio sent to Telegram.
+
+Telegram accepts an audio thumbnail only as a JPEG of at most 320x320 px
+and 200 KB; cover art from iTunes (600x600) or Deezer (cover_xl) is larger
+and used to be uploaded as is. get_thumbnail() fetches the cover, scales it
+down to MAX_SIZE and re-encodes it under MAX_BYTES once, and keeps the
+result in an in-memory LRU keyed by cover URL, so an album or a popular
+track is prepared only once. Concurrent requests for the same cover (tracks
+of one album in a batch) share a single fetch.
+
+Known cover CDNs are asked for a small rendition directly. Resizing needs
+Pillow; without it a cover is used only if it already is a JPEG within
+MAX_BYTES.
+"""
+
+import asyncio
+import io
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Configuration
+MAX_SIZE = 320  # px, Telegram's limit for each side
+MAX_BYTES = 200 * 1024  # Telegram's limit
+JPEG_QUALITIES = (85, 75, 65, 50, 35)
+CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", "32")) * 1024 * 1024
+FAILURE_TTL = 300  # seconds a cover that could not be prepared is not retried
+
+# iTunes ".../600x600bb.jpg", Deezer ".../1000x1000-000000-80-0-0.jpg"
+_SIZED_COVER = re.compile(r"/\d{2,4}x\d{2,4}(bb|-[\w-]+)?\.jpg$")
+_SIZED_COVER_HOSTS = ("mzstatic.com", "dzcdn.net")
+
+# Storage
+# Format: cover URL -> prepared JPEG bytes, least recently used first
+_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_cache_bytes = 0
+# Format: cover URL -> monotonic time of the failure
+_failures: Dict[str, float] = {}
+# Format: cover URL -> fetch in progress
+_in_flight: Dict[str, "asyncio.Future[Optional[bytes]]"] = {}
+
+# Statistics
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "shared_fetches": 0,  # waited for a fetch of the same cover already running
+    "failures": 0,
+    "resized": 0,
+    "passed_through": 0,  # already a small enough JPEG
+    "source_bytes": 0,
+    "prepared_bytes": 0
+}
+
+
+def _small_cover_url(url: str) -> str:
+    """Asks iTunes/Deezer for a MAX_SIZE rendition instead of the full-size cover"""
+    if any(host in url for host in _SIZED_COVER_HOSTS):
+        return _SIZED_COVER.sub(lambda m: f"/{MAX_SIZE}x{MAX_SIZE}{m.group(1) or ''}.jpg", url)
+    return url
+
+
+def _is_jpeg(data: bytes) -> bool:
+    return data[:3] == b"\xff\xd8\xff"
+
+
+def _prepare(data: bytes) -> Optional[bytes]:
+    """Scales the image to fit MAX_SIZE and encodes it as a JPEG within MAX_BYTES (blocking)"""
+    if Image is None:
+        if _is_jpeg(data) and len(data) <= MAX_BYTES:
+            _stats["passed_through"] += 1
+            return data
+        return None
+
+    with Image.open(io.BytesIO(data)) as image:
+        if (image.format == "JPEG" and max(image.size) <= MAX_SIZE
+                and len(data) <= MAX_BYTES and image.mode in ("RGB", "L")):
+            _stats["passed_through"] += 1
+            return data
+        image = image.convert("RGB")
+        image.thumbnail((MAX_SIZE, MAX_SIZE), Image.LANCZOS)
+        for quality in JPEG_QUALITIES:
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=quality, optimize=True)
+            if output.tell() <= MAX_BYTES:
+                _stats["resized"] += 1
+                return output.getvalue()
+    return None
+
+
+def _store(url: str, data: bytes) -> None:
+    global _cache_bytes
+    _cache[url] = data
+    _cache_bytes += len(data)
+    while _cache_bytes > CACHE_MAX_BYTES and _cache:
+        _, evicted = _cache.popitem(last=False)
+        _cache_bytes -= len(evicted)
+
+
+async def _fetch(url: str) -> Optional[bytes]:
+    small_url = _small_cover_url(url)
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
+        response = await client.get(small_url)
+        if response.status_code != 200 and small_url != url:
+            response = await client.get(url)  # the CDN has no such rendition
+        if response.status_code != 200:
+            return None
+    _stats["source_bytes"] += len(response.content)
+    # Декодирование и сжатие - в отдельном потоке, чтобы не блокировать event loop
+    return await asyncio.to_thread(_prepare, response.content)
+
+
+async def get_thumbnail(image_url: Optional[str]) -> Optional[bytes]:
+    """
+    Returns the cover at image_url as a Telegram-ready JPEG thumbnail,
+    or None if there is none or it could not be prepared.
+    """
+    if not image_url:
+        return None
+
+    data = _cache.get(image_url)
+    if data is not None:
+        _cache.move_to_end(image_url)
+        _stats["hits"] += 1
+        return data
+
+    failed_at = _failures.get(image_url)
+    if failed_at is not None:
+        if time.monotonic() - failed_at < FAILURE_TTL:
+            return None
+        del _failures[image_url]
+
+    pending = _in_flight.get(image_url)
+    if pending is not None:
+        _stats["shared_fetches"] += 1
+        return await asyncio.shield(pending)
+
+    _stats["misses"] += 1
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[image_url] = future
+    data = None
+    try:
+        data = await _fetch(image_url)
+    except Exception as e:
+        print(f"Failed to prepare thumbnail: {e}")
+    finally:
+        del _in_flight[image_url]
+        future.set_result(data)
+
+    if data is None:
+        _stats["failures"] += 1
+        if len(_failures) > 1000:
+            _failures.clear()
+        _failures[image_url] = time.monotonic()
+        return None
+
+    _stats["prepared_bytes"] += len(data)
+    _store(image_url, data)
+    return data
+
+
+def get_thumbnail_stats() -> Dict[str, Any]:
+    """
+    Returns thumbnail cache statistics.
+    """
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        "pillow_available": Image is not None,
+        "cached": len(_cache),
+        "cache_bytes": _cache_bytes,
+        "cache_max_bytes": CACHE_MAX_BYTES,
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0,
+        **_stats
+    }
@@ -0,0 +1,221 @@
+"""
+Track registry.
+
+Every track returned by search, genre or YouTube info is registered here so it
+can later be resolved by ID in O(1). Entries live in an in-memory LRU and are
+persisted to the `tracks` table, so favorites and playlists survive restarts.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    from backend.database import TrackRecord, SessionLocal
+except ImportError:
+    from database import TrackRecord, SessionLocal
+
+# Configuration
+MAX_MEMORY_TRACKS = int(os.getenv("TRACK_REGISTRY_MAX_MEMORY", "50000"))
+URL_TTL = int(os.getenv("TRACK_URL_TTL", str(6 * 3600)))  # seconds until a Hitmo URL is re-resolved
+
+# Storage
+# Format: track_id -> {id, title, artist, duration, url, image, source, url_resolved_at}
+_tracks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# Statistics
+_stats = {
+    "registered": 0,
+    "memory_hits": 0,
+    "db_hits": 0,
+    "misses": 0,
+    "url_refreshes": 0,
+    "url_refresh_failures": 0
+}
+
+
+def _detect_source(track_id: str, url: str) -> str:
+    if track_id.startswith("yt_") or "youtube.com" in url or "youtu.be" in url:
+        return "youtube"
+    return "hitmo"
+
+
+def _remember(entry: Dict[str, Any]) -> None:
+    _tracks[entry["id"]] = entry
+    _tracks.move_to_end(entry["id"])
+    while len(_tracks) > MAX_MEMORY_TRACKS:
+        _tracks.popitem(last=False)
+
+
+def _record_to_entry(record: TrackRecord) -> Dict[str, Any]:
+    resolved_at = record.url_resolved_at.timestamp() if record.url_resolved_at else 0
+    return {
+        "id": record.id,
+        "title": record.title,
+        "artist": record.artist,
+        "duration": record.duration or 0,
+        "url": record.url,
+        "image": record.image or "",
+        "source": record.source or "hitmo",
+        "url_resolved_at": resolved_at
+    }
+
+
+def register_tracks(tracks: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Registers parsed tracks (with their original upstream URLs).
+    Unchanged tracks only refresh url_resolved_at in memory; new or changed
+    tracks are written to the database in a single transaction.
+    Returns the entries of tracks that were not registered before.
+    """
+    now = time.time()
+    changed = []
+    seen = set()  # already in memory
+    batch = set()
+
+    for track in tracks:
+        track_id = track.get("id")
+        url = track.get("url")
+        if not track_id or not url:
+            continue
+
+        entry = {
+            "id": track_id,
+            "title": track.get("title", ""),
+            "artist": track.get("artist", ""),
+            "duration": track.get("duration") or 0,
+            "url": url,
+            "image": track.get("image") or "",
+            "source": _detect_source(track_id, url),
+            "url_resolved_at": now
+        }
+
+        previous = _tracks.get(track_id)
+        if previous is not None and track_id not in batch:
+            seen.add(track_id)
+        batch.add(track_id)
+        if previous is None or any(previous[k] != entry[k] for k in ("title", "artist", "url", "image")):
+            changed.append(entry)
+        _remember(entry)
+
+    if not changed:
+        return []
+
+    _stats["registered"] += len(changed)
+    added = []
+    db = SessionLocal()
+    try:
+        # Треки, которых нет в памяти, могут уже быть в базе (после рестарта или вытеснения)
+        unseen = [entry["id"] for entry in changed if entry["id"] not in seen]
+        known = set()
+        if unseen:
+            known = {row[0] for row in db.query(TrackRecord.id).filter(TrackRecord.id.in_(unseen)).all()}
+        added = list({
+            entry["id"]: entry for entry in changed if entry["id"] not in seen and entry["id"] not in known
+        }.values())
+
+        for entry in changed:
+            db.merge(TrackRecord(
+                id=entry["id"],
+                title=entry["title"],
+                artist=entry["artist"],
+                duration=entry["duration"],
+                url=entry["url"],
+                image=entry["image"],
+                source=entry["source"],
+                url_resolved_at=datetime.utcfromtimestamp(entry["url_resolved_at"]),
+                updated_at=datetime.utcnow()
+            ))
+        db.commit()
+    except Exception as e:
+        print(f"❌ Failed to persist tracks: {e}")
+        db.rollback()
+    finally:
+        db.close()
+    return added
+
+
+def register_track(track: Dict[str, Any]) -> None:
+    register_tracks([track])
+
+
+def get_track(track_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the registered track (memory first, then database) or None.
+    """
+    entry = _tracks.get(track_id)
+    if entry is not None:
+        _tracks.move_to_end(track_id)
+        _stats["memory_hits"] += 1
+        return entry
+
+    db = SessionLocal()
+    try:
+        record = db.query(TrackRecord).filter(TrackRecord.id == track_id).first()
+    finally:
+        db.close()
+
+    if record is None:
+        _stats["misses"] += 1
+        return None
+
+    _stats["db_hits"] += 1
+    entry = _record_to_entry(record)
+    _remember(entry)
+    return entry
+
+
+def is_url_stale(entry: Dict[str, Any]) -> bool:
+    """
+    YouTube tracks keep the original watch URL, which never expires.
+    Hitmo download links are re-resolved once they are older than URL_TTL.
+    """
+    if entry["source"] != "hitmo":
+        return False
+    return time.time() - entry["url_resolved_at"] > URL_TTL
+
+
+async def resolve_track(
+    track_id: str,
+    parser,
+    user_agent: Optional[str] = None,
+    force: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Returns the registered track, re-resolving its stream URL through the
+    parser when it has gone stale (or unconditionally with force=True, after
+    the upstream rejected the URL). If the track can no longer be found
+    upstream, the last known entry is returned unchanged.
+    """
+    entry = get_track(track_id)
+    if entry is None or not (force or is_url_stale(entry)):
+        return entry
+
+    try:
+        candidates = await parser.search(f"{entry['artist']} {entry['title']}", limit=48, user_agent=user_agent)
+    except Exception as e:
+        print(f"Track re-resolve error for {track_id}: {e}")
+        candidates = []
+
+    for candidate in candidates:
+        if candidate.get("id") == track_id:
+            _stats["url_refreshes"] += 1
+            register_tracks(candidates)
+            return _tracks[track_id]
+
+    _stats["url_refresh_failures"] += 1
+    return entry
+
+
+def get_registry_stats() -> Dict[str, Any]:
+    """
+    Returns current registry statistics.
+    """
+    return {
+        "memory_entries": len(_tracks),
+        "max_memory_entries": MAX_MEMORY_TRACKS,
+        "url_ttl_seconds": URL_TTL,
+        **_stats
+    }
@@ -0,0 +1,384 @@
+"""
+On-the-fly transcoding to lower bitrates for /api/stream?quality=...
+
+The original file is piped through ffmpeg, and the encoded output is streamed
+to the client while it is produced. The same output is written to a disk
+cache, so each (track, quality) pair is encoded only once. Requests that
+arrive while an encode is running follow the growing output file instead of
+starting another ffmpeg. A semaphore caps concurrent ffmpeg processes to
+protect the CPU; when no slot frees up in time, the caller falls back to the
+original file. The response starts only once the encode has produced output,
+so an encode that fails early (e.g. the source link expired) or produces
+nothing within FIRST_OUTPUT_TIMEOUT (stalled source) also falls back to the
+original instead of sending an empty 200. File I/O and the startup scan of
+the cache directory run in worker threads.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+import anyio
+
+try:
+    from backend.audio_cache import FileSegment, parse_range
+except ImportError:
+    from audio_cache import FileSegment, parse_range
+
+# Configuration
+TRANSCODE_ENABLED = os.getenv("TRANSCODE_ENABLED", "1") == "1"
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+MAX_JOBS = int(os.getenv("TRANSCODE_MAX_JOBS", "2"))  # concurrent ffmpeg processes
+QUEUE_TIMEOUT = float(os.getenv("TRANSCODE_QUEUE_TIMEOUT", "5"))  # wait for a free slot before falling back
+# Wait for the first encoded bytes before the encode is killed and the original served
+FIRST_OUTPUT_TIMEOUT = float(os.getenv("TRANSCODE_FIRST_OUTPUT_TIMEOUT", "15"))
+# Relative paths are resolved against backend/, whatever the working directory
+TRANSCODE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("TRANSCODE_CACHE_DIR", "transcode_cache"))
+TRANSCODE_CACHE_MAX_BYTES = int(os.getenv("TRANSCODE_CACHE_MAX_MB", "512")) * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+# quality -> encoder settings
+QUALITY_PRESETS: Dict[str, Dict[str, Any]] = {
+    "low": {"codec": "libopus", "bitrate": "48k", "format": "ogg", "ext": "ogg", "media_type": "audio/ogg"},
+    "medium": {"codec": "libopus", "bitrate": "96k", "format": "ogg", "ext": "ogg", "media_type": "audio/ogg"},
+    # AAC for clients without Opus support (older iOS)
+    "aac-low": {"codec": "aac", "bitrate": "64k", "format": "adts", "ext": "aac", "media_type": "audio/aac"},
+    "aac-medium": {"codec": "aac", "bitrate": "128k", "format": "adts", "ext": "aac", "media_type": "audio/aac"},
+}
+
+Source = Callable[[], AsyncIterator[bytes]]
+
+# Statistics
+_stats = {
+    "jobs_started": 0,
+    "jobs_completed": 0,
+    "jobs_failed": 0,
+    "cache_hits": 0,
+    "joined_running": 0,  # requests that followed an encode already in progress
+    "fallbacks": 0,  # no free slot: original served instead
+    "first_output_timeouts": 0,  # killed: no output in time
+    "bytes_in": 0,
+    "bytes_out": 0
+}
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_PATH) is not None
+
+
+class TranscodeJob:
+    """One ffmpeg run writing to a temporary file that readers can follow"""
+
+    def __init__(self, key: str, preset: Dict[str, Any], tmp_path: str, final_path: str):
+        self.key = key
+        self.preset = preset
+        self.tmp_path = tmp_path
+        self.final_path = final_path
+        self.written = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.task: Optional[asyncio.Task] = None
+        self._progress = asyncio.Condition()
+
+    async def run(self, source: Source, slots: asyncio.Semaphore) -> None:
+        preset = self.preset
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+                "-i", "pipe:0", "-vn",
+                "-c:a", preset["codec"], "-b:a", preset["bitrate"],
+                "-f", preset["format"], "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            feeder = asyncio.create_task(self._feed(process, source))
+            try:
+                out = await anyio.to_thread.run_sync(open, self.tmp_path, "wb")
+                try:
+                    while True:
+                        chunk = await process.stdout.read(READ_SIZE)
+                        if not chunk:
+                            break
+                        await anyio.to_thread.run_sync(_append, out, chunk)
+                        async with self._progress:
+                            self.written += len(chunk)
+                            self._progress.notify_all()
+                finally:
+                    await anyio.to_thread.run_sync(out.close)
+                await feeder
+                if await process.wait() != 0:
+                    raise IOError(f"ffmpeg exited with code {process.returncode}")
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                feeder.cancel()
+
+            await anyio.to_thread.run_sync(os.replace, self.tmp_path, self.final_path)
+            _stats["jobs_completed"] += 1
+            _stats["bytes_out"] += self.written
+            await transcode_cache.added(self.final_path, self.written)
+        except asyncio.CancelledError:
+            self.error = IOError("Transcode cancelled")
+            await anyio.to_thread.run_sync(_remove_files, [self.tmp_path])
+            raise
+        except Exception as e:
+            _stats["jobs_failed"] += 1
+            self.error = e
+            print(f"❌ Transcode failed for {self.key}: {e}")
+            await anyio.to_thread.run_sync(_remove_files, [self.tmp_path])
+        finally:
+            slots.release()
+            _jobs.pop(self.key, None)
+            async with self._progress:
+                self.done = True
+                self._progress.notify_all()
+
+    async def _feed(self, process, source: Source) -> None:
+        try:
+            async for chunk in source():
+                _stats["bytes_in"] += len(chunk)
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    async def wait_output(self) -> None:
+        """Waits until the encode has produced output or finished"""
+        async with self._progress:
+            await self._progress.wait_for(lambda: self.written > 0 or self.done)
+
+    async def follow(self) -> AsyncIterator[bytes]:
+        """
+        Returns an iterator over the output from the start, waiting for
+        ffmpeg as needed. The file is opened right away: a job that has just
+        finished has already renamed its output to final_path. Raises
+        OSError if neither file exists (the encode failed).
+        """
+        return self._follow(await anyio.to_thread.run_sync(self._open))
+
+    def _open(self) -> BinaryIO:
+        try:
+            return open(self.tmp_path, "rb")
+        except FileNotFoundError:
+            return open(self.final_path, "rb")
+
+    async def _follow(self, f: BinaryIO) -> AsyncIterator[bytes]:
+        offset = 0
+        try:
+            while True:
+                async with self._progress:
+                    await self._progress.wait_for(lambda: self.written > offset or self.done)
+                    available = self.written
+                    done = self.done
+                if self.error:
+                    raise self.error
+                if available > offset:
+                    # The file handle stays valid after the rename on completion
+                    data = await anyio.to_thread.run_sync(_read_at, f, offset, available - offset)
+                    offset += len(data)
+                    yield data
+                elif done:
+                    return
+        finally:
+            f.close()
+
+
+class TranscodeCache:
+    """Finished encodes on disk, evicted least-recently-used over the quota"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._files: Dict[str, int] = {}  # path -> size, least recently used first
+        self.total_bytes = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name.endswith(".tmp"):
+                    os.remove(path)  # interrupted encode
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path, stat.st_size))
+        return sorted(found)
+
+    async def load(self) -> None:
+        """Picks up finished encodes from disk (oldest first) in a worker thread"""
+        found = await anyio.to_thread.run_sync(self._scan)
+        # Encodes finished while the scan ran are the most recent ones
+        added = self._files
+        self._files = {path: size for _, path, size in found if path not in added}
+        self._files.update(added)
+        self.total_bytes = sum(self._files.values())
+        await self._evict()
+
+    def path_for(self, key: str) -> str:
+        quality = key.rsplit(".", 1)[1]
+        return os.path.join(self.root, f"{key}.{QUALITY_PRESETS[quality]['ext']}")
+
+    def lookup(self, path: str) -> Optional[int]:
+        size = self._files.pop(path, None)
+        if size is not None:
+            self._files[path] = size  # move to the most recently used end
+        return size
+
+    async def added(self, path: str, size: int) -> None:
+        self.total_bytes += size - self._files.pop(path, 0)
+        self._files[path] = size
+        await self._evict()
+
+    async def _evict(self) -> None:
+        victims = []
+        while self.total_bytes > self.max_bytes and len(self._files) > 1:
+            oldest = next(iter(self._files))
+            self.total_bytes -= self._files.pop(oldest)
+            victims.append(oldest)
+        if victims:
+            await anyio.to_thread.run_sync(_remove_files, victims)
+
+
+def _append(f: BinaryIO, data: bytes) -> None:
+    f.write(data)
+    f.flush()
+
+
+def _read_at(f: BinaryIO, offset: int, count: int) -> bytes:
+    f.seek(offset)
+    return f.read(count)
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Running encodes: cache key -> job
+_jobs: Dict[str, TranscodeJob] = {}
+_slots = asyncio.Semaphore(MAX_JOBS)
+
+# Files already on disk are picked up by load() at startup
+transcode_cache: Optional[TranscodeCache] = None
+if TRANSCODE_ENABLED:
+    try:
+        transcode_cache = TranscodeCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES)
+    except OSError as e:
+        print(f"❌ Transcode cache disabled: {e}")
+
+
+async def transcode(
+    identity: str,
+    quality: str,
+    source: Source,
+    range_header: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Returns {"body", "media_type", "size", "range"} for the encoded file, or
+    None if the original should be served instead.
+
+    A finished encode is served from disk with Range support; a running or
+    new encode is streamed from the start with unknown size.
+    """
+    if transcode_cache is None or quality not in QUALITY_PRESETS or not ffmpeg_available():
+        return None
+
+    preset = QUALITY_PRESETS[quality]
+    key = f"{hashlib.sha256(identity.encode('utf-8')).hexdigest()}.{quality}"
+    final_path = transcode_cache.path_for(key)
+
+    cached = _from_cache(final_path, preset, range_header)
+    if cached is not None:
+        return cached
+
+    job = _jobs.get(key)
+    if job is None:
+        try:
+            await asyncio.wait_for(_slots.acquire(), timeout=QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            _stats["fallbacks"] += 1
+            return None
+        # Another request may have started or finished this encode while we waited
+        job = _jobs.get(key)
+        cached = _from_cache(final_path, preset, range_header) if job is None else None
+        if job is not None or cached is not None:
+            _slots.release()
+        if cached is not None:
+            return cached
+
+    if job is not None:
+        _stats["joined_running"] += 1
+    else:
+        # The job opens its output file itself; readers open it after the first output
+        job = TranscodeJob(key, preset, f"{final_path}.tmp", final_path)
+        _jobs[key] = job
+        _stats["jobs_started"] += 1
+        job.task = asyncio.create_task(job.run(source, _slots))
+
+    try:
+        await asyncio.wait_for(job.wait_output(), timeout=FIRST_OUTPUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        # Source stalled: stop ffmpeg and free its slot for other encodes
+        _stats["first_output_timeouts"] += 1
+        print(f"⏱️ Transcode {key}: no output in {FIRST_OUTPUT_TIMEOUT:.0f}s, serving the original")
+        if job.task and not job.done:
+            job.task.cancel()
+    if job.written == 0:
+        _stats["fallbacks"] += 1
+        return None
+    try:
+        body = await job.follow()
+    except OSError:
+        # Finished and already evicted from the cache, or failed
+        _stats["fallbacks"] += 1
+        return None
+    return {"body": body, "media_type": preset["media_type"], "size": None, "range": None}
+
+
+def _from_cache(final_path: str, preset: Dict[str, Any], range_header: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Finished encode from disk, or None if it is not cached"""
+    size = transcode_cache.lookup(final_path)
+    if size is None or not os.path.exists(final_path):
+        return None
+    _stats["cache_hits"] += 1
+    try:
+        selected = parse_range(range_header, size)
+    except ValueError:
+        selected = None  # unsupported range: send the whole file
+    start, end = selected or (0, size - 1)
+    return {
+        "body": _segments(final_path, start, end),
+        "media_type": preset["media_type"],
+        "size": size,
+        "range": selected
+    }
+
+
+async def _segments(path: str, start: int, end: int) -> AsyncIterator[Union[bytes, FileSegment]]:
+    yield FileSegment(path, start, end - start + 1)
+
+
+def get_transcoder_stats() -> Dict[str, Any]:
+    """
+    Returns current transcoder statistics.
+    """
+    return {
+        "enabled": transcode_cache is not None,
+        "ffmpeg_available": ffmpeg_available(),
+        "running_jobs": len(_jobs),
+        "max_jobs": MAX_JOBS,
+        "cached_files": len(transcode_cache._files) if transcode_cache else 0,
+        "disk_usage_bytes": transcode_cache.total_bytes if transcode_cache else 0,
+        "qualities": list(QUALITY_PRESETS),
+        **_stats
+    }